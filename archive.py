@@ -0,0 +1,444 @@
+"""
+Archives of many drawings in a single file.
+
+An archive starts with a fixed size header, followed by the cells of every
+drawing, packed by cellpack.pack_cells, and ends with an index holding one
+fixed size record per drawing: its name, the digest of the reference it was
+drawn from, when it was created and modified, its size, palette, where its
+cells are, its perceptual hash and a small thumbnail. Archives are read
+through mmap, and the index is used in place, so listing, previewing or
+exporting any subset of an archive only touches the bytes of the drawings
+involved, e.g.
+
+    python3 archive.py pack photos.prar drawings/*.poprev --skip-duplicates
+    python3 archive.py pack mario.prar mario.poprev -r refs/mario.jpg
+    python3 archive.py list photos.prar
+    python3 archive.py export photos.prar out/ --scale 4 photo_012
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+import numpy as np
+from typing import List, Optional, Sequence, Tuple
+
+from cellpack import get_cell_bits, pack_cells, unpack_cells
+from exporter import export_indexed, get_bit_depth
+from phash import HashIndex, hash_drawing
+from poprev import check_geometry, read_drawing
+from ref_cache import file_digest
+from util import make_palette
+from constants import COLOUR_UNKNOWN, COLOUR_UNKNOWN_RGB, MAX_COLOURS, \
+    ARCHIVE_NAME_BYTES, ARCHIVE_THUMBNAIL_WIDTH, ARCHIVE_THUMBNAIL_HEIGHT, \
+    DUPLICATE_RADIUS
+
+
+MAGIC = b"PRAR"
+VERSION = 2
+# magic, version, number of drawings and offset of the index, padded to 32
+# bytes
+HEADER = struct.Struct("<4sHxxIQ12x")
+
+# the index record of a single drawing
+RECORD = np.dtype([
+    ("name", "S{}".format(ARCHIVE_NAME_BYTES)),
+    # hex SHA-1 digest of the reference file, or empty if there is none
+    ("reference", "S40"),
+    # perceptual hash of the drawing, see phash.hash_drawing
+    ("hash", "<u8"),
+    # seconds since the epoch
+    ("created", "<f8"),
+    ("modified", "<f8"),
+    ("width", "<u2"),
+    ("height", "<u2"),
+    ("colours", "u1"),
+    # bits per pixel the cells are packed into
+    ("bits", "u1"),
+    ("palette", "u1", (MAX_COLOURS, 3)),
+    # where the packed cells are, in bytes from the start of the archive
+    ("offset", "<u8"),
+    ("length", "<u8"),
+    ("thumbnail", "u1", (ARCHIVE_THUMBNAIL_HEIGHT, ARCHIVE_THUMBNAIL_WIDTH))
+])
+
+
+def make_thumbnail(selections: np.ndarray) -> np.ndarray:
+    """
+    :param selections: the colour of every pixel of a drawing
+    :return: the colours of the drawing, sampled at the nearest pixel onto
+    a grid of ARCHIVE_THUMBNAIL_WIDTH x ARCHIVE_THUMBNAIL_HEIGHT
+    """
+    height, width = selections.shape
+    ys = np.arange(ARCHIVE_THUMBNAIL_HEIGHT) * height // \
+        ARCHIVE_THUMBNAIL_HEIGHT
+    xs = np.arange(ARCHIVE_THUMBNAIL_WIDTH) * width // ARCHIVE_THUMBNAIL_WIDTH
+    return selections[np.ix_(ys, xs)]
+
+
+class ArchiveWriter(object):
+    """
+    Writes a new archive, one drawing at a time. The index and header are
+    written when the writer is closed; until then, the archive is invalid.
+    Used as a context manager, the archive is deleted instead if an
+    exception is raised while writing it.
+    """
+
+    def __init__(self, filename: str,
+                 duplicate_radius: Optional[int] = None):
+        """
+        Initialise this ArchiveWriter, truncating the archive
+        :param filename: the archive to write
+        :param duplicate_radius: if given, drawings whose perceptual hash is
+        within this many bits of one already added are skipped
+        """
+        self._file = open(filename, "wb")
+        self._file.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+        self._records = []  # type: List[np.ndarray]
+        self._names = set()
+        self._duplicate_radius = duplicate_radius
+        self._hashes = HashIndex()
+
+    def add(self, name: str, selections: np.ndarray,
+            colours: Sequence[Tuple[int, int, int]],
+            reference: Optional[str] = None,
+            created: Optional[float] = None,
+            modified: Optional[float] = None) -> Optional[str]:
+        """
+        Append a drawing to the archive, unless it duplicates one already
+        added.
+        :param name: the name of the drawing, unique within the archive
+        :param selections: the colour of every pixel of the drawing
+        :param colours: the RGB value of each colour of the drawing
+        :param reference: the hex digest of the reference the drawing was
+        drawn from, as returned by ref_cache.file_digest, if any
+        :param created: when the drawing was created, in seconds since the
+        epoch. Defaults to now.
+        :param modified: when the drawing was last modified. Defaults to
+        created.
+        :return: the name of the drawing this one duplicates, if it was
+        skipped, or None if it was added
+        """
+        encoded = name.encode("utf-8")
+        if len(encoded) > ARCHIVE_NAME_BYTES:
+            raise ValueError("name longer than {} bytes: {}"
+                             .format(ARCHIVE_NAME_BYTES, name))
+        if name in self._names:
+            raise ValueError("duplicate name: {}".format(name))
+        height, width = selections.shape
+        check_geometry(width, height, colours)
+
+        value = hash_drawing(selections, colours)
+        if self._duplicate_radius is not None:
+            matches = self._hashes.query(value, self._duplicate_radius)
+            if matches:
+                return matches[0][0]
+
+        bits = get_cell_bits(selections)
+        data = pack_cells(selections, bits)
+
+        record = np.zeros((), dtype=RECORD)
+        record["name"] = encoded
+        record["reference"] = (reference or "").encode("ascii")
+        record["hash"] = value
+        record["created"] = time.time() if created is None else created
+        record["modified"] = record["created"] if modified is None \
+            else modified
+        record["width"] = width
+        record["height"] = height
+        record["colours"] = len(colours)
+        record["bits"] = bits
+        record["palette"][:len(colours)] = colours
+        record["offset"] = self._file.tell()
+        record["length"] = len(data)
+        record["thumbnail"] = make_thumbnail(selections)
+
+        self._file.write(data)
+        self._records.append(record)
+        self._names.add(name)
+        self._hashes.add(name, value)
+        return None
+
+    def add_drawing(self, filename: str, name: Optional[str] = None,
+                    reference: Optional[str] = None) -> Optional[str]:
+        """
+        Append a drawing saved by PopRev.save_drawing_as to the archive,
+        unless it duplicates one already added.
+        :param filename: the drawing to append
+        :param name: the name of the drawing. Defaults to the drawing's
+        filename, without its directory or extension.
+        :param reference: the reference image the drawing was drawn from, if
+        any
+        :return: the name of the drawing this one duplicates, if it was
+        skipped, or None if it was added
+        """
+        selections, colours = read_drawing(filename)
+        if name is None:
+            name = os.path.splitext(os.path.basename(filename))[0]
+        digest = None if reference is None else file_digest(reference)
+        stat = os.stat(filename)
+        return self.add(name, selections, colours, digest, stat.st_ctime,
+                        stat.st_mtime)
+
+    def close(self) -> None:
+        """
+        Write the index and header, and close the archive.
+        """
+        index_offset = self._file.tell()
+        index = np.zeros(len(self._records), dtype=RECORD)
+        for i, record in enumerate(self._records):
+            index[i] = record
+        self._file.write(index.tobytes())
+
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, VERSION, len(index),
+                                     index_offset))
+        self._file.close()
+
+    def discard(self) -> None:
+        """
+        Close and delete the archive without finishing it, e.g. if a drawing
+        could not be added.
+        """
+        self._file.close()
+        os.remove(self._file.name)
+
+    def __enter__(self) -> "ArchiveWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        # a partly written archive would look valid once closed, so is
+        # removed if writing it failed
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class Archive(object):
+    """
+    A read-only view of an archive written by ArchiveWriter.
+    """
+
+    def __init__(self, filename: str):
+        """
+        Initialise this Archive
+        :param filename: the archive to open
+        """
+        with open(filename, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, version, count, index_offset = \
+                HEADER.unpack_from(self._mmap)
+        except struct.error:
+            raise ValueError("{} is not an archive".format(filename))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a version {} archive"
+                             .format(filename, VERSION))
+
+        self._index = np.frombuffer(self._mmap, dtype=RECORD, count=count,
+                                    offset=index_offset)
+        # position of each drawing, by name, built when first needed
+        self._positions = None
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get_names(self) -> List[str]:
+        """
+        :return: the name of every drawing in this Archive, in order
+        """
+        return [name.decode("utf-8") for name in self._index["name"]]
+
+    def find(self, name: str) -> int:
+        """
+        :param name: the name of a drawing
+        :return: the position of the drawing in this Archive
+        """
+        if self._positions is None:
+            self._positions = {name: i for i, name
+                               in enumerate(self.get_names())}
+        if name not in self._positions:
+            raise KeyError(name)
+        return self._positions[name]
+
+    def get_info(self, index: int) -> dict:
+        """
+        :param index: the position of a drawing in this Archive
+        :return: the name, reference digest, created and modified
+        timestamps, width, height and colours of the drawing
+        """
+        record = self._index[index]
+        return {
+            "name": record["name"].decode("utf-8"),
+            "reference": record["reference"].decode("ascii") or None,
+            "created": float(record["created"]),
+            "modified": float(record["modified"]),
+            "width": int(record["width"]),
+            "height": int(record["height"]),
+            "colours": self.get_colours(index)
+        }
+
+    def get_hash_index(self) -> HashIndex:
+        """
+        :return: an index of the perceptual hash of every drawing in this
+        Archive, by name
+        """
+        index = HashIndex()
+        for name, value in zip(self.get_names(), self._index["hash"]):
+            index.add(name, int(value))
+        return index
+
+    def get_colours(self, index: int) -> List[Tuple[int, int, int]]:
+        """
+        :param index: the position of a drawing in this Archive
+        :return: the RGB value of each colour of the drawing
+        """
+        record = self._index[index]
+        return [tuple(int(v) for v in colour)
+                for colour in record["palette"][:record["colours"]]]
+
+    def get_selections(self, index: int) -> np.ndarray:
+        """
+        :param index: the position of a drawing in this Archive
+        :return: the colour of every pixel of the drawing
+        """
+        record = self._index[index]
+        data = np.frombuffer(self._mmap, dtype=np.uint8,
+                             count=int(record["length"]),
+                             offset=int(record["offset"]))
+        return unpack_cells(data, int(record["width"]),
+                            int(record["height"]), int(record["bits"]))
+
+    def get_thumbnail(self, index: int) -> np.ndarray:
+        """
+        :param index: the position of a drawing in this Archive
+        :return: an RGB rendering of the drawing's thumbnail
+        """
+        palette = make_palette(self.get_colours(index), COLOUR_UNKNOWN + 1,
+                               COLOUR_UNKNOWN_RGB)
+        return np.take(palette, self._index[index]["thumbnail"], axis=0)
+
+    def export(self, indices: Sequence[int], directory: str,
+               scales: Sequence[int] = (1,)) -> List[str]:
+        """
+        Export drawings of this Archive as indexed colour PNGs, named after
+        the drawings, at the smallest bit depth that holds their colours.
+        :param indices: the positions of the drawings to export
+        :param directory: the directory to export to
+        :param scales: the integer factors to upscale each drawing by
+        :return: the filenames of the images written
+        """
+        os.makedirs(directory, exist_ok=True)
+        written = []
+        for index in indices:
+            colours = self.get_colours(index)
+            palette = make_palette(colours, COLOUR_UNKNOWN + 1,
+                                   COLOUR_UNKNOWN_RGB)
+            filename = os.path.join(directory, "{}.png".format(
+                self._index[index]["name"].decode("utf-8")))
+            written += export_indexed(filename, self.get_selections(index),
+                                      palette, scales,
+                                      get_bit_depth(len(colours)),
+                                      len(colours))
+        return written
+
+    def close(self) -> None:
+        """
+        Close this Archive. Arrays returned by it remain valid.
+        """
+        # the index is a view of the mapping, so must be released first
+        self._index = None
+        self._mmap.close()
+
+    def __enter__(self) -> "Archive":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def main(argv: List[str]) -> int:
+    """
+    Pack, list or export an archive, as described by the given command line
+    arguments.
+    :param argv: command line arguments, excluding the program name
+    :return: exit status
+    """
+    parser = argparse.ArgumentParser(description="Archives of drawings")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    pack = commands.add_parser("pack", help="pack drawings into an archive")
+    pack.add_argument("archive")
+    pack.add_argument("drawings", nargs="+", help=".poprev files")
+    pack.add_argument("--skip-duplicates", action="store_true",
+                      help="skip drawings within {} bits of the perceptual "
+                           "hash of one already packed"
+                      .format(DUPLICATE_RADIUS))
+    pack.add_argument("-r", "--reference", action="append", default=[],
+                      help="reference image the drawings were drawn from. "
+                           "Give it once for every drawing, or once per "
+                           "drawing in the same order.")
+
+    list_ = commands.add_parser("list", help="list the drawings of an "
+                                             "archive")
+    list_.add_argument("archive")
+
+    export = commands.add_parser("export", help="export drawings of an "
+                                                "archive as PNGs")
+    export.add_argument("archive")
+    export.add_argument("directory")
+    export.add_argument("names", nargs="*",
+                        help="drawings to export. Defaults to all of them.")
+    export.add_argument("--scale", type=int, default=1)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "pack":
+        references = args.reference
+        if len(references) == 1:
+            references = references * len(args.drawings)
+        elif not references:
+            references = [None] * len(args.drawings)
+        elif len(references) != len(args.drawings):
+            parser.error("give --reference once, or once per drawing")
+
+        radius = DUPLICATE_RADIUS if args.skip_duplicates else None
+        packed = 0
+        with ArchiveWriter(args.archive, radius) as writer:
+            for drawing, reference in zip(args.drawings, references):
+                duplicate = writer.add_drawing(drawing, reference=reference)
+                if duplicate is None:
+                    packed += 1
+                else:
+                    print("skipped {}, a duplicate of {}"
+                          .format(drawing, duplicate))
+        print("packed {} drawings".format(packed))
+        return 0
+
+    with Archive(args.archive) as archive:
+        if args.command == "list":
+            for i in range(len(archive)):
+                info = archive.get_info(i)
+                print("{}\t{}x{}\t{}\t{}".format(
+                    info["name"], info["width"], info["height"],
+                    time.strftime("%Y-%m-%d %H:%M",
+                                  time.localtime(info["modified"])),
+                    info["reference"] or "-"))
+            return 0
+
+        try:
+            indices = [archive.find(name) for name in args.names] or \
+                range(len(archive))
+        except KeyError as e:
+            print("no drawing named {}".format(e), file=sys.stderr)
+            return 1
+        written = archive.export(indices, args.directory, (args.scale,))
+        print("exported {} images".format(len(written)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,198 @@
+"""
+Automatic classification of a drawing from its reference.
+
+Each pixel is classified from the mean intensity of its sector of the
+reference. The intensities are first corrected for the brightness and
+contrast of the photographed screen, then compared against thresholds
+placed between the intensities of the drawing's colours. How much of each
+sector is sampled, how illumination is corrected and where the thresholds
+lie are described by a ClassifierConfig, which can be tuned for a camera
+and screen setup with tuner.py. The configuration named by the
+POPREV_CLASSIFIER environment variable is used by default.
+"""
+import json
+import os
+import cv2
+import numpy as np
+from typing import Dict, Sequence, Tuple
+
+from residual import BGR_WEIGHTS, RGB_WEIGHTS
+from util import get_sector_means
+from constants import AUTO_INSET, AUTO_CORRECTION, CORRECTION_WINDOW
+
+
+CONFIG_FILE = os.environ.get("POPREV_CLASSIFIER")
+
+# ways of correcting the illumination of a reference:
+# none: intensities are used as they are
+# global: intensities are stretched so that the darkest and brightest parts
+# of the reference span the palette
+# local: as global, but the darkest and brightest intensities are estimated
+# around each pixel, correcting uneven lighting and vignetting
+CORRECTIONS = ("none", "global", "local")
+# percentiles of intensity taken as the darkest and brightest, so that a
+# few stray sectors do not set the range
+CORRECTION_PERCENTILES = (1, 99)
+
+
+def get_intensities(ref: np.ndarray, width: int, height: int,
+                    inset: float) -> np.ndarray:
+    """
+    :param ref: a BGR reference image
+    :param width: width of the drawing
+    :param height: height of the drawing
+    :param inset: the fraction of each sector to leave out on every side
+    :return: a float32 array of the mean intensity of the sector of the
+    reference under each pixel of the drawing
+    """
+    return get_sector_means(ref, width, height, inset=inset) @ BGR_WEIGHTS
+
+
+def correct_illumination(intensities: np.ndarray, correction: str) \
+        -> np.ndarray:
+    """
+    :param intensities: the mean intensity of each sector of a reference
+    :param correction: how to correct illumination, one of CORRECTIONS
+    :return: a float32 array of the corrected intensities, where 0 is the
+    darkest and 1 the brightest colour of the palette
+    """
+    intensities = np.asarray(intensities, dtype=np.float32)
+    if correction == "none":
+        return intensities / 255
+    if correction == "global":
+        low, high = np.percentile(intensities, CORRECTION_PERCENTILES)
+    elif correction == "local":
+        # the darkest and brightest intensity in the window around each
+        # pixel, smoothed so that the correction does not follow the drawing
+        window = min(CORRECTION_WINDOW, *intensities.shape)
+        kernel = np.ones((window, window), dtype=np.uint8)
+        low = cv2.blur(cv2.erode(intensities, kernel), (window, window))
+        high = cv2.blur(cv2.dilate(intensities, kernel), (window, window))
+    else:
+        raise ValueError("unknown correction: {}".format(correction))
+    return (intensities - low) / np.maximum(high - low, 1e-3)
+
+
+def get_thresholds(levels: np.ndarray, shift: float, spread: float) \
+        -> np.ndarray:
+    """
+    :param levels: the intensity of each colour of the palette, in
+    increasing order, scaled so that the darkest is 0 and the brightest 1
+    :param shift: how far to move every threshold up
+    :param spread: how far to scale the thresholds away from the middle of
+    the range
+    :return: the intensity dividing each adjacent pair of colours
+    """
+    midpoints = (levels[1:] + levels[:-1]) / 2
+    return 0.5 + shift + spread * (midpoints - 0.5)
+
+
+def classify(corrected: np.ndarray, colours: Sequence[Tuple[int, int, int]],
+             shift: float = 0.0, spread: float = 1.0) -> np.ndarray:
+    """
+    :param corrected: the corrected intensity of each pixel of a drawing, as
+    returned by correct_illumination
+    :param colours: the RGB value of each colour of the drawing
+    :param shift: how far to move every threshold up
+    :param spread: how far to scale the thresholds away from the middle
+    :return: the colour of each pixel of the drawing
+    """
+    levels = np.asarray(colours, dtype=np.float32) @ RGB_WEIGHTS
+    order = np.argsort(levels, kind="stable")
+    levels = levels[order]
+    span = levels[-1] - levels[0]
+    if span > 0:
+        levels = (levels - levels[0]) / span
+    else:
+        levels = np.zeros_like(levels)
+
+    thresholds = get_thresholds(levels, shift, spread)
+    ranks = np.searchsorted(thresholds, corrected)
+    return order[ranks].astype(np.uint8)
+
+
+class ClassifierConfig(object):
+    """
+    The parameters of automatic classification.
+    """
+
+    def __init__(self, inset: float = AUTO_INSET,
+                 correction: str = AUTO_CORRECTION, shift: float = 0.0,
+                 spread: float = 1.0):
+        """
+        Initialise this ClassifierConfig
+        :param inset: the fraction of each sector to leave out on every side
+        :param correction: how to correct illumination, one of CORRECTIONS
+        :param shift: how far to move every threshold up
+        :param spread: how far to scale the thresholds away from the middle
+        """
+        if correction not in CORRECTIONS:
+            raise ValueError("unknown correction: {}".format(correction))
+        self.inset = float(inset)
+        self.correction = correction
+        self.shift = float(shift)
+        self.spread = float(spread)
+
+    def __repr__(self) -> str:
+        return "ClassifierConfig(inset={}, correction={!r}, shift={}, " \
+               "spread={})".format(self.inset, self.correction, self.shift,
+                                   self.spread)
+
+    def classify(self, ref: np.ndarray, width: int, height: int,
+                 colours: Sequence[Tuple[int, int, int]]) -> np.ndarray:
+        """
+        :param ref: a BGR reference image
+        :param width: width of the drawing
+        :param height: height of the drawing
+        :param colours: the RGB value of each colour of the drawing
+        :return: the colour of each pixel of the drawing
+        """
+        intensities = get_intensities(ref, width, height, self.inset)
+        return classify(correct_illumination(intensities, self.correction),
+                        colours, self.shift, self.spread)
+
+    def to_dict(self) -> Dict[str, object]:
+        """
+        :return: this configuration as a JSON-compatible dict
+        """
+        return {"inset": self.inset, "correction": self.correction,
+                "shift": self.shift, "spread": self.spread}
+
+    @staticmethod
+    def from_dict(values: Dict[str, object]) -> "ClassifierConfig":
+        """
+        :param values: a dict returned by ClassifierConfig.to_dict
+        :return: the configuration it describes
+        """
+        return ClassifierConfig(values["inset"], values["correction"],
+                                values["shift"], values["spread"])
+
+    def save(self, filename: str) -> None:
+        """
+        Save this configuration as JSON
+        :param filename: the file to save to
+        """
+        with open(filename, "w") as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+    @staticmethod
+    def load(filename: str) -> "ClassifierConfig":
+        """
+        :param filename: a file written by ClassifierConfig.save
+        :return: the configuration saved in the file
+        """
+        with open(filename) as file:
+            return ClassifierConfig.from_dict(json.load(file))
+
+
+def get_default_config() -> ClassifierConfig:
+    """
+    :return: the configuration named by POPREV_CLASSIFIER, or the default
+    configuration if there is none or it cannot be read
+    """
+    if CONFIG_FILE:
+        try:
+            return ClassifierConfig.load(CONFIG_FILE)
+        except (OSError, KeyError, ValueError):
+            pass
+    return ClassifierConfig()
@@ -0,0 +1,286 @@
+"""
+Headless benchmarks of the PopRev hot paths.
+
+Times each operation over synthetic reference images of several sizes, and
+reports latency percentiles and peak traced memory. Results are printed and
+can be written as JSON so that revisions can be compared, e.g.
+
+    python3 benchmark.py --sizes 0.5 12 48 --json bench.json
+
+Sector means are also timed against a 48 MP photo, as taken by a phone, on
+increasing numbers of threads, to show how preprocessing scales with the
+number of CPUs.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import tkinter as tk
+import cv2
+import numpy as np
+from PIL import Image
+from typing import Callable, Dict, List
+
+from poprev import PopRev
+from preview import Preview
+from ref_cache import ReferenceCache, flush
+from util import highlight_sector, get_sector_means, get_ref_cell_size, \
+    get_ref_tile_cells
+from constants import DRAW_WIDTH, DRAW_HEIGHT, REF_CANVAS_WIDTH, \
+    REF_CANVAS_HEIGHT, PREVIEW_WIDTH, PREVIEW_HEIGHT, HIGHLIGHT_COLOUR, \
+    SECTOR_WORKERS
+
+
+DEFAULT_SIZES = [0.5, 2, 12, 48]
+DEFAULT_REPEATS = 200
+# (width, height) of a 48 MP phone photo
+PHOTO_SIZE = (8192, 5856)
+PHOTO_REPEATS = 5
+PERCENTILES = [50, 90, 99]
+# repetitions of each operation while tracing memory, which is much slower
+# than running untraced
+MEMORY_REPEATS = 5
+
+
+def make_reference(megapixels: float, seed: int = 0) -> np.ndarray:
+    """
+    :param megapixels: the approximate size of the reference to make
+    :param seed: seed of the random colours of the reference
+    :return: a synthetic reference image, with the aspect ratio of a drawing,
+    in which every sector is a random shade of grey plus noise
+    """
+    pixels = megapixels * 1000000
+    height = int(round((pixels * DRAW_HEIGHT / DRAW_WIDTH) ** 0.5))
+    width = int(round(height * DRAW_WIDTH / DRAW_HEIGHT))
+
+    rng = np.random.default_rng(seed)
+    shades = rng.integers(0, 4, (DRAW_HEIGHT, DRAW_WIDTH),
+                          dtype=np.uint8) * 85
+    ref = cv2.resize(shades, (width, height),
+                     interpolation=cv2.INTER_NEAREST)
+    noise = rng.integers(0, 16, ref.shape, dtype=np.uint8)
+    ref = cv2.add(ref, noise)
+    return cv2.cvtColor(ref, cv2.COLOR_GRAY2BGR)
+
+
+def measure(fn: Callable[[int], None], repeats: int) -> Dict[str, float]:
+    """
+    :param fn: the operation to measure. It is called with the index of
+    each repetition.
+    :param repeats: the number of times to call fn
+    :return: latency percentiles, in milliseconds, and the peak memory
+    traced while fn was running, in bytes
+    """
+    fn(0)  # warm up caches and lazy initialisation
+
+    latencies = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        fn(i)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    for i in range(min(repeats, MEMORY_REPEATS)):
+        fn(i)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {"p{}_ms".format(p): float(np.percentile(latencies, p))
+              for p in PERCENTILES}
+    result["mean_ms"] = float(np.mean(latencies))
+    result["peak_bytes"] = peak
+    result["repeats"] = repeats
+    return result
+
+
+def get_display_fn(display: bool) -> Callable[[np.ndarray], None]:
+    """
+    :param display: whether to display images on a real Preview. This
+    requires a display, e.g. a virtual one provided by Xvfb.
+    :return: a function that displays an image the way Preview.display_image
+    does. If display is False, or no display is available, only the image
+    conversion is performed.
+    """
+    if display:
+        try:
+            root = tk.Tk()
+            preview = Preview(root, PREVIEW_WIDTH, PREVIEW_HEIGHT)
+            preview.pack()
+
+            def show(arr: np.ndarray) -> None:
+                preview.display_image(arr)
+                root.update()
+            return show
+        except tk.TclError as e:
+            print("no display available ({}), timing image conversion "
+                  "only".format(e), file=sys.stderr)
+
+    def convert(arr: np.ndarray) -> None:
+        new_arr = cv2.resize(arr, (PREVIEW_WIDTH, PREVIEW_HEIGHT),
+                             interpolation=cv2.INTER_NEAREST)
+        Image.fromarray(new_arr).tobytes()
+    return convert
+
+
+def bench_size(megapixels: float, repeats: int, workdir: str,
+               display_fn: Callable[[np.ndarray], None]) \
+        -> Dict[str, Dict[str, float]]:
+    """
+    Benchmark every operation against a reference of the given size.
+    :param megapixels: the approximate size of the reference to use
+    :param repeats: the number of times to repeat each operation
+    :param workdir: a directory to write temporary files to
+    :param display_fn: function used to display images
+    :return: the measurements of each operation, by name
+    """
+    ref = make_reference(megapixels)
+    ref_file = os.path.join(workdir, "ref_{}.png".format(megapixels))
+    cv2.imwrite(ref_file, ref)
+    drawing_file = os.path.join(workdir, "drawing.poprev")
+
+    cache = ReferenceCache(os.path.join(workdir, "cache"))
+    poprev = PopRev(ref_cache=cache)
+
+    def position(i: int):
+        return i % DRAW_WIDTH, (i // DRAW_WIDTH) % DRAW_HEIGHT
+
+    # fewer repetitions of the operations that decode the whole reference
+    load_repeats = max(1, repeats // 20)
+    results = {
+        "load_reference_uncached": measure(
+            lambda i: PopRev(ref_cache=ReferenceCache(
+                os.path.join(workdir, "uncached"), 0)).load_reference(
+                ref_file), load_repeats)
+    }
+
+    # fill the cache before timing loads from it
+    poprev.load_reference(ref_file)
+    flush()
+    results["load_reference_cached"] = measure(
+        lambda i: poprev.load_reference(ref_file), load_repeats)
+
+    results["get_sector_means"] = measure(
+        lambda i: get_sector_means(ref, DRAW_WIDTH, DRAW_HEIGHT),
+        load_repeats)
+    results["get_sector_means_1_thread"] = measure(
+        lambda i: get_sector_means(ref, DRAW_WIDTH, DRAW_HEIGHT, workers=1),
+        load_repeats)
+
+    results["get_ref_context"] = measure(
+        lambda i: poprev.get_ref_context(*position(i), REF_CANVAS_WIDTH,
+                                         REF_CANVAS_HEIGHT, 1), repeats)
+    # a tile of the reference viewer at its default zoom level
+    cell_width = get_ref_cell_size(REF_CANVAS_WIDTH, 0)
+    cell_height = get_ref_cell_size(REF_CANVAS_HEIGHT, 0)
+    columns = get_ref_tile_cells(cell_width)
+    rows = get_ref_tile_cells(cell_height)
+    results["get_ref_tile"] = measure(
+        lambda i: poprev.get_ref_tile(*position(i), columns, rows,
+                                      cell_width, cell_height), repeats)
+    results["edit_drawing"] = measure(
+        lambda i: poprev.edit_drawing(*position(i), i % 4), repeats)
+    results["get_preview"] = measure(
+        lambda i: poprev.get_preview(*position(i)), repeats)
+    results["save_drawing_as"] = measure(
+        lambda i: poprev.save_drawing_as(drawing_file), repeats)
+    results["load_drawing"] = measure(
+        lambda i: poprev.load_drawing(drawing_file), repeats)
+
+    context = poprev.get_ref_context(0, 0, REF_CANVAS_WIDTH,
+                                     REF_CANVAS_HEIGHT, 1)
+    results["highlight_sector"] = measure(
+        lambda i: highlight_sector(context, i % 3, (i // 3) % 3, 3, 3, 1,
+                                   HIGHLIGHT_COLOUR), repeats)
+    results["display_image"] = measure(
+        lambda i: display_fn(poprev.get_preview(*position(i))), repeats)
+
+    return results
+
+
+def bench_workers(repeats: int) -> Dict[str, Dict[str, float]]:
+    """
+    Benchmark sector means of a 48 MP photo on 1, 2, 4, ... threads, up to
+    the number of CPUs.
+    :param repeats: the number of times to repeat each measurement
+    :return: the measurements for each number of threads, by name
+    """
+    width, height = PHOTO_SIZE
+    ref = cv2.resize(make_reference(48), (width, height),
+                     interpolation=cv2.INTER_NEAREST)
+
+    results = {}
+    workers = 1
+    while True:
+        results["get_sector_means_{}_threads".format(workers)] = measure(
+            lambda i: get_sector_means(ref, DRAW_WIDTH, DRAW_HEIGHT,
+                                       workers=workers), repeats)
+        if workers >= SECTOR_WORKERS:
+            return results
+        workers = min(workers * 2, SECTOR_WORKERS)
+
+
+def print_results(title: str, results: Dict[str, Dict[str, float]]) -> None:
+    """
+    Print the measurements of each operation
+    :param title: the heading to print them under
+    :param results: the measurements of each operation, by name
+    """
+    print(title)
+    for name, result in results.items():
+        print("  {:<30}{:>10.3f} ms p50{:>10.3f} ms p99{:>12} B peak"
+              .format(name, result["p50_ms"], result["p99_ms"],
+                      result["peak_bytes"]))
+
+
+def main(argv: List[str]) -> int:
+    """
+    Run the benchmarks described by the given command line arguments.
+    :param argv: command line arguments, excluding the program name
+    :return: exit status
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes", type=float, nargs="+",
+                        default=DEFAULT_SIZES,
+                        help="reference sizes to test, in megapixels")
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS,
+                        help="repetitions of each interactive operation")
+    parser.add_argument("--display", action="store_true",
+                        help="display images on a real Tk canvas")
+    parser.add_argument("--json", help="file to write results to")
+    args = parser.parse_args(argv)
+
+    display_fn = get_display_fn(args.display)
+
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": {}
+    }
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            results = bench_size(size, args.repeats, workdir, display_fn)
+            report["results"]["{}MP".format(size)] = results
+            print_results("{} MP".format(size), results)
+
+    results = bench_workers(PHOTO_REPEATS)
+    report["results"]["48MP_photo"] = results
+    print_results("48 MP photo ({}x{}), {} CPUs".format(
+        *PHOTO_SIZE, os.cpu_count()), results)
+
+    if args.json is not None:
+        with open(args.json, "w") as file:
+            json.dump(report, file, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
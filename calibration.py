@@ -0,0 +1,300 @@
+"""
+Calibration profiles for references photographed with a fixed camera rig.
+
+A profile maps a raw photograph of the Game Boy's screen to a deskewed,
+cropped image of just the screen. It holds a homography, optionally
+combined with the lens's intrinsics and distortion, and the cv2.remap maps
+precomputed from them, so that rectifying a reference is a single remap.
+Profiles are keyed by the size of the raw photograph they apply to.
+
+A profile can be created from the corners of the screen in one reference,
+e.g.
+
+    python3 calibration.py reference.jpg 412,230 3610,251 3598,2980 398,2961
+
+after which every reference of the same size is rectified when loaded.
+"""
+import argparse
+import hashlib
+import os
+import sys
+import cv2
+import numpy as np
+from PIL import Image
+from typing import List, Optional, Sequence, Tuple
+
+from constants import CALIBRATION_DIR, DRAW_WIDTH, DRAW_HEIGHT, \
+    CALIBRATION_SCALE
+
+
+# EXIF orientations that rotate an image by 90 degrees
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+EXIF_ORIENTATION = 0x0112
+# formats whose EXIF data, if any, is read along with the header. Reading the
+# EXIF data of other formats, e.g. PNG, can decode the whole image.
+EXIF_HEADER_FORMATS = ("JPEG", "MPO", "TIFF", "WEBP")
+
+
+def get_image_size(filename: str) -> Optional[Tuple[int, int]]:
+    """
+    :param filename: an image file
+    :return: the (width, height) of the image as OpenCV decodes it, read
+    from its header without decoding it, or None if it cannot be read
+    """
+    try:
+        with Image.open(filename) as img:
+            width, height = img.size
+            orientation = None
+            if img.format in EXIF_HEADER_FORMATS:
+                orientation = img.getexif().get(EXIF_ORIENTATION)
+    except (OSError, ValueError):
+        return None
+
+    # OpenCV applies the EXIF orientation when decoding
+    if orientation in TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+    return width, height
+
+
+class CalibrationProfile(object):
+    """
+    Rectifies references of a particular size, as described above.
+    """
+
+    def __init__(self, image_size: Tuple[int, int], homography: np.ndarray,
+                 output_size: Tuple[int, int],
+                 camera_matrix: Optional[np.ndarray] = None,
+                 dist_coeffs: Optional[np.ndarray] = None,
+                 maps: Optional[Tuple[np.ndarray, np.ndarray]] = None):
+        """
+        Initialise this CalibrationProfile
+        :param image_size: (width, height) of the raw references this
+        profile applies to
+        :param homography: maps undistorted reference coordinates to
+        rectified image coordinates
+        :param output_size: (width, height) of the rectified image
+        :param camera_matrix: intrinsics of the lens, if it is to be
+        undistorted
+        :param dist_coeffs: distortion coefficients of the lens, in OpenCV's
+        order
+        :param maps: the remap maps of this profile, if already computed
+        """
+        self.image_size = tuple(int(v) for v in image_size)
+        self.output_size = tuple(int(v) for v in output_size)
+        self.homography = np.asarray(homography, dtype=np.float64)
+
+        if camera_matrix is None:
+            camera_matrix = np.eye(3)
+        if dist_coeffs is None:
+            dist_coeffs = np.zeros(5)
+        self.camera_matrix = np.asarray(camera_matrix, dtype=np.float64)
+        self.dist_coeffs = np.asarray(dist_coeffs, dtype=np.float64).ravel()
+
+        self._maps = maps
+
+    @staticmethod
+    def from_corners(image_size: Tuple[int, int],
+                     corners: Sequence[Tuple[float, float]],
+                     output_size: Tuple[int, int] = (
+                         DRAW_WIDTH * CALIBRATION_SCALE,
+                         DRAW_HEIGHT * CALIBRATION_SCALE),
+                     camera_matrix: Optional[np.ndarray] = None,
+                     dist_coeffs: Optional[np.ndarray] = None) \
+            -> "CalibrationProfile":
+        """
+        :param image_size: (width, height) of the raw references the profile
+        applies to
+        :param corners: the top left, top right, bottom right and bottom left
+        corners of the picture in a raw reference, in pixels
+        :param output_size: (width, height) of the rectified image
+        :param camera_matrix: intrinsics of the lens, if it is to be
+        undistorted
+        :param dist_coeffs: distortion coefficients of the lens
+        :return: a profile mapping the given corners to the corners of the
+        rectified image
+        """
+        src = np.asarray(corners, dtype=np.float32).reshape(-1, 1, 2)
+        if camera_matrix is not None:
+            # the homography is applied after the lens is undistorted
+            src = cv2.undistortPoints(src, camera_matrix, dist_coeffs,
+                                      P=camera_matrix)
+
+        width, height = output_size
+        dst = np.array([[0, 0], [width, 0], [width, height], [0, height]],
+                       dtype=np.float32)
+        homography = cv2.getPerspectiveTransform(src.reshape(4, 2), dst)
+        return CalibrationProfile(image_size, homography, output_size,
+                                  camera_matrix, dist_coeffs)
+
+    def get_maps(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: the fixed-point cv2.remap maps that rectify a raw reference
+        """
+        if self._maps is None:
+            # initUndistortRectifyMap maps each output pixel p to the raw
+            # pixel K * distort((new_K * R)^-1 * p). With new_K = I and
+            # R = H * K, that is the raw pixel whose undistorted position
+            # the homography H maps to p.
+            rotation = self.homography @ self.camera_matrix
+            self._maps = cv2.initUndistortRectifyMap(
+                self.camera_matrix, self.dist_coeffs, rotation, np.eye(3),
+                self.output_size, cv2.CV_16SC2)
+        return self._maps
+
+    def applies_to(self, img: np.ndarray) -> bool:
+        """
+        :param img: a raw reference
+        :return: True if this profile rectifies references of its size
+        """
+        return (img.shape[1], img.shape[0]) == self.image_size
+
+    def rectify(self, img: np.ndarray) -> np.ndarray:
+        """
+        :param img: a raw reference
+        :return: the reference, deskewed and cropped to the picture
+        """
+        map1, map2 = self.get_maps()
+        return cv2.remap(img, map1, map2, cv2.INTER_LINEAR)
+
+    def digest(self) -> str:
+        """
+        :return: a digest of the parameters of this profile, which changes
+        whenever the rectified images it produces would
+        """
+        digest = hashlib.sha1()
+        digest.update(repr((self.image_size, self.output_size)).encode())
+        for arr in (self.homography, self.camera_matrix, self.dist_coeffs):
+            digest.update(np.ascontiguousarray(arr).tobytes())
+        return digest.hexdigest()
+
+    def save(self, filename: str) -> None:
+        """
+        Save this profile, including its precomputed maps.
+        :param filename: the file to save the profile to
+        """
+        map1, map2 = self.get_maps()
+        with open(filename, "wb") as file:
+            np.savez(file, image_size=self.image_size,
+                     output_size=self.output_size, homography=self.homography,
+                     camera_matrix=self.camera_matrix,
+                     dist_coeffs=self.dist_coeffs, map1=map1, map2=map2)
+
+    @staticmethod
+    def load(filename: str) -> "CalibrationProfile":
+        """
+        :param filename: a file written by CalibrationProfile.save
+        :return: the profile saved in the file
+        """
+        with np.load(filename) as data:
+            return CalibrationProfile(
+                tuple(data["image_size"]), data["homography"],
+                tuple(data["output_size"]), data["camera_matrix"],
+                data["dist_coeffs"], (data["map1"], data["map2"]))
+
+
+class CalibrationStore(object):
+    """
+    A directory of calibration profiles, one per raw reference size.
+    """
+
+    def __init__(self, directory: str = CALIBRATION_DIR):
+        """
+        Initialise this CalibrationStore
+        :param directory: the directory profiles are kept in. It is created
+        when the first profile is saved.
+        """
+        self._directory = directory
+        # profiles already loaded, or known to be missing, by image size
+        self._profiles = {}
+
+    def _path(self, image_size: Tuple[int, int]) -> str:
+        """
+        :param image_size: (width, height) of raw references
+        :return: the file the profile for references of that size is kept in
+        """
+        return os.path.join(self._directory,
+                            "calibration_{}x{}.npz".format(*image_size))
+
+    def get(self, image_size: Tuple[int, int]) \
+            -> Optional[CalibrationProfile]:
+        """
+        :param image_size: (width, height) of a raw reference
+        :return: the profile for references of the given size, or None if
+        there is none
+        """
+        image_size = tuple(image_size)
+        if image_size not in self._profiles:
+            try:
+                profile = CalibrationProfile.load(self._path(image_size))
+            except (OSError, KeyError, ValueError):
+                profile = None
+            self._profiles[image_size] = profile
+        return self._profiles[image_size]
+
+    def put(self, profile: CalibrationProfile) -> None:
+        """
+        Save a profile, replacing any existing profile for references of
+        its size.
+        :param profile: the profile to save
+        """
+        os.makedirs(self._directory, exist_ok=True)
+        profile.save(self._path(profile.image_size))
+        self._profiles[profile.image_size] = profile
+
+    def remove(self, image_size: Tuple[int, int]) -> None:
+        """
+        Delete the profile for references of the given size, if there is one.
+        :param image_size: (width, height) of raw references
+        """
+        try:
+            os.remove(self._path(image_size))
+        except OSError:
+            pass
+        self._profiles[tuple(image_size)] = None
+
+
+def main(argv: List[str]) -> int:
+    """
+    Create a calibration profile from the corners of the picture in a
+    reference, as described by the given command line arguments.
+    :param argv: command line arguments, excluding the program name
+    :return: exit status
+    """
+    parser = argparse.ArgumentParser(
+        description="Create a calibration profile for a camera rig")
+    parser.add_argument("reference", help="a raw reference from the rig")
+    parser.add_argument("corners", nargs=4, metavar="X,Y",
+                        help="top left, top right, bottom right and bottom "
+                             "left corners of the picture, in pixels")
+    parser.add_argument("--lens",
+                        help=".npz file holding camera_matrix and "
+                             "dist_coeffs of the lens, e.g. from "
+                             "cv2.calibrateCamera")
+    parser.add_argument("--directory", default=CALIBRATION_DIR,
+                        help="directory to save the profile to")
+    args = parser.parse_args(argv)
+
+    image_size = get_image_size(args.reference)
+    if image_size is None:
+        print("cannot read {}".format(args.reference), file=sys.stderr)
+        return 1
+
+    corners = [tuple(float(v) for v in corner.split(","))
+               for corner in args.corners]
+
+    camera_matrix = dist_coeffs = None
+    if args.lens is not None:
+        with np.load(args.lens) as lens:
+            camera_matrix = lens["camera_matrix"]
+            dist_coeffs = lens["dist_coeffs"]
+
+    profile = CalibrationProfile.from_corners(image_size, corners,
+                                              camera_matrix=camera_matrix,
+                                              dist_coeffs=dist_coeffs)
+    CalibrationStore(args.directory).put(profile)
+    print("saved profile for {}x{} references".format(*image_size))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,78 @@
+import numpy as np
+
+from constants import COLOUR_UNKNOWN
+
+
+def get_cell_bits(selections: np.ndarray) -> int:
+    """
+    :param selections: the colour of every pixel of a drawing
+    :return: the fewest bits per pixel, either 2 or 4, that pack_cells can
+    pack the drawing into without losing any known colour
+    """
+    known = selections[selections != COLOUR_UNKNOWN]
+    if known.size == 0 or known.max() < 4:
+        return 2
+    return 4
+
+
+def packed_size(width: int, height: int, bits: int = 2) -> int:
+    """
+    :param width: width of a drawing
+    :param height: height of a drawing
+    :param bits: the number of bits each pixel is packed into
+    :return: the number of bytes pack_cells packs a width x height drawing
+    into
+    """
+    cells = width * height
+    return -(-cells // (8 // bits)) + -(-cells // 8)
+
+
+def pack_cells(selections: np.ndarray, bits: int = 2) -> bytes:
+    """
+    Pack the colours of a drawing into 2 or 4 bits per pixel, followed by a
+    1 bit per pixel mask of which pixels are unknown. COLOUR_UNKNOWN, and any
+    value too large to be packed, is treated as unknown.
+    :param selections: the colour of every pixel of a drawing
+    :param bits: the number of bits to pack each pixel into, either 2 or 4
+    :return: the packed drawing, of packed_size(width, height, bits) bytes
+    """
+    if bits not in (2, 4):
+        raise ValueError("unsupported cell size: {} bits".format(bits))
+
+    flat = selections.ravel()
+    unknown = (flat == COLOUR_UNKNOWN) | (flat >= 1 << bits)
+    values = np.where(unknown, 0, flat).astype(np.uint8)
+
+    # pad to a whole number of bytes of values
+    per_byte = 8 // bits
+    values = np.concatenate((values, np.zeros(-len(values) % per_byte,
+                                              dtype=np.uint8)))
+    shifts = np.arange(8 - bits, -1, -bits, dtype=np.uint8)
+    packed = np.bitwise_or.reduce(values.reshape(-1, per_byte) << shifts,
+                                  axis=1)
+
+    return packed.astype(np.uint8).tobytes() + np.packbits(unknown).tobytes()
+
+
+def unpack_cells(data, width: int, height: int, bits: int = 2) -> np.ndarray:
+    """
+    Unpack a drawing packed by pack_cells.
+    :param data: the packed drawing, as bytes or a uint8 array
+    :param width: width of the drawing
+    :param height: height of the drawing
+    :param bits: the number of bits each pixel was packed into
+    :return: the colour of every pixel of the drawing
+    """
+    cells = width * height
+    packed = np.frombuffer(data, dtype=np.uint8)
+    value_bytes = -(-cells // (8 // bits))
+
+    groups = packed[:value_bytes]
+    shifts = np.arange(8 - bits, -1, -bits, dtype=np.uint8)
+    values = ((groups[:, None] >> shifts) & ((1 << bits) - 1)).ravel()
+    values = values[:cells]
+
+    unknown = np.unpackbits(packed[value_bytes:])[:cells].astype(bool)
+    values[unknown] = COLOUR_UNKNOWN
+
+    return values.reshape(height, width)
@@ -1,50 +1,85 @@
 import tkinter as tk
 import numpy as np
-from typing import Callable
+from typing import Callable, Sequence, Tuple
 
-from constants import REF_CANVAS_HEIGHT, REF_CANVAS_WIDTH
+from constants import REF_CANVAS_HEIGHT, REF_CANVAS_WIDTH, COLOURS
 from colour_selector import ColourSelector
-from preview import Preview
+from ref_viewer import RefViewer
 
 
 class Classifier(tk.Frame):
     """
     A GUI component that displays an image and allows users to classify the
-    image as one of four colours.
+    image as one of the colours of a drawing.
     """
 
     def __init__(self, master, callback: Callable[[int], None],
-                 bg: str = "#ffffff"):
+                 render_tile: Callable[[int, int, int, int, int, int],
+                                       np.ndarray],
+                 bg: str = "#ffffff",
+                 colours: Sequence[Tuple[int, int, int]] = COLOURS):
         """
         Initialise this Classifier
         :param master: parent container of this Classifier
         :param callback: function to call when the ColourSelector sub-component
         of this Classifier is clicked
+        :param render_tile: function that renders a tile of the reference
+        image, given as PopRev.get_ref_tile
         :param bg: the background colour of this Classifier
+        :param colours: the RGB value of each colour to choose from
         """
         super().__init__(master, bg=bg, padx=5)
 
         self._callback = callback
+        self._bg = bg
 
-        self._preview = Preview(self, REF_CANVAS_WIDTH, REF_CANVAS_HEIGHT)
-        self._preview.pack(side=tk.TOP)
+        self._viewer = RefViewer(self, REF_CANVAS_WIDTH, REF_CANVAS_HEIGHT,
+                                 render_tile)
+        self._viewer.pack(side=tk.TOP)
 
-        self._selector = ColourSelector(self,
-                                        ["#000000", "#555555", "#aaaaaa",
-                                         "#ffffff"],
-                                        ["#ffffff", "#aaaaaa", "#555555",
-                                         "#000000"],
-                                        self._callback, bg=bg)
+        self._selector = None
+        self.set_colours(colours)
+
+    def set_colours(self, colours: Sequence[Tuple[int, int, int]]) -> None:
+        """
+        Replace the ColourSelector of this Classifier with one offering the
+        given colours. Each colour is highlighted with its inverse.
+        :param colours: the RGB value of each colour to choose from
+        """
+        if self._selector is not None:
+            self._selector.destroy()
+
+        hexes = ["#{:02x}{:02x}{:02x}".format(*colour) for colour in colours]
+        highlights = ["#{:02x}{:02x}{:02x}".format(*(255 - v for v in colour))
+                      for colour in colours]
+        self._selector = ColourSelector(self, hexes, highlights,
+                                        self._callback, bg=self._bg)
         self._selector.pack(side=tk.TOP)
 
-        self._img = None
+    def display_reference(self, reference: np.ndarray, width: int,
+                          height: int, x: int, y: int) -> None:
+        """
+        Display the reference image around sector (x, y).
+        :param reference: the reference image
+        :param width: width of the drawing the reference is divided into
+        :param height: height of the drawing the reference is divided into
+        :param x: x coordinate of the sector to display
+        :param y: y coordinate of the sector to display
+        """
+        self._viewer.set_reference(reference, width, height)
+        self._viewer.show(x, y)
+
+    def zoom_in(self) -> None:
+        """
+        Show less of the reference image around the current sector
+        """
+        self._viewer.zoom_in()
 
-    def display_image(self, arr: np.ndarray):
+    def zoom_out(self) -> None:
         """
-        Display an image on the Preview component of this Classifier.
-        :param arr: the image to display
+        Show more of the reference image around the current sector
         """
-        self._preview.display_image(arr)
+        self._viewer.zoom_out()
 
     def get_selector(self) -> ColourSelector:
         """
@@ -56,7 +91,5 @@ class Classifier(tk.Frame):
         """
         Display a warning that no reference image is loaded.
         """
-        self._preview.delete(tk.ALL)
-        self._preview.create_text(REF_CANVAS_WIDTH / 2, REF_CANVAS_HEIGHT / 2,
-                                  text="Please load a reference image\n "
-                                       "by going to File > Load Reference")
+        self._viewer.display_message("Please load a reference image\n "
+                                     "by going to File > Load Reference")
@@ -1,23 +1,109 @@
+import os
+
 COLOUR0 = (0, 0, 0)
 COLOUR1 = (85, 85, 85)
 COLOUR2 = (170, 170, 170)
 COLOUR3 = (255, 255, 255)
 
+# the palette of a new drawing
 COLOURS = [COLOUR0, COLOUR1, COLOUR2, COLOUR3]
 
 HIGHLIGHT_COLOUR = (255, 0, 0)
 
+# the size of a new drawing
 DRAW_WIDTH = 128
 DRAW_HEIGHT = 112
+# the greatest width or height of a drawing that can be started
+DRAW_MAX_SIZE = 4096
 
 REF_CANVAS_WIDTH = 300
 REF_CANVAS_HEIGHT = 300
-PREVIEW_WIDTH = 4 * DRAW_WIDTH
-PREVIEW_HEIGHT = 4 * DRAW_HEIGHT
+# how many cells of context the reference viewer can show either side of
+# the current pixel, from most to least zoomed in
+REF_ZOOM_LEVELS = (1, 2, 4, 7, 12)
+# the reference viewer is rendered in tiles of about this many pixels
+# square, and keeps up to REF_TILE_CACHE_PIXELS pixels of them
+REF_TILE_SIZE = 256
+REF_TILE_CACHE_PIXELS = 16 * 1024 * 1024
+# screen pixels per drawing pixel in the drawing preview, reduced for large
+# drawings so that the preview is at most PREVIEW_MAX_SIZE pixels across
+PREVIEW_SCALE = 4
+PREVIEW_MAX_SIZE = 640
+PREVIEW_WIDTH = PREVIEW_SCALE * DRAW_WIDTH
+PREVIEW_HEIGHT = PREVIEW_SCALE * DRAW_HEIGHT
 
 CSO_WIDTH = 100
 CSO_HEIGHT = 100
 
 BACKGROUND_COLOUR = "#cce5ff"
 
-COLOUR_UNKNOWN = 9
\ No newline at end of file
+COLOUR_UNKNOWN = 9
+COLOUR_UNKNOWN_RGB = COLOUR3
+# drawings are saved one digit per pixel, so every colour index, including
+# COLOUR_UNKNOWN, must be a single digit
+MAX_COLOURS = COLOUR_UNKNOWN
+# the first line of a drawing file, followed by its width, height and the
+# hex RGB value of each of its colours
+DRAWING_HEADER = "#poprev"
+
+# the greatest number of threads a reference is preprocessed on, and the
+# fewest pixels worth giving a thread of its own
+SECTOR_WORKERS = os.cpu_count() or 1
+SECTOR_BAND_PIXELS = 4 * 1024 * 1024
+
+REF_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "poprev")
+REF_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+CALIBRATION_DIR = os.path.join(os.path.expanduser("~"), ".config", "poprev",
+                               "calibration")
+# pixels per drawing pixel in references rectified by a calibration profile
+CALIBRATION_SCALE = 8
+
+EXPORT_POLL_MS = 100
+
+PROJECT_SLOTS = 30
+THUMBNAIL_STEP = 2
+CONTACT_SHEET_COLUMNS = 6
+CONTACT_SHEET_SPACING = 4
+ANIMATION_FRAME_MS = 500
+
+ARCHIVE_NAME_BYTES = 128
+ARCHIVE_THUMBNAIL_WIDTH = 32
+ARCHIVE_THUMBNAIL_HEIGHT = 28
+
+# perceptual hashes are split into this many chunks to be searched, so
+# searches within fewer bits than this are fastest
+HASH_CHUNKS = 8
+# the greatest number of bits the perceptual hashes of two pictures may
+# differ by for them to be considered duplicates
+DUPLICATE_RADIUS = 6
+
+# sampling and illumination correction used by automatic classification,
+# unless a tuned configuration is given in POPREV_CLASSIFIER
+AUTO_INSET = 0.2
+AUTO_CORRECTION = "global"
+# side of the window local illumination correction estimates the darkest
+# and brightest intensity over, in drawing pixels
+CORRECTION_WINDOW = 15
+# values swept by tuner.py
+AUTO_INSETS = (0.0, 0.1, 0.2, 0.3)
+THRESHOLD_SHIFTS = (-0.15, -0.1, -0.05, 0.0, 0.05, 0.1, 0.15)
+THRESHOLD_SPREADS = (0.7, 0.8, 0.9, 1.0, 1.1, 1.2, 1.3)
+
+TIMING_WINDOW = 500
+TIMING_TRACE_LIMIT = 1000000
+
+# keys that select each colour, in colour order
+COLOUR_KEYS = ["1", "2", "3", "4", "5", "6", "7", "8", "9"]
+# keys that move the cursor, and the direction they move it in
+MOVE_KEYS = {"Up": "up", "Right": "right", "Down": "down", "Left": "left"}
+UNDO_KEYS = ["<Control-z>"]
+REDO_KEYS = ["<Control-y>", "<Control-Z>"]
+
+HISTORY_MAX_BYTES = 4 * 1024 * 1024
+
+RESIDUAL_OPACITY = 0.6
+WORST_CELL_COUNT = 50
+NEXT_WORST_KEYS = ["n"]
+ZOOM_IN_KEYS = ["plus", "equal"]
+ZOOM_OUT_KEYS = ["minus"]
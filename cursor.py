@@ -0,0 +1,73 @@
+from typing import Tuple
+
+from constants import DRAW_WIDTH, DRAW_HEIGHT
+
+
+class Cursor(object):
+    """
+    The position of the pixel being classified, which wraps around the edges
+    of the drawing.
+    """
+
+    def __init__(self, width: int = DRAW_WIDTH, height: int = DRAW_HEIGHT):
+        """
+        Initialise this Cursor at the top left pixel
+        :param width: width of the drawing this Cursor moves over
+        :param height: height of the drawing this Cursor moves over
+        """
+        self._width = width
+        self._height = height
+        self._x = 0
+        self._y = 0
+
+    def get_position(self) -> Tuple[int, int]:
+        """
+        :return: the (x, y) coordinate of this Cursor
+        """
+        return self._x, self._y
+
+    def set_bounds(self, width: int, height: int) -> None:
+        """
+        Change the size of the drawing this Cursor moves over, moving this
+        Cursor onto the drawing if it is now outside it
+        :param width: width of the drawing
+        :param height: height of the drawing
+        """
+        self._width = width
+        self._height = height
+        self._x = min(self._x, width - 1)
+        self._y = min(self._y, height - 1)
+
+    def next(self) -> None:
+        """
+        Go to the 'next' pixel i.e. right neighbour of current pixel, or
+        left-most pixel in the next row down if the former does not apply (or
+        go back to top left if current is bottom right)
+        """
+        self._x = (self._x + 1) % self._width
+        if self._x == 0:
+            self._y = (self._y + 1) % self._height
+
+    def move(self, direction: str) -> None:
+        """
+        Move to the next pixel in the specified direction.
+        :param direction: the direction to move
+        """
+        if direction == "up":
+            self._y = (self._y - 1) % self._height
+        elif direction == "right":
+            self._x = (self._x + 1) % self._width
+        elif direction == "down":
+            self._y = (self._y + 1) % self._height
+        elif direction == "left":
+            self._x = (self._x - 1) % self._width
+
+    def jump(self, x: int, y: int) -> None:
+        """
+        Jump to the pixel specified by the given (x, y) coordinate, or the
+        nearest pixel of the drawing if it is outside it
+        :param x: x coordinate of position to jump to
+        :param y: y coordinate of position to jump to
+        """
+        self._x = max(0, min(x, self._width - 1))
+        self._y = max(0, min(y, self._height - 1))
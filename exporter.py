@@ -0,0 +1,107 @@
+import os
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor
+from PIL import Image
+from typing import List, Sequence
+
+from constants import COLOURS
+
+
+# the bit depths indexed colour PNGs may be exported at
+BIT_DEPTHS = (2, 4, 8)
+
+# exports are written one at a time, in the order they were requested, so
+# that the editor never competes with more than one writer
+_executor = ThreadPoolExecutor(max_workers=1,
+                               thread_name_prefix="poprev-export")
+
+
+def get_scaled_filename(filename: str, scale: int) -> str:
+    """
+    :param filename: the filename of a native size export
+    :param scale: the factor the export is upscaled by
+    :return: the filename of the export at the given scale, e.g.
+    "photo@4x.png" for "photo.png" at scale 4
+    """
+    if scale == 1:
+        return filename
+    root, ext = os.path.splitext(filename)
+    return "{}@{}x{}".format(root, scale, ext)
+
+
+def get_bit_depth(colour_count: int) -> int:
+    """
+    :param colour_count: the number of colours of a drawing
+    :return: the smallest bit depth the drawing can be exported at
+    """
+    for bits in BIT_DEPTHS:
+        if colour_count <= 1 << bits:
+            return bits
+    raise ValueError("too many colours: {}".format(colour_count))
+
+
+def export_indexed(filename: str, selections: np.ndarray,
+                   palette: np.ndarray, scales: Sequence[int] = (1,),
+                   bits: int = 2,
+                   colour_count: int = len(COLOURS)) -> List[str]:
+    """
+    Export a drawing as one or more indexed colour PNGs.
+    :param filename: the file to save the native size export to. Upscaled
+    exports are saved alongside it, see get_scaled_filename.
+    :param selections: the colour indices of the drawing
+    :param palette: the RGB value of each colour index
+    :param scales: the integer factors to upscale the drawing by. One image
+    is written per scale.
+    :param bits: the bit depth of the exported images, one of BIT_DEPTHS.
+    Below a bit depth of 8, unknown pixels are written as the last known
+    colour.
+    :param colour_count: the number of known colours of the drawing
+    :return: the filenames of the images that were written
+    """
+    if bits not in BIT_DEPTHS:
+        raise ValueError("unsupported bit depth: {}".format(bits))
+
+    if bits == 8:
+        indices = selections.astype(np.uint8)
+    elif colour_count > 1 << bits:
+        raise ValueError("{} colours cannot be exported at a bit depth of {}"
+                         .format(colour_count, bits))
+    else:
+        indices = np.where(selections < colour_count, selections,
+                           colour_count - 1).astype(np.uint8)
+        palette = palette[:colour_count]
+
+    flat_palette = np.asarray(palette, dtype=np.uint8).flatten().tolist()
+
+    written = []
+    for scale in scales:
+        scaled = indices
+        if scale != 1:
+            scaled = np.repeat(np.repeat(indices, scale, axis=0), scale,
+                               axis=1)
+        height, width = scaled.shape
+
+        img = Image.frombytes("P", (width, height),
+                              np.ascontiguousarray(scaled).tobytes())
+        img.putpalette(flat_palette)
+
+        scaled_filename = get_scaled_filename(filename, scale)
+        img.save(scaled_filename, format="PNG", bits=bits)
+        written.append(scaled_filename)
+
+    return written
+
+
+def export_indexed_async(filename: str, selections: np.ndarray,
+                         palette: np.ndarray, scales: Sequence[int] = (1,),
+                         bits: int = 2,
+                         colour_count: int = len(COLOURS)) -> Future:
+    """
+    Export a drawing as one or more indexed colour PNGs on a background
+    thread. Takes the same arguments as export_indexed. The given arrays are
+    copied, so the caller is free to modify them once this returns.
+    :return: a Future resolving to the filenames of the images written
+    """
+    return _executor.submit(export_indexed, filename, np.copy(selections),
+                            np.copy(palette), tuple(scales), bits,
+                            colour_count)
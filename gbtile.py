@@ -0,0 +1,82 @@
+import numpy as np
+
+
+# the width and height of a Game Boy tile, in pixels
+TILE_SIZE = 8
+# the number of shades the Game Boy can display
+SHADES = 4
+
+
+def tile_data_size(width: int, height: int) -> int:
+    """
+    :param width: width of the picture, in pixels
+    :param height: height of the picture, in pixels
+    :return: the number of bytes a width x height picture occupies in 2bpp
+    format
+    """
+    return width * height // 4
+
+
+def encode_tiles(selections: np.ndarray) -> np.ndarray:
+    """
+    Encode drawings in the Game Boy's native 2bpp tile format.
+
+    The picture is divided into 8x8 tiles, stored left to right, top to
+    bottom. Each row of a tile is two bytes: the low bit of each pixel,
+    followed by the high bit, with the leftmost pixel in the most
+    significant bit. The Game Boy numbers its shades from lightest to
+    darkest, so colour i of a drawing is shade 3 - i. Unknown pixels, and
+    any colour beyond the Game Boy's four shades, are encoded as the
+    lightest shade.
+    :param selections: an array of shape (..., height, width) of drawing
+    colours, where height and width are multiples of 8. Any leading
+    dimensions are treated as a batch of drawings.
+    :return: a uint8 array of shape (..., width * height / 4) holding the
+    encoded tile data of each drawing
+    """
+    *batch, height, width = selections.shape
+    if height % TILE_SIZE or width % TILE_SIZE:
+        raise ValueError("drawing dimensions must be multiples of {}"
+                         .format(TILE_SIZE))
+
+    shades = np.where(selections < SHADES, SHADES - 1 - selections, 0)
+    shades = shades.astype(np.uint8)
+
+    # (..., tile row, tile column, pixel row, pixel column)
+    tiles = shades.reshape(*batch, height // TILE_SIZE, TILE_SIZE,
+                           width // TILE_SIZE, TILE_SIZE)
+    tiles = np.swapaxes(tiles, -3, -2)
+
+    low = np.packbits(tiles & 1, axis=-1)
+    high = np.packbits(tiles >> 1, axis=-1)
+
+    data = np.concatenate((low, high), axis=-1)
+    return data.reshape(*batch, tile_data_size(width, height))
+
+
+def decode_tiles(data: np.ndarray, width: int, height: int) -> np.ndarray:
+    """
+    Decode drawings stored in the Game Boy's native 2bpp tile format. This
+    is the inverse of encode_tiles, except that unknown pixels are decoded
+    as the lightest colour.
+    :param data: a uint8 array of shape (..., width * height / 4). Any
+    leading dimensions are treated as a batch of drawings.
+    :param width: width of the encoded drawings, in pixels
+    :param height: height of the encoded drawings, in pixels
+    :return: a uint8 array of shape (..., height, width) of drawing colours
+    """
+    *batch, size = data.shape
+    if height % TILE_SIZE or width % TILE_SIZE:
+        raise ValueError("drawing dimensions must be multiples of {}"
+                         .format(TILE_SIZE))
+    if size != tile_data_size(width, height):
+        raise ValueError("expected {} bytes of tile data, got {}"
+                         .format(tile_data_size(width, height), size))
+
+    rows = data.reshape(*batch, height // TILE_SIZE, width // TILE_SIZE,
+                        TILE_SIZE, 2)
+    bits = np.unpackbits(rows, axis=-1)
+    shades = bits[..., :TILE_SIZE] | (bits[..., TILE_SIZE:] << 1)
+
+    pixels = np.swapaxes(shades, -3, -2).reshape(*batch, height, width)
+    return (SHADES - 1 - pixels).astype(np.uint8)
@@ -0,0 +1,242 @@
+import zlib
+import numpy as np
+from collections import deque
+from typing import List, Optional, Tuple, Union
+
+from cellpack import get_cell_bits, pack_cells, unpack_cells
+from constants import HISTORY_MAX_BYTES
+
+
+# estimated memory used by a CellEdit, including the deque slot holding it
+CELL_EDIT_BYTES = 100
+# estimated memory used by a Snapshot, excluding its compressed data
+SNAPSHOT_BYTES = 150
+
+# a drawing's colour indices, the RGB value of each of its colours, the
+# file it is saved to, if any, and whether it has changes not saved there
+Drawing = Tuple[np.ndarray, List[Tuple[int, int, int]], Optional[str], bool]
+
+
+class CellEdit(object):
+    """
+    An undoable change to the colour of a single pixel.
+    """
+
+    def __init__(self, x: int, y: int, old: int, new: int):
+        """
+        Initialise this CellEdit
+        :param x: x coordinate of the edited pixel
+        :param y: y coordinate of the edited pixel
+        :param old: colour of the pixel before the edit
+        :param new: colour of the pixel after the edit
+        """
+        self.x = x
+        self.y = y
+        self.old = old
+        self.new = new
+
+    def size(self) -> int:
+        """
+        :return: estimated memory used by this CellEdit, in bytes
+        """
+        return CELL_EDIT_BYTES
+
+    def swap(self, drawing: Drawing, undo: bool) -> Drawing:
+        """
+        Undo or redo this edit.
+        :param drawing: the drawing to apply the edit to, in place
+        :param undo: True to undo this edit, False to redo it
+        :return: the edited drawing, which is no longer the same as its file
+        """
+        selections, colours, save_name, _ = drawing
+        selections[self.y, self.x] = self.old if undo else self.new
+        return selections, colours, save_name, True
+
+
+class Snapshot(object):
+    """
+    An undoable change to many pixels at once, stored as a compressed copy of
+    the drawing, its palette and the file it is saved to, as they were on
+    the other side of the change.
+    """
+
+    def __init__(self, drawing: Drawing):
+        """
+        Initialise this Snapshot
+        :param drawing: the drawing as it was before the change
+        """
+        self._store(drawing)
+
+    def _store(self, drawing: Drawing) -> None:
+        """
+        Keep a packed and compressed copy of a drawing.
+        :param drawing: the drawing to keep
+        """
+        selections, colours, save_name, unsaved = drawing
+        self._shape = selections.shape
+        self._bits = get_cell_bits(selections)
+        self._data = zlib.compress(pack_cells(selections, self._bits))
+        self._colours = list(colours)
+        self._save_name = save_name
+        self._unsaved = unsaved
+
+    def size(self) -> int:
+        """
+        :return: estimated memory used by this Snapshot, in bytes
+        """
+        return SNAPSHOT_BYTES + len(self._data)
+
+    def swap(self, drawing: Drawing, undo: bool) -> Drawing:
+        """
+        Undo or redo this change, by exchanging the drawing with the stored
+        copy.
+        :param drawing: the drawing to apply the change to
+        :param undo: True to undo this change, False to redo it. Snapshots
+        behave identically in both directions.
+        :return: the stored copy of the drawing. It is only as saved as it
+        was when stored if it is saved to a different file than the given
+        drawing, as otherwise that file may have been saved over since.
+        """
+        height, width = self._shape
+        restored = unpack_cells(zlib.decompress(self._data), width, height,
+                                self._bits)
+        colours = self._colours
+        save_name = self._save_name
+        unsaved = self._unsaved or save_name == drawing[2]
+        self._store(drawing)
+        return restored, colours, save_name, unsaved
+
+
+class History(object):
+    """
+    The undo and redo stacks of a drawing, within a memory budget. When the
+    budget is exceeded, the oldest changes are forgotten first.
+    """
+
+    def __init__(self, max_bytes: int = HISTORY_MAX_BYTES):
+        """
+        Initialise an empty History
+        :param max_bytes: the maximum estimated memory to use, in bytes
+        """
+        self._max_bytes = max_bytes
+        self._undo = deque()
+        self._redo = deque()
+        self._bytes = 0
+
+    def record_edit(self, x: int, y: int, old: int, new: int) -> None:
+        """
+        Record that a single pixel has been changed.
+        :param x: x coordinate of the edited pixel
+        :param y: y coordinate of the edited pixel
+        :param old: colour of the pixel before the edit
+        :param new: colour of the pixel after the edit
+        """
+        self._push(CellEdit(x, y, old, new))
+
+    def record_snapshot(self, selections: np.ndarray,
+                        colours: List[Tuple[int, int, int]],
+                        save_name: Optional[str] = None,
+                        unsaved: bool = True) -> None:
+        """
+        Record the drawing as it is before many pixels, its palette, or the
+        file it is saved to are changed at once.
+        :param selections: the colours of the drawing before the change
+        :param colours: the palette of the drawing before the change
+        :param save_name: the file the drawing was saved to before the change
+        :param unsaved: whether the drawing had unsaved changes before the
+        change
+        """
+        self._push(Snapshot((selections, colours, save_name, unsaved)))
+
+    def _push(self, record: Union[CellEdit, Snapshot]) -> None:
+        """
+        Add a change to the undo stack, discarding every change that could
+        have been redone.
+        :param record: the change to add
+        """
+        for redo in self._redo:
+            self._bytes -= redo.size()
+        self._redo.clear()
+
+        self._undo.append(record)
+        self._bytes += record.size()
+
+        while self._bytes > self._max_bytes and self._undo:
+            self._bytes -= self._undo.popleft().size()
+
+    def can_undo(self) -> bool:
+        """
+        :return: True if there is a change to undo
+        """
+        return len(self._undo) > 0
+
+    def can_redo(self) -> bool:
+        """
+        :return: True if there is a change to redo
+        """
+        return len(self._redo) > 0
+
+    def undo(self, selections: np.ndarray,
+             colours: List[Tuple[int, int, int]],
+             save_name: Optional[str] = None,
+             unsaved: bool = True) -> Optional[Drawing]:
+        """
+        Undo the most recent change.
+        :param selections: the colours of the drawing to undo the change of.
+        They may be modified in place.
+        :param colours: the palette of the drawing
+        :param save_name: the file the drawing is saved to
+        :param unsaved: whether the drawing has unsaved changes
+        :return: the colours, palette, save file and unsaved state of the
+        drawing with the change undone, or None if there was no change to
+        undo
+        """
+        return self._move(self._undo, self._redo,
+                          (selections, colours, save_name, unsaved), True)
+
+    def redo(self, selections: np.ndarray,
+             colours: List[Tuple[int, int, int]],
+             save_name: Optional[str] = None,
+             unsaved: bool = True) -> Optional[Drawing]:
+        """
+        Redo the most recently undone change.
+        :param selections: the colours of the drawing to redo the change of.
+        They may be modified in place.
+        :param colours: the palette of the drawing
+        :param save_name: the file the drawing is saved to
+        :param unsaved: whether the drawing has unsaved changes
+        :return: the colours, palette, save file and unsaved state of the
+        drawing with the change redone, or None if there was no change to
+        redo
+        """
+        return self._move(self._redo, self._undo,
+                          (selections, colours, save_name, unsaved), False)
+
+    def _move(self, source: deque, dest: deque, drawing: Drawing,
+              undo: bool) -> Optional[Drawing]:
+        """
+        Apply the change at the top of one stack, and move it to the other.
+        :param source: the stack to take the change from
+        :param dest: the stack to move the change to
+        :param drawing: the drawing to apply the change to
+        :param undo: True if the change is being undone
+        :return: the drawing with the change applied, or None if there was no
+        change to apply
+        """
+        if not source:
+            return None
+
+        record = source.pop()
+        self._bytes -= record.size()
+        drawing = record.swap(drawing, undo)
+        self._bytes += record.size()
+        dest.append(record)
+        return drawing
+
+    def clear(self) -> None:
+        """
+        Forget every change.
+        """
+        self._undo.clear()
+        self._redo.clear()
+        self._bytes = 0
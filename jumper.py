@@ -66,6 +66,15 @@ class Jumper(tk.Frame):
 
         self._jump_callback(x, y)
 
+    def set_bounds(self, xu: int, yu: int) -> None:
+        """
+        Change the upper bounds on the allowed range of coordinates
+        :param xu: upper bound on the allowed range of x coordinates
+        :param yu: upper bound on the allowed range of y coordinates
+        """
+        self._xu = xu
+        self._yu = yu
+
     def display_position(self, x: int, y: int) -> None:
         """
         Display a given (x, y) coordinate in this object's text entry fields.
@@ -38,3 +38,11 @@ class Navigator(tk.Frame):
         :param y: y coordinate to display
         """
         self._jumper.display_position(x, y)
+
+    def set_bounds(self, width: int, height: int) -> None:
+        """
+        Change the size of the x-y space that can be navigated
+        :param width: the largest x coordinate that can be jumped to
+        :param height: the largest y coordinate that can be jumped to
+        """
+        self._jumper.set_bounds(width, height)
@@ -0,0 +1,235 @@
+"""
+Perceptual hashes of drawings and references, for finding duplicates.
+
+A hash is a 64 bit difference hash: the picture is shrunk to 9x8
+intensities, and each bit records whether an intensity is brighter than its
+right neighbour. Pictures that look alike have hashes that differ in few
+bits, so re-photographed pictures can be found by the Hamming distance
+between their hashes, e.g.
+
+    python3 phash.py references.npz new_photos/*.jpg
+
+reports every photo within DUPLICATE_RADIUS bits of one already indexed,
+and adds the rest to the index.
+"""
+import argparse
+import os
+import sys
+import cv2
+import numpy as np
+from collections import defaultdict
+from typing import List, Sequence, Tuple
+
+from residual import BGR_WEIGHTS, RGB_WEIGHTS
+from util import make_palette
+from constants import COLOUR_UNKNOWN, COLOUR_UNKNOWN_RGB, HASH_CHUNKS, \
+    DUPLICATE_RADIUS
+
+
+# the hash is taken over a (HASH_SIZE + 1) x HASH_SIZE grid, giving
+# HASH_SIZE * HASH_SIZE bits
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE
+
+
+def hash_intensities(intensities: np.ndarray) -> int:
+    """
+    :param intensities: a 2D array of the intensity of every pixel of a
+    picture
+    :return: the difference hash of the picture
+    """
+    small = cv2.resize(intensities.astype(np.float32),
+                       (HASH_SIZE + 1, HASH_SIZE),
+                       interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] < small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hash_drawing(selections: np.ndarray,
+                 colours: Sequence[Tuple[int, int, int]]) -> int:
+    """
+    :param selections: the colour of every pixel of a drawing
+    :param colours: the RGB value of each colour of the drawing
+    :return: the difference hash of the drawing as it is rendered
+    """
+    levels = make_palette(colours, COLOUR_UNKNOWN + 1,
+                          COLOUR_UNKNOWN_RGB).astype(np.float32) @ RGB_WEIGHTS
+    return hash_intensities(levels[selections])
+
+
+def hash_image(img: np.ndarray) -> int:
+    """
+    :param img: a BGR image, as loaded by OpenCV
+    :return: the difference hash of the image
+    """
+    # shrink before converting to intensity, so that a large reference is
+    # never copied at full size
+    small = cv2.resize(img, (HASH_SIZE + 1, HASH_SIZE),
+                       interpolation=cv2.INTER_AREA)
+    return hash_intensities(small.astype(np.float32) @ BGR_WEIGHTS)
+
+
+def hamming(a: np.ndarray, b: int) -> np.ndarray:
+    """
+    :param a: an array of hashes
+    :param b: a hash
+    :return: the number of bits each hash of a differs from b by
+    """
+    diff = np.bitwise_xor(a.astype(np.uint64), np.uint64(b))
+    bits = np.unpackbits(diff.view(np.uint8).reshape(-1, 8), axis=1)
+    return bits.sum(axis=1)
+
+
+class HashIndex(object):
+    """
+    Named hashes, searchable by Hamming distance.
+
+    Searches use multi-index hashing: each hash is split into HASH_CHUNKS
+    chunks, and each chunk is indexed in its own table. Two hashes within
+    fewer than HASH_CHUNKS bits of each other must have at least one chunk
+    in common, so only hashes sharing a chunk with the query are compared.
+    Wider searches compare every hash, in a single vectorised pass.
+    """
+
+    def __init__(self, chunks: int = HASH_CHUNKS):
+        """
+        Initialise an empty HashIndex
+        :param chunks: the number of chunks each hash is split into. Must
+        divide HASH_BITS.
+        """
+        self._chunks = chunks
+        self._chunk_bits = HASH_BITS // chunks
+        self._names = []  # type: List[str]
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        # hashes added since self._hashes was last rebuilt
+        self._pending = []  # type: List[int]
+        # for each chunk, a table of the positions of every hash by the
+        # chunk's value
+        self._tables = [defaultdict(list) for _ in range(chunks)]
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def _split(self, value: int) -> List[int]:
+        """
+        :param value: a hash
+        :return: the value of each chunk of the hash
+        """
+        mask = (1 << self._chunk_bits) - 1
+        return [(value >> (i * self._chunk_bits)) & mask
+                for i in range(self._chunks)]
+
+    def add(self, name: str, value: int) -> None:
+        """
+        Add a hash to this HashIndex
+        :param name: what the hash is of, e.g. a filename
+        :param value: the hash
+        """
+        position = len(self._names)
+        self._names.append(name)
+        self._pending.append(value)
+        for table, chunk in zip(self._tables, self._split(value)):
+            table[chunk].append(position)
+
+    def get_hashes(self) -> np.ndarray:
+        """
+        :return: every hash in this HashIndex, in the order they were added
+        """
+        if self._pending:
+            self._hashes = np.concatenate(
+                (self._hashes, np.array(self._pending, dtype=np.uint64)))
+            self._pending = []
+        return self._hashes
+
+    def query(self, value: int, radius: int = DUPLICATE_RADIUS) \
+            -> List[Tuple[str, int]]:
+        """
+        :param value: a hash
+        :param radius: the greatest number of bits a match may differ by
+        :return: the name and distance of every hash within radius bits of
+        the given hash, nearest first
+        """
+        hashes = self.get_hashes()
+        if radius < self._chunks:
+            candidates = set()
+            for table, chunk in zip(self._tables, self._split(value)):
+                candidates.update(table.get(chunk, ()))
+            positions = np.array(sorted(candidates), dtype=np.int64)
+        else:
+            positions = np.arange(len(hashes))
+
+        if len(positions) == 0:
+            return []
+        distances = hamming(hashes[positions], value)
+        found = np.flatnonzero(distances <= radius)
+        found = found[np.argsort(distances[found], kind="stable")]
+        return [(self._names[positions[i]], int(distances[i]))
+                for i in found]
+
+    def save(self, filename: str) -> None:
+        """
+        Save this HashIndex. The chunk tables are rebuilt when it is loaded.
+        :param filename: the file to save to
+        """
+        with open(filename, "wb") as file:
+            np.savez(file, names=np.array(self._names, dtype=str),
+                     hashes=self.get_hashes(), chunks=self._chunks)
+
+    @staticmethod
+    def load(filename: str) -> "HashIndex":
+        """
+        :param filename: a file written by HashIndex.save
+        :return: the HashIndex saved in the file
+        """
+        with np.load(filename) as data:
+            index = HashIndex(int(data["chunks"]))
+            for name, value in zip(data["names"], data["hashes"]):
+                index.add(str(name), int(value))
+        return index
+
+
+def main(argv: List[str]) -> int:
+    """
+    Check references against an index of those already seen, as described
+    by the given command line arguments.
+    :param argv: command line arguments, excluding the program name
+    :return: exit status
+    """
+    parser = argparse.ArgumentParser(
+        description="Find re-photographed references before decoding them")
+    parser.add_argument("index", help=".npz index of references seen so "
+                                      "far. Created if it does not exist.")
+    parser.add_argument("references", nargs="+")
+    parser.add_argument("--radius", type=int, default=DUPLICATE_RADIUS,
+                        help="the greatest number of bits a duplicate's "
+                             "hash may differ by")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="do not add new references to the index")
+    args = parser.parse_args(argv)
+
+    index = HashIndex()
+    if os.path.exists(args.index):
+        index = HashIndex.load(args.index)
+
+    for reference in args.references:
+        img = cv2.imread(reference, cv2.IMREAD_COLOR)
+        if img is None:
+            print("{}\tunreadable".format(reference), file=sys.stderr)
+            continue
+        value = hash_image(img)
+        matches = index.query(value, args.radius)
+        if matches:
+            name, distance = matches[0]
+            print("{}\tduplicate of {} ({} bits)".format(reference, name,
+                                                         distance))
+        else:
+            print("{}\tnew".format(reference))
+            index.add(reference, value)
+
+    if not args.dry_run:
+        index.save(args.index)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
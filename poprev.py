@@ -1,9 +1,100 @@
 import numpy as np
 import cv2
+from concurrent.futures import Future
+from typing import List, Optional, Sequence, Tuple
+
+from autoclassify import ClassifierConfig, get_default_config
+from calibration import CalibrationProfile, CalibrationStore, \
+    get_image_size
+from exporter import export_indexed_async, get_bit_depth
+from gbtile import SHADES, encode_tiles, decode_tiles
+from history import History
+from ref_cache import ReferenceCache
+from residual import get_residuals, get_worst_cells, render_heatmap
+from timing import timed
 from util import get_range_around, highlight_sector, get_img_extract, \
-    get_img_sector
+    get_img_sector, get_sector_means, make_palette
 from constants import COLOURS, DRAW_HEIGHT, DRAW_WIDTH, HIGHLIGHT_COLOUR, \
-    COLOUR_UNKNOWN
+    COLOUR_UNKNOWN, COLOUR_UNKNOWN_RGB, MAX_COLOURS, DRAWING_HEADER
+
+
+def check_geometry(width: int, height: int,
+                   colours: Sequence[Tuple[int, int, int]]) -> None:
+    """
+    Check that a drawing of the given size and palette can be edited and
+    saved, raising ValueError if not.
+    :param width: width of the drawing
+    :param height: height of the drawing
+    :param colours: the RGB value of each colour of the drawing
+    """
+    if width < 1 or height < 1:
+        raise ValueError("invalid drawing size: {}x{}".format(width, height))
+    if not 1 <= len(colours) <= MAX_COLOURS:
+        raise ValueError("drawings must have between 1 and {} colours"
+                         .format(MAX_COLOURS))
+
+
+def format_header(width: int, height: int,
+                  colours: Sequence[Tuple[int, int, int]]) -> str:
+    """
+    :param width: width of a drawing
+    :param height: height of a drawing
+    :param colours: the RGB value of each colour of the drawing
+    :return: the first line of the drawing's file, without a line break
+    """
+    return " ".join([DRAWING_HEADER, str(width), str(height)] +
+                    ["{:02x}{:02x}{:02x}".format(*colour)
+                     for colour in colours])
+
+
+def parse_header(line: str) -> Tuple[int, int, List[Tuple[int, int, int]]]:
+    """
+    :param line: a line written by format_header
+    :return: the width, height and colours of the drawing it describes
+    """
+    try:
+        _, width, height, *hexes = line.split()
+        width, height = int(width), int(height)
+        colours = [(int(h[0:2], 16), int(h[2:4], 16), int(h[4:6], 16))
+                   for h in hexes if len(h) == 6]
+    except ValueError:
+        raise ValueError("invalid drawing header: {}".format(line.strip()))
+    if len(colours) != len(hexes):
+        raise ValueError("invalid drawing header: {}".format(line.strip()))
+
+    check_geometry(width, height, colours)
+    return width, height, colours
+
+
+def read_drawing(filename: str) \
+        -> Tuple[np.ndarray, List[Tuple[int, int, int]]]:
+    """
+    Read a drawing saved by PopRev.save_drawing_as. Drawings saved without a
+    header have the default size and palette.
+    :param filename: the drawing to read
+    :return: the colour of every pixel of the drawing, and the RGB value of
+    each of its colours
+    """
+    with open(filename, "r") as file:
+        lines = file.read().splitlines()
+
+    width, height, colours = DRAW_WIDTH, DRAW_HEIGHT, list(COLOURS)
+    if lines and lines[0].startswith(DRAWING_HEADER):
+        width, height, colours = parse_header(lines.pop(0))
+
+    if len(lines) > height or any(len(line) > width for line in lines):
+        raise ValueError("{} is larger than {}x{}".format(filename, width,
+                                                          height))
+
+    selections = np.full((height, width), COLOUR_UNKNOWN, dtype=np.uint8)
+    for i, line in enumerate(lines):
+        row = np.frombuffer(line.encode("ascii"), dtype=np.uint8) - ord("0")
+        if np.any(row > 9):
+            raise ValueError("invalid pixel on line {} of {}"
+                             .format(i + 1, filename))
+        selections[i, :len(row)] = row
+
+    return selections, colours
 
 
 class PopRev(object):
@@ -11,16 +102,42 @@ class PopRev(object):
     The model for the Picture of Picture Reverser application.
     """
 
-    def __init__(self):
+    def __init__(self, ref_cache: Optional[ReferenceCache] = None,
+                 calibrations: Optional[CalibrationStore] = None):
         """
         Initialise the model
+        :param ref_cache: cache of preprocessed reference images. If not
+        given, the default on-disk cache is used.
+        :param calibrations: calibration profiles used to rectify reference
+        images. If not given, the default profile directory is used.
         """
         self._ref = None
+        # mean colour of each sector of the reference image, for the size of
+        # drawing it was last calculated for
+        self._ref_means = None
+
+        if ref_cache is None:
+            ref_cache = ReferenceCache()
+        self._ref_cache = ref_cache
+
+        if calibrations is None:
+            calibrations = CalibrationStore()
+        self._calibrations = calibrations
 
-        # the drawing as it appears when exported
-        self._export = None
         # internal representation of the drawing
         self._selections = None
+        # the RGB value of each colour of the drawing
+        self._colours = list(COLOURS)
+        # maps each value of self._selections to the RGB colour it is drawn
+        # with
+        self._palette = make_palette(self._colours, COLOUR_UNKNOWN + 1,
+                                     COLOUR_UNKNOWN_RGB)
+        # the drawing as it appears when exported, rendered from
+        # self._selections on demand
+        self._export = None
+
+        # changes to the drawing that can be undone or redone
+        self._history = History()
 
         # name of file the drawing will be saved to
         self._save_name = None
@@ -29,6 +146,7 @@ class PopRev(object):
 
         self.new_drawing()
 
+    @timed("PopRev.get_selection")
     def get_selection(self, x: int, y: int) -> int:
         """
         :param x: x coordinate to retrieve from
@@ -37,14 +155,47 @@ class PopRev(object):
         """
         return self._selections[y, x]
 
+    def get_selections(self) -> np.ndarray:
+        """
+        :return: the colour of every pixel of the drawing. The returned array
+        is shared with this model, and must not be modified.
+        """
+        return self._selections
+
+    def get_width(self) -> int:
+        """
+        :return: the width of the drawing, in pixels
+        """
+        return self._selections.shape[1]
+
+    def get_height(self) -> int:
+        """
+        :return: the height of the drawing, in pixels
+        """
+        return self._selections.shape[0]
+
+    def get_colours(self) -> List[Tuple[int, int, int]]:
+        """
+        :return: the RGB value of each colour of the drawing, in order
+        """
+        return list(self._colours)
+
+    def get_colour_count(self) -> int:
+        """
+        :return: the number of colours of the drawing
+        """
+        return len(self._colours)
+
     def get_ref_sector(self, x: int, y: int) -> np.ndarray:
         """
         :param x: x coordinate to retrieve from
         :param y: y coordinate to retrieve from
         :return: sector (x,y) of the reference image
         """
-        return get_img_sector(self._ref, x, y, DRAW_WIDTH, DRAW_HEIGHT)
+        return get_img_sector(self._ref, x, y, self.get_width(),
+                              self.get_height())
 
+    @timed("PopRev.get_ref_context")
     def get_ref_context(self, x: int, y: int, width: int, height: int,
                         level: int) -> np.ndarray:
         """
@@ -57,11 +208,11 @@ class PopRev(object):
         surrounding area. The output will be (2 * level + 1) sectors high and
         wide.
         """
-        xl, xu = get_range_around(x, 0, DRAW_WIDTH - 1, level)
-        yl, yu = get_range_around(y, 0, DRAW_HEIGHT - 1, level)
+        xl, xu = get_range_around(x, 0, self.get_width() - 1, level)
+        yl, yu = get_range_around(y, 0, self.get_height() - 1, level)
 
-        extract = get_img_extract(self._ref, xl, xu, yl, yu, DRAW_WIDTH,
-                                  DRAW_HEIGHT)
+        extract = get_img_extract(self._ref, xl, xu, yl, yu,
+                                  self.get_width(), self.get_height())
 
         resize = cv2.resize(extract, (width, height),
                             interpolation=cv2.INTER_NEAREST)
@@ -71,16 +222,130 @@ class PopRev(object):
 
         return resize
 
+    @timed("PopRev.get_ref_tile")
+    def get_ref_tile(self, x: int, y: int, columns: int, rows: int,
+                     cell_width: int, cell_height: int) -> np.ndarray:
+        """
+        :param x: x coordinate of the top left sector of the tile
+        :param y: y coordinate of the top left sector of the tile
+        :param columns: how many sectors wide the tile is
+        :param rows: how many sectors high the tile is
+        :param cell_width: width each sector is drawn at, in pixels
+        :param cell_height: height each sector is drawn at, in pixels
+        :return: the given sectors of the reference image, scaled so that
+        each is cell_width x cell_height pixels. Tiles at the right and
+        bottom edges of the drawing are cut short.
+        """
+        xu = min(x + columns, self.get_width()) - 1
+        yu = min(y + rows, self.get_height()) - 1
+
+        extract = get_img_extract(self._ref, x, xu, y, yu, self.get_width(),
+                                  self.get_height())
+
+        return cv2.resize(extract, ((xu - x + 1) * cell_width,
+                                    (yu - y + 1) * cell_height),
+                          interpolation=cv2.INTER_NEAREST)
+
+    @timed("PopRev.get_preview")
     def get_preview(self, x: int, y: int) -> np.ndarray:
         """
         :param x: x coordinate to retrieve from
         :param y: y coordinate to retrieve from
         :return: the entire drawing, but with the pixel at (x,y) highlighted
         """
-        preview = np.copy(self._export)
+        preview = np.copy(self.get_drawing())
         preview[y, x] = HIGHLIGHT_COLOUR
         return preview
 
+    def get_ref_means(self) -> Optional[np.ndarray]:
+        """
+        :return: the mean BGR colour of the sector of the reference image
+        under each pixel of the drawing, or None if no reference has been
+        loaded
+        """
+        if self._ref is None:
+            return None
+        if self._ref_means is None or \
+                self._ref_means.shape[:2] != self._selections.shape:
+            self._ref_means = get_sector_means(self._ref, self.get_width(),
+                                               self.get_height())
+        return self._ref_means
+
+    def get_residuals(self) -> Optional[np.ndarray]:
+        """
+        :return: how far the intensity of each pixel of the drawing is from
+        that of the corresponding sector of the reference, as returned by
+        residual.get_residuals, or None if no reference has been loaded
+        """
+        ref_means = self.get_ref_means()
+        if ref_means is None:
+            return None
+        return get_residuals(self._selections, self._palette, ref_means,
+                             len(self._colours))
+
+    def get_worst_cells(self, count: int) -> List[Tuple[int, int]]:
+        """
+        :param count: the maximum number of pixels to return
+        :return: the (x, y) coordinates of the classified pixels that differ
+        most from the reference, worst first
+        """
+        residuals = self.get_residuals()
+        if residuals is None:
+            return []
+        return get_worst_cells(residuals, count)
+
+    def get_residual_preview(self, x: int, y: int, opacity: float) \
+            -> np.ndarray:
+        """
+        :param x: x coordinate to retrieve from
+        :param y: y coordinate to retrieve from
+        :param opacity: how strongly to draw the heatmap, from 0 to 1
+        :return: the entire drawing, overlaid with a heatmap of how far each
+        pixel is from the reference, with the pixel at (x,y) highlighted
+        """
+        residuals = self.get_residuals()
+        if residuals is None:
+            return self.get_preview(x, y)
+
+        preview = render_heatmap(self.get_drawing(), residuals, opacity,
+                                 len(self._colours))
+        preview[y, x] = HIGHLIGHT_COLOUR
+        return preview
+
+    @timed("PopRev.get_drawing")
+    def get_drawing(self) -> np.ndarray:
+        """
+        :return: the drawing as it appears when exported. The returned array
+        is shared with this model, and must not be modified.
+        """
+        if self._export is None:
+            self._export = np.take(self._palette, self._selections, axis=0)
+        return self._export
+
+    def set_palette(self, colours: Sequence[Tuple[int, int, int]]) -> None:
+        """
+        Change the colours of the drawing. Pixels of colours beyond the end
+        of the new palette become unknown.
+        :param colours: the RGB values to draw each colour with, in order
+        """
+        check_geometry(self.get_width(), self.get_height(), colours)
+        self._record_snapshot()
+
+        self._selections[self._selections >= len(colours)] = COLOUR_UNKNOWN
+        self._set_colours(colours)
+        self._export = None
+        self._unsaved_changes = True
+
+    def _set_colours(self, colours: Sequence[Tuple[int, int, int]]) -> None:
+        """
+        Replace the palette of the drawing, without checking it.
+        :param colours: the RGB value of each colour of the drawing
+        """
+        self._colours = [tuple(int(v) for v in colour) for colour in colours]
+        self._palette = make_palette(self._colours, COLOUR_UNKNOWN + 1,
+                                     COLOUR_UNKNOWN_RGB)
+
+    @timed("PopRev.edit_drawing")
     def edit_drawing(self, x: int, y: int, colour: int) -> None:
         """
         Set the colour of the drawing at position (x,y)
@@ -88,16 +353,160 @@ class PopRev(object):
         :param y: y coordinate of pixel to edit
         :param colour: colour to set the pixel to
         """
-        self._export[y, x] = COLOURS[colour]
+        old = self._selections[y, x]
+        if old != colour:
+            self._history.record_edit(x, y, int(old), colour)
+
         self._selections[y, x] = colour
+        if self._export is not None:
+            self._export[y, x] = self._palette[colour]
         self._unsaved_changes = True
 
+    def undo(self) -> bool:
+        """
+        Undo the most recent change to the drawing
+        :return: True if there was a change to undo
+        """
+        drawing = self._history.undo(self._selections, self._colours,
+                                     self._save_name, self._unsaved_changes)
+        if drawing is None:
+            return False
+        self._set_drawing(*drawing)
+        return True
+
+    def redo(self) -> bool:
+        """
+        Redo the most recently undone change to the drawing
+        :return: True if there was a change to redo
+        """
+        drawing = self._history.redo(self._selections, self._colours,
+                                     self._save_name, self._unsaved_changes)
+        if drawing is None:
+            return False
+        self._set_drawing(*drawing)
+        return True
+
+    def can_undo(self) -> bool:
+        """
+        :return: True if there is a change to the drawing that can be undone
+        """
+        return self._history.can_undo()
+
+    def can_redo(self) -> bool:
+        """
+        :return: True if there is a change to the drawing that can be redone
+        """
+        return self._history.can_redo()
+
+    def _record_snapshot(self) -> None:
+        """
+        Record the whole drawing, its palette and the file it is saved to,
+        before they are changed at once
+        """
+        self._history.record_snapshot(self._selections, self._colours,
+                                      self._save_name,
+                                      self._unsaved_changes)
+
+    def _set_drawing(self, selections: np.ndarray,
+                     colours: Sequence[Tuple[int, int, int]],
+                     save_name: Optional[str], unsaved: bool) -> None:
+        """
+        Replace the drawing after it has been changed by undo or redo
+        :param selections: the new colour of every pixel of the drawing
+        :param colours: the new palette of the drawing
+        :param save_name: the file the new drawing is saved to, so that
+        undoing a load never saves over the loaded file
+        :param unsaved: whether the new drawing has unsaved changes
+        """
+        self._selections = selections
+        self._set_colours(colours)
+        self._export = None
+        self._save_name = save_name
+        self._unsaved_changes = unsaved
+
     def export_drawing(self, filename: str) -> None:
         """
         Export the drawing as an image
         :param filename: the file to save the exported image to
         """
-        cv2.imwrite(filename, self._export)
+        cv2.imwrite(filename, self.get_drawing())
+
+    def export_indexed(self, filename: str, scales: Sequence[int] = (1,),
+                       bits: Optional[int] = None,
+                       palette: Optional[Sequence[Tuple[int, int, int]]] =
+                       None) -> Future:
+        """
+        Export the drawing as indexed colour PNGs on a background thread
+        :param filename: the file to save the native size export to
+        :param scales: the integer factors to upscale the export by
+        :param bits: the bit depth of the exported images, one of
+        exporter.BIT_DEPTHS. If not given, the smallest depth that holds
+        every colour of the drawing is used.
+        :param palette: the RGB values to export each colour with. If not
+        given, the palette the drawing is rendered with is used.
+        :return: a Future resolving to the filenames of the images written
+        """
+        if bits is None:
+            bits = get_bit_depth(len(self._colours))
+        if palette is None:
+            lut = self._palette
+        else:
+            lut = make_palette(palette, COLOUR_UNKNOWN + 1,
+                               COLOUR_UNKNOWN_RGB)
+        return export_indexed_async(filename, self._selections, lut, scales,
+                                    bits, len(self._colours))
+
+    def export_tiles(self, filename: str) -> None:
+        """
+        Export the drawing as raw Game Boy 2bpp tile data
+        :param filename: the file to save the tile data to
+        """
+        if len(self._colours) > SHADES:
+            raise ValueError("tile data holds at most {} colours"
+                             .format(SHADES))
+        with open(filename, "wb") as file:
+            file.write(encode_tiles(self._selections).tobytes())
+
+    def import_tiles(self, filename: str) -> None:
+        """
+        Replace the drawing with one decoded from raw Game Boy 2bpp tile data.
+        The imported drawing is the same size as the current one, and has the
+        default palette.
+        :param filename: the tile data to import
+        """
+        with open(filename, "rb") as file:
+            data = np.frombuffer(file.read(), dtype=np.uint8)
+
+        selections = decode_tiles(data, self.get_width(), self.get_height())
+        self._record_snapshot()
+        self._selections = selections
+        self._set_colours(COLOURS)
+        self._export = None
+        self._save_name = None
+        self._unsaved_changes = True
+
+    @timed("PopRev.auto_classify")
+    def auto_classify(self, config: Optional[ClassifierConfig] = None) \
+            -> bool:
+        """
+        Replace the drawing with one classified automatically from the
+        reference. The drawing keeps its size and palette.
+        :param config: how to classify the reference. If not given, the
+        configuration named by POPREV_CLASSIFIER is used.
+        :return: True if there was a reference to classify
+        """
+        if self._ref is None:
+            return False
+        if config is None:
+            config = get_default_config()
+
+        selections = config.classify(self._ref, self.get_width(),
+                                     self.get_height(), self._colours)
+        self._record_snapshot()
+        self._selections = selections
+        self._export = None
+        self._unsaved_changes = True
+        return True
 
     def save_drawing(self) -> None:
         """
@@ -106,53 +515,113 @@ class PopRev(object):
         self.save_drawing_as(self._save_name)
         self._unsaved_changes = False
 
+    @timed("PopRev.save_drawing_as")
     def save_drawing_as(self, filename: str) -> None:
         """
-        Save the current drawing to the specified file
+        Save the current drawing to the specified file. The first line holds
+        its size and palette, as written by format_header, and each
+        following line holds one row of pixels, one digit per pixel.
         :param filename: the file to save the drawing to
         """
-        file = open(filename, "w")
-        out = ""
-        for row in self._selections:
-            for cell in row:
-                out = "{}{}".format(out, str(cell))
-            out = "{}{}".format(out, "\n")
+        digits = self._selections + np.uint8(ord("0"))
+        newlines = np.full((self.get_height(), 1), ord("\n"), dtype=np.uint8)
+        rows = np.concatenate((digits, newlines), axis=1)
 
-        file.write(out)
-        file.close()
+        with open(filename, "w") as file:
+            file.write(format_header(self.get_width(), self.get_height(),
+                                     self._colours) + "\n")
+            file.write(rows.tobytes().decode("ascii"))
         self._unsaved_changes = False
 
         self._save_name = filename
 
+    @timed("PopRev.load_drawing")
     def load_drawing(self, filename: str) -> None:
         """
         Load the specified drawing
         :param filename: the drawing to load
         """
-
-        file = open(filename, "r")
-
-        for i, line in enumerate(file):
-            line = line[:-1]
-            for j, cell in enumerate(line):
-                colour = int(cell)
-                self._selections[i, j] = colour
-
-                if not (0 <= colour < 4):
-                    self._export[i, j] = COLOURS[3]
-                else:
-                    self._export[i, j] = COLOURS[colour]
-
-        file.close()
+        selections, colours = read_drawing(filename)
+        self._record_snapshot()
+        self._selections = selections
+        self._set_colours(colours)
+        self._export = None
         self._save_name = filename
         self._unsaved_changes = False
 
+    @timed("PopRev.load_reference")
     def load_reference(self, filename: str) -> None:
         """
         Load the specified reference image
         :param filename: the reference image to load
         """
+        # references from a calibrated rig are rectified with the rig's
+        # profile, which is found from the image size alone
+        profile = None
+        size = get_image_size(filename)
+        if size is not None:
+            profile = self._calibrations.get(size)
+
+        try:
+            key = self._ref_cache.key(filename, self._ref_params(profile))
+        except OSError:
+            key = None
+
+        if key is not None:
+            cached = self._ref_cache.load(key)
+            if cached is not None:
+                self._ref, self._ref_means = cached
+                return
+
         self._ref = cv2.imread(filename, cv2.IMREAD_COLOR)
+        if self._ref is None:
+            self._ref_means = None
+            return
+
+        if profile is not None and profile.applies_to(self._ref):
+            self._ref = profile.rectify(self._ref)
+
+        self._ref_means = None
+        ref_means = self.get_ref_means()
+
+        if key is not None:
+            self._ref_cache.store_async(key, self._ref, ref_means)
+
+    def _ref_params(self, profile: Optional[CalibrationProfile]) -> tuple:
+        """
+        :param profile: the calibration profile the reference is rectified
+        with, if any
+        :return: the parameters that determine how a reference image is
+        preprocessed. References are only reused from the cache if these
+        match.
+        """
+        calibration = None if profile is None else profile.digest()
+        return "v1", cv2.IMREAD_COLOR, self.get_width(), self.get_height(), \
+            calibration
+
+    def calibrate_reference(self, filename: str,
+                            corners: Sequence[Tuple[float, float]],
+                            camera_matrix: Optional[np.ndarray] = None,
+                            dist_coeffs: Optional[np.ndarray] = None) -> None:
+        """
+        Save a calibration profile that rectifies every reference the same
+        size as the given one, then load the given reference with it.
+        :param filename: a raw reference image
+        :param corners: the top left, top right, bottom right and bottom left
+        corners of the picture in the raw reference, in pixels
+        :param camera_matrix: intrinsics of the lens, if it is to be
+        undistorted
+        :param dist_coeffs: distortion coefficients of the lens
+        """
+        size = get_image_size(filename)
+        if size is None:
+            raise ValueError("cannot read {}".format(filename))
+
+        profile = CalibrationProfile.from_corners(
+            size, corners, camera_matrix=camera_matrix,
+            dist_coeffs=dist_coeffs)
+        self._calibrations.put(profile)
+        self.load_reference(filename)
 
     def has_reference(self) -> bool:
         """
@@ -160,6 +629,14 @@ class PopRev(object):
         """
         return self._ref is not None
 
+    def get_reference(self) -> Optional[np.ndarray]:
+        """
+        :return: the reference image as loaded, after any rectification, or
+        None if no reference has been loaded. The returned array is shared
+        with this model, and must not be modified.
+        """
+        return self._ref
+
     def get_save_name(self) -> str:
         """
         :return: the filename of the current drawing
@@ -172,13 +649,26 @@ class PopRev(object):
         """
         return self._unsaved_changes
 
-    def new_drawing(self) -> None:
+    def new_drawing(self, width: int = DRAW_WIDTH, height: int = DRAW_HEIGHT,
+                    colours: Optional[Sequence[Tuple[int, int, int]]] = None) \
+            -> None:
         """
         Set up model state for a blank drawing.
+        :param width: width of the new drawing
+        :param height: height of the new drawing
+        :param colours: the RGB value of each colour of the new drawing. If
+        not given, the default palette is used.
         """
-        self._export = np.ones((DRAW_HEIGHT, DRAW_WIDTH, 3),
-                               dtype=np.uint8) * 255
-        self._selections = np.ones((DRAW_HEIGHT, DRAW_WIDTH),
-                                   dtype=np.uint8) * COLOUR_UNKNOWN
+        if colours is None:
+            colours = COLOURS
+        check_geometry(width, height, colours)
+
+        if self._selections is not None:
+            self._record_snapshot()
+
+        self._export = None
+        self._selections = np.full((height, width), COLOUR_UNKNOWN,
+                                   dtype=np.uint8)
+        self._set_colours(colours)
         self._save_name = None
         self._unsaved_changes = False
@@ -1,14 +1,31 @@
+import time
 import tkinter as tk
-from tkinter import filedialog
+from collections import deque
+from tkinter import filedialog, messagebox, simpledialog
+from concurrent.futures import Future
 from typing import Callable
 
-from poprev import PopRev
+import startup
+from cursor import Cursor
 from navigator import Navigator
-from classifier import Classifier
-from preview import Preview
-from util import ask_save_before_doing
-from constants import DRAW_WIDTH, DRAW_HEIGHT, REF_CANVAS_WIDTH,\
-    REF_CANVAS_HEIGHT, PREVIEW_HEIGHT, PREVIEW_WIDTH, BACKGROUND_COLOUR
+from timing import timed, registry, OVERLAY_ENABLED
+from constants import DRAW_WIDTH, DRAW_HEIGHT, DRAW_MAX_SIZE, \
+    PREVIEW_HEIGHT, PREVIEW_WIDTH, BACKGROUND_COLOUR, EXPORT_POLL_MS, \
+    COLOUR_KEYS, MOVE_KEYS, UNDO_KEYS, REDO_KEYS, RESIDUAL_OPACITY, \
+    WORST_CELL_COUNT, NEXT_WORST_KEYS, ZOOM_IN_KEYS, ZOOM_OUT_KEYS
+
+# these depend on numpy, OpenCV and Pillow, so are only executed once they
+# are first used, after the window has been shown
+poprev = startup.lazy_import("poprev")
+session = startup.lazy_import("session")
+classifier = startup.lazy_import("classifier")
+preview = startup.lazy_import("preview")
+util = startup.lazy_import("util")
+
+
+# stages whose timings are displayed in the status bar
+STATUS_STAGES = ["refresh_components", "refresh_selector", "refresh_preview",
+                 "refresh_title", "refresh_navigator"]
 
 
 class PopRevApp(object):
@@ -27,17 +44,36 @@ class PopRevApp(object):
 
         self._file_menu = None
 
-        self._poprev = PopRev()
+        self._poprev = poprev.PopRev()
 
-        self._x = 0
-        self._y = 0
+        self._cursor = Cursor()
+        # the size and palette of the drawing the components were last laid
+        # out for
+        self._geometry = None
+        # navigation and classification inputs not yet applied, in the order
+        # they were received
+        self._inputs = deque()  # type: deque
+        self._drain_scheduled = False
+        self._recorder = None
+        if session.RECORD_FILE:
+            self._recorder = session.SessionRecorder(session.RECORD_FILE)
 
         self._classifier = None
         self._preview = None
         self._navigator = None
+        # status bar showing stage timings, if enabled
+        self._status = None
+
+        # whether the drawing preview shows a heatmap of residuals
+        self._show_residuals = tk.BooleanVar(master, value=False)
+        # pixels that differ most from the reference, and which of them was
+        # last jumped to
+        self._worst_cells = []
+        self._worst_index = -1
 
         self._setup_menu()
         self._setup_view()
+        self._setup_keys()
         self.refresh_components()
 
     def _smart_ask_save_before_doing(self, do_fn: Callable[[], None],
@@ -51,8 +87,8 @@ class PopRevApp(object):
         :param message: save prompt message
         """
         if self._poprev.unsaved_changes():
-            ask_save_before_doing(lambda: self._smart_save(), do_fn, title,
-                                  message)
+            util.ask_save_before_doing(lambda: self._smart_save(), do_fn,
+                                       title, message)
         else:
             do_fn()
 
@@ -67,18 +103,123 @@ class PopRevApp(object):
         frame = tk.Frame(self._master, bg=self._bg)
         frame.pack(side=tk.TOP)
 
-        self._classifier = Classifier(frame,
-                                      self.handle_select_callback,
-                                      bg=self._bg)
+        self._classifier = classifier.Classifier(
+            frame, self.handle_select_callback, self._poprev.get_ref_tile,
+            bg=self._bg, colours=self._poprev.get_colours())
         self._classifier.pack(side=tk.LEFT)
 
-        self._preview = Preview(frame, PREVIEW_WIDTH, PREVIEW_HEIGHT,
-                                callback=self._handle_preview_click)
+        self._preview = preview.Preview(frame, PREVIEW_WIDTH,
+                                        PREVIEW_HEIGHT,
+                                        callback=self.handle_preview_click)
         self._preview.pack(side=tk.LEFT)
 
+        if OVERLAY_ENABLED:
+            self._status = tk.Label(self._master, anchor=tk.W, bg=self._bg,
+                                    font=("Courier", 10))
+            self._status.pack(side=tk.BOTTOM, fill=tk.X)
+
         self._master.config(bg=self._bg)
         self._master.title("poprev")
-        self._master.protocol("WM_DELETE_WINDOW", self._exit)
+        self._master.protocol("WM_DELETE_WINDOW",
+                              self._after_inputs(self._exit))
+
+    def _setup_keys(self) -> None:
+        """
+        Set up keyboard shortcuts for classifying and navigating
+        """
+        for i, key in enumerate(COLOUR_KEYS):
+            self._master.bind("<Key-{}>".format(key),
+                              lambda evt, i=i: self._handle_key(
+                                  evt, self.handle_select_callback, i))
+        for key, direction in MOVE_KEYS.items():
+            self._master.bind("<Key-{}>".format(key),
+                              lambda evt, d=direction: self._handle_key(
+                                  evt, self.handle_move_callback, d))
+        for key in UNDO_KEYS:
+            self._master.bind(key, lambda evt: self.undo())
+        for key in REDO_KEYS:
+            self._master.bind(key, lambda evt: self.redo())
+        for key in NEXT_WORST_KEYS:
+            self._master.bind("<Key-{}>".format(key),
+                              lambda evt: self._handle_key(
+                                  evt, lambda _: self.next_worst_cell(),
+                                  None))
+        for key in ZOOM_IN_KEYS:
+            self._master.bind("<Key-{}>".format(key),
+                              lambda evt: self._handle_key(
+                                  evt, lambda _: self.zoom_in(), None))
+        for key in ZOOM_OUT_KEYS:
+            self._master.bind("<Key-{}>".format(key),
+                              lambda evt: self._handle_key(
+                                  evt, lambda _: self.zoom_out(), None))
+
+    def _handle_key(self, evt: tk.Event, handler: Callable, arg) -> None:
+        """
+        Handle a keyboard shortcut, unless it was typed into a text entry
+        :param evt: event object generated by the key press
+        :param handler: the function the shortcut triggers
+        :param arg: the argument to pass to handler
+        """
+        if isinstance(evt.widget, tk.Entry):
+            return
+        handler(arg)
+
+    def _queue_input(self, kind: str, *args) -> None:
+        """
+        Queue a navigation or classification input. Queued inputs are all
+        applied, in order, once Tk is idle, and the components are refreshed
+        once afterwards, so that inputs arriving faster than the components
+        can be refreshed are never dropped or reordered.
+        :param kind: the kind of input
+        :param args: the arguments of the input
+        """
+        self._inputs.append((kind, args))
+        if not self._drain_scheduled:
+            self._drain_scheduled = True
+            self._master.after_idle(self.drain_inputs)
+
+    def drain_inputs(self) -> None:
+        """
+        Apply every queued input, in order, then refresh the components.
+        """
+        self._drain_scheduled = False
+        if not self._inputs:
+            return
+
+        while self._inputs:
+            kind, args = self._inputs.popleft()
+            if kind == "select":
+                if args[0] >= self._poprev.get_colour_count():
+                    continue
+                x, y = self._cursor.get_position()
+                self._poprev.edit_drawing(x, y, *args)
+                self._cursor.next()
+            elif kind == "move":
+                self._cursor.move(*args)
+            elif kind == "jump":
+                self._cursor.jump(*args)
+            elif kind == "undo":
+                self._poprev.undo()
+            elif kind == "redo":
+                self._poprev.redo()
+
+            if kind in ("undo", "redo"):
+                # undoing may change the size of the drawing under later
+                # inputs
+                self._cursor.set_bounds(self._poprev.get_width(),
+                                        self._poprev.get_height())
+
+        self.refresh_components()
+
+    def _after_inputs(self, fn: Callable[[], None]) -> Callable[[], None]:
+        """
+        :param fn: a function that acts on the drawing or the cursor
+        :return: a function that applies any queued inputs before calling fn
+        """
+        def wrapper() -> None:
+            self.drain_inputs()
+            fn()
+        return wrapper
 
     def _exit(self) -> None:
         """
@@ -86,8 +227,16 @@ class PopRevApp(object):
         """
         title = "Save Before Exiting?"
         message = "Would you like to save this drawing before exiting?"
-        self._smart_ask_save_before_doing(lambda: self._master.destroy(),
-                                          title, message)
+        self._smart_ask_save_before_doing(lambda: self._quit(), title,
+                                          message)
+
+    def _quit(self) -> None:
+        """
+        Exit the application immediately
+        """
+        if self._recorder is not None:
+            self._recorder.close()
+        self._master.destroy()
 
     def _setup_menu(self) -> None:
         """
@@ -105,19 +254,56 @@ class PopRevApp(object):
         drawing_menu = tk.Menu(file_menu)
         file_menu.add_cascade(label="Drawing", menu=drawing_menu)
 
+        # apply any queued inputs before acting on the drawing
+        after_inputs = self._after_inputs
+
         reference_menu.add_command(label="Load Reference",
-                                   command=self.load_reference)
+                                   command=after_inputs(self.load_reference))
 
         drawing_menu.add_command(label="New Drawing",
-                                 command=self.try_new_drawing)
+                                 command=after_inputs(self.try_new_drawing))
+        drawing_menu.add_command(label="New Drawing of Size",
+                                 command=after_inputs(
+                                     self.try_new_drawing_of_size))
         drawing_menu.add_command(label="Load Drawing",
-                                 command=self.try_load_drawing)
+                                 command=after_inputs(self.try_load_drawing))
         drawing_menu.add_command(label="Save Drawing",
-                                 command=self._smart_save)
+                                 command=after_inputs(self._smart_save))
         drawing_menu.add_command(label="Save Drawing As",
-                                 command=self.save_drawing_as)
+                                 command=after_inputs(self.save_drawing_as))
         drawing_menu.add_command(label="Export Drawing",
-                                 command=self.export_drawing)
+                                 command=after_inputs(self.export_drawing))
+        drawing_menu.add_command(label="Import Tiles",
+                                 command=after_inputs(self.try_import_tiles))
+        drawing_menu.add_command(label="Export Tiles",
+                                 command=after_inputs(self.export_tiles))
+
+        edit_menu = tk.Menu(menu_bar)
+        menu_bar.add_cascade(label="Edit", menu=edit_menu)
+
+        edit_menu.add_command(label="Undo", accelerator="Ctrl+Z",
+                              command=self.undo)
+        edit_menu.add_command(label="Redo", accelerator="Ctrl+Y",
+                              command=self.redo)
+        edit_menu.add_separator()
+        edit_menu.add_command(label="Auto Classify",
+                              command=after_inputs(self.auto_classify))
+
+        view_menu = tk.Menu(menu_bar)
+        menu_bar.add_cascade(label="View", menu=view_menu)
+
+        view_menu.add_checkbutton(label="Show Residuals",
+                                  variable=self._show_residuals,
+                                  command=self.refresh_preview)
+        view_menu.add_command(label="Review Worst Cells",
+                              command=after_inputs(self.review_worst_cells))
+        view_menu.add_command(label="Next Worst Cell", accelerator="N",
+                              command=after_inputs(self.next_worst_cell))
+        view_menu.add_separator()
+        view_menu.add_command(label="Zoom In", accelerator="+",
+                              command=self.zoom_in)
+        view_menu.add_command(label="Zoom Out", accelerator="-",
+                              command=self.zoom_out)
 
         self._file_menu = file_menu
 
@@ -131,15 +317,25 @@ class PopRevApp(object):
         else:
             self.save_drawing()
 
-    def _handle_preview_click(self, x: int, y: int) -> None:
+    def _record(self, kind: str, *args) -> None:
+        """
+        Record a user-level event, if this session is being recorded.
+        :param kind: the kind of event
+        :param args: the arguments of the event
+        """
+        if self._recorder is not None:
+            self._recorder.record(kind, *args)
+
+    def handle_preview_click(self, x: int, y: int) -> None:
         """
         Handle the event when the drawing preview is clicked.
         :param x: the x coordinate that was clicked
         :param y: the y coordinate that was clicked
         """
-        jumpx = int(x * DRAW_WIDTH / PREVIEW_WIDTH)
-        jumpy = int(y * DRAW_HEIGHT / PREVIEW_HEIGHT)
-        self.jump_to(jumpx, jumpy)
+        self._record("preview", x, y)
+        scale = util.get_preview_scale(self._poprev.get_width(),
+                                       self._poprev.get_height())
+        self._queue_input("jump", x // scale, y // scale)
 
     def load_reference(self) -> None:
         """
@@ -153,8 +349,16 @@ class PopRevApp(object):
                                               )
                                               )
         if filename != "":
-            self._poprev.load_reference(filename)
-            self.refresh_components()
+            self.open_reference(filename)
+
+    def open_reference(self, filename: str) -> None:
+        """
+        Load the specified reference image
+        :param filename: the reference image to load
+        """
+        self._record("load_reference", filename)
+        self._poprev.load_reference(filename)
+        self.refresh_components()
 
     def next_pixel(self) -> None:
         """
@@ -162,9 +366,7 @@ class PopRevApp(object):
         left-most pixel in the next row down if the former does not apply (or
         go back to top left if current is bottom right)
         """
-        self._x = (self._x + 1) % DRAW_WIDTH
-        if self._x == 0:
-            self._y = (self._y + 1) % DRAW_HEIGHT
+        self._cursor.next()
 
         self.refresh_components()
 
@@ -173,14 +375,7 @@ class PopRevApp(object):
         Move to the next pixel in the specified direction.
         :param direction: the direction to move
         """
-        if direction == "up":
-            self._y = (self._y - 1) % DRAW_HEIGHT
-        elif direction == "right":
-            self._x = (self._x + 1) % DRAW_WIDTH
-        elif direction == "down":
-            self._y = (self._y + 1) % DRAW_HEIGHT
-        elif direction == "left":
-            self._x = (self._x - 1) % DRAW_WIDTH
+        self._cursor.move(direction)
 
         self.refresh_components()
 
@@ -190,59 +385,163 @@ class PopRevApp(object):
         :param x: x coordinate of position to jump to
         :param y: y coordinate of position to jump to
         """
-        self._x = x
-        self._y = y
+        self._cursor.jump(x, y)
 
         self.refresh_components()
 
+    @timed("refresh_components")
     def refresh_components(self) -> None:
         """
         Refresh appearance of GUI components
         """
+        self.refresh_geometry()
         self.refresh_selector()
         self.refresh_preview()
         self.refresh_title()
         self.refresh_navigator()
 
+        if self._status is not None:
+            # wait until this refresh has been recorded before displaying it
+            self._master.after_idle(self.refresh_status)
+
+    def refresh_status(self) -> None:
+        """
+        Refresh the stage timings displayed in the status bar
+        """
+        self._status.config(text=registry.format_summary(STATUS_STAGES))
+
+    def refresh_geometry(self) -> None:
+        """
+        Fit the cursor, navigator, drawing preview and colour selector to
+        the size and palette of the drawing, if they have changed
+        """
+        width = self._poprev.get_width()
+        height = self._poprev.get_height()
+        colours = self._poprev.get_colours()
+        if self._geometry == (width, height, colours):
+            return
+
+        self._cursor.set_bounds(width, height)
+        self._navigator.set_bounds(width, height)
+
+        scale = util.get_preview_scale(width, height)
+        self._preview.set_size(scale * width, scale * height)
+
+        if self._geometry is not None and self._geometry[2] != colours:
+            self._classifier.set_colours(colours)
+        self._geometry = (width, height, colours)
+
+    @timed("refresh_preview")
     def refresh_preview(self) -> None:
         """
         Refresh the appearance of the drawing preview
         """
-        self._preview.display_image(self._poprev.get_preview(self._x, self._y))
+        x, y = self._cursor.get_position()
+        if self._show_residuals.get():
+            self._preview.display_image(
+                self._poprev.get_residual_preview(x, y, RESIDUAL_OPACITY))
+        else:
+            self._preview.display_image(self._poprev.get_preview(x, y))
 
         if self._poprev.has_reference():
-            image = self._poprev.get_ref_context(self._x, self._y,
-                                                 REF_CANVAS_WIDTH,
-                                                 REF_CANVAS_HEIGHT, 1)
-            self._classifier.display_image(image)
+            self._classifier.display_reference(self._poprev.get_reference(),
+                                               self._poprev.get_width(),
+                                               self._poprev.get_height(),
+                                               x, y)
         else:
             self._classifier.display_no_image_warning()
 
+    @timed("refresh_selector")
     def refresh_selector(self) -> None:
         """
         Refresh the appearance of the colour selector
         """
         selector = self._classifier.get_selector()
-        colour = self._poprev.get_selection(self._x, self._y)
+        colour = self._poprev.get_selection(*self._cursor.get_position())
 
-        if not (0 <= colour < 4):
+        if not (0 <= colour < self._poprev.get_colour_count()):
             colour = None
 
         selector.set_selected(colour)
 
+    @timed("refresh_navigator")
     def refresh_navigator(self) -> None:
         """
         Refresh the appearance of the navigator
         """
-        self._navigator.display_position(self._x + 1, self._y + 1)
+        x, y = self._cursor.get_position()
+        self._navigator.display_position(x + 1, y + 1)
 
     def handle_select_callback(self, identifier: int) -> None:
         """
         Handle the event when a colour is selected
         :param identifier: the id of the colour that was selected
         """
-        self._poprev.edit_drawing(self._x, self._y, identifier)
-        self.next_pixel()
+        self._record("select", identifier)
+        self._queue_input("select", identifier)
+
+    def review_worst_cells(self) -> None:
+        """
+        Find the pixels that differ most from the reference, and jump to the
+        worst of them
+        """
+        self._worst_cells = self._poprev.get_worst_cells(WORST_CELL_COUNT)
+        self._worst_index = -1
+        if not self._worst_cells:
+            messagebox.showinfo(title="Review Worst Cells",
+                                message="Load a reference and classify some "
+                                        "pixels to find the worst cells.")
+            return
+        self.next_worst_cell()
+
+    def next_worst_cell(self) -> None:
+        """
+        Jump to the next of the pixels found by review_worst_cells
+        """
+        if not self._worst_cells:
+            self.review_worst_cells()
+            return
+        self._worst_index = (self._worst_index + 1) % len(self._worst_cells)
+        self._queue_input("jump", *self._worst_cells[self._worst_index])
+
+    def zoom_in(self) -> None:
+        """
+        Show less of the reference around the current pixel
+        """
+        self._classifier.zoom_in()
+
+    def zoom_out(self) -> None:
+        """
+        Show more of the reference around the current pixel
+        """
+        self._classifier.zoom_out()
+
+    def undo(self) -> None:
+        """
+        Undo the most recent change to the drawing
+        """
+        self._record("undo")
+        self._queue_input("undo")
+
+    def redo(self) -> None:
+        """
+        Redo the most recently undone change to the drawing
+        """
+        self._record("redo")
+        self._queue_input("redo")
+
+    def auto_classify(self) -> None:
+        """
+        Classify every pixel of the drawing automatically from the reference
+        """
+        if not self._poprev.has_reference():
+            messagebox.showinfo(title="Auto Classify",
+                                message="Load a reference to classify the "
+                                        "drawing from.")
+            return
+        self._poprev.auto_classify()
+        self._record("auto")
+        self.refresh_components()
 
     def export_drawing(self) -> None:
         """
@@ -254,12 +553,71 @@ class PopRevApp(object):
                                                             "*.png"),)
                                                 )
         if filename != "":
-            self._poprev.export_drawing(filename)
+            future = self._poprev.export_indexed(filename)
+            self._watch_export(future)
+
+    def _watch_export(self, future: Future) -> None:
+        """
+        Wait for a background export to finish without blocking the editor,
+        and report it if the export failed.
+        :param future: the pending export
+        """
+        if not future.done():
+            self._master.after(EXPORT_POLL_MS,
+                               lambda: self._watch_export(future))
+            return
+
+        error = future.exception()
+        if error is not None:
+            messagebox.showerror(title="Export Failed", message=str(error))
+
+    def export_tiles(self) -> None:
+        """
+        Display a dialog allowing user to export the current drawing as raw
+        Game Boy tile data.
+        """
+        filename = filedialog.asksaveasfilename(title="Export Tiles",
+                                                filetypes=(("2bpp tile data",
+                                                            "*.2bpp"),)
+                                                )
+        if filename != "":
+            try:
+                self._poprev.export_tiles(filename)
+            except ValueError as e:
+                messagebox.showerror(title="Export Failed", message=str(e))
+
+    def import_tiles(self) -> None:
+        """
+        Display a dialog allowing the user to import raw Game Boy tile data
+        as a new drawing
+        """
+        filename = filedialog.askopenfilename(title="Import Tiles",
+                                              filetypes=(("2bpp tile data",
+                                                          "*.2bpp"),)
+                                              )
+        if filename != "":
+            try:
+                self._poprev.import_tiles(filename)
+            except ValueError as e:
+                messagebox.showerror(title="Import Failed", message=str(e))
+            self.refresh_components()
+
+    def try_import_tiles(self) -> None:
+        """
+        If there are unsaved changes to the current drawing, ask the user if
+        they would like to save before importing tile data.
+        """
+        title = "Save Before Importing?"
+        message = "Would you like to save this drawing before importing " \
+                  "another?"
+        self._smart_ask_save_before_doing(lambda: self.import_tiles(),
+                                          title, message)
 
     def save_drawing(self) -> None:
         """
         Save changes to the current drawing.
         """
+        self._record("save", self._poprev.get_save_name())
         self._poprev.save_drawing()
         self.refresh_title()
 
@@ -272,8 +630,16 @@ class PopRevApp(object):
                                                 filetypes=(("poprev drawing",
                                                             ".poprev"),))
         if filename != "":
-            self._poprev.save_drawing_as(filename)
-            self.refresh_title()
+            self.save_drawing_to(filename)
+
+    def save_drawing_to(self, filename: str) -> None:
+        """
+        Save the current drawing to the specified file
+        :param filename: the file to save the drawing to
+        """
+        self._record("save", filename)
+        self._poprev.save_drawing_as(filename)
+        self.refresh_title()
 
     def load_drawing(self) -> None:
         """
@@ -284,8 +650,16 @@ class PopRevApp(object):
                                                           ".poprev"),)
                                               )
         if filename != "":
-            self._poprev.load_drawing(filename)
-            self.refresh_components()
+            self.open_drawing(filename)
+
+    def open_drawing(self, filename: str) -> None:
+        """
+        Load the specified drawing
+        :param filename: the drawing to load
+        """
+        self._record("load_drawing", filename)
+        self._poprev.load_drawing(filename)
+        self.refresh_components()
 
     def try_load_drawing(self) -> None:
         """
@@ -298,13 +672,54 @@ class PopRevApp(object):
         self._smart_ask_save_before_doing(lambda: self.load_drawing(),
                                           title, message)
 
-    def new_drawing(self) -> None:
+    def new_drawing(self, width: int = DRAW_WIDTH,
+                    height: int = DRAW_HEIGHT) -> None:
         """
         Clear the current drawing and start a new one.
+        :param width: width of the new drawing
+        :param height: height of the new drawing
         """
-        self._poprev.new_drawing()
+        self._record("new", width, height)
+        self._poprev.new_drawing(width, height)
         self.refresh_components()
 
+    def new_drawing_of_size(self) -> None:
+        """
+        Display a dialog allowing the user to start a new drawing of a
+        particular size
+        """
+        size = simpledialog.askstring(
+            "New Drawing of Size", "Width x height, in pixels:",
+            initialvalue="{}x{}".format(DRAW_WIDTH, DRAW_HEIGHT),
+            parent=self._master)
+        if size is None:
+            return
+
+        width, _, height = size.lower().partition("x")
+        try:
+            width, height = int(width), int(height)
+        except ValueError:
+            width = height = 0
+        if not (1 <= width <= DRAW_MAX_SIZE and 1 <= height <= DRAW_MAX_SIZE):
+            messagebox.showerror(
+                title="New Drawing",
+                message="Invalid size: {}. Drawings can be up to {}x{} "
+                        "pixels.".format(size, DRAW_MAX_SIZE, DRAW_MAX_SIZE))
+            return
+        self.new_drawing(width, height)
+
+    def try_new_drawing_of_size(self) -> None:
+        """
+        If there are unsaved changes to the current drawing, ask the user if
+        they would like to save before starting a new drawing of a particular
+        size.
+        """
+        title = "Save Before Starting Over?"
+        message = "Would you like to save this drawing before starting " \
+                  "another?"
+        self._smart_ask_save_before_doing(lambda: self.new_drawing_of_size(),
+                                          title, message)
+
     def try_new_drawing(self) -> None:
         """
         If there are unsaved changes to the current drawing, ask the user if
@@ -322,7 +737,8 @@ class PopRevApp(object):
         the navigator are clicked.
         :param direction: the direction that was clicked
         """
-        self.move_to(direction)
+        self._record("move", direction)
+        self._queue_input("move", direction)
 
     def handle_jump_callback(self, x: int, y: int) -> None:
         """
@@ -330,8 +746,10 @@ class PopRevApp(object):
         :param x: the x coordinate to jump to
         :param y: the y coordinate to jump to
         """
-        self.jump_to(x - 1, y - 1)
+        self._record("jump", x, y)
+        self._queue_input("jump", x - 1, y - 1)
 
+    @timed("refresh_title")
     def refresh_title(self) -> None:
         """
         Refresh the title of the application window
@@ -348,6 +766,29 @@ class PopRevApp(object):
 
 
 if __name__ == "__main__":
+    startup.preload()
+
+    # show the window straight away, and build the application once it is
+    # visible, while the heavy modules are still being imported
     root = tk.Tk()
-    app = PopRevApp(root)
+    root.title("poprev")
+    splash = tk.Label(root, text="Loading...", bg=BACKGROUND_COLOUR, padx=80,
+                      pady=80)
+    splash.pack()
+    root.update()
+    startup.mark("window")
+
+    def build() -> None:
+        """
+        Replace the loading message with the application
+        """
+        began = time.perf_counter()
+        splash.destroy()
+        PopRevApp(root)
+        root.update_idletasks()
+        startup.mark("build", began)
+        startup.mark("ready")
+        startup.report()
+
+    root.after(0, build)
     root.mainloop()
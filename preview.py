@@ -4,6 +4,8 @@ from PIL import Image, ImageTk
 import numpy as np
 from typing import Callable, Optional
 
+from timing import timed
+
 
 class Preview(tk.Canvas):
     """
@@ -29,6 +31,20 @@ class Preview(tk.Canvas):
 
         self.bind("<Button-1>", self.handle_click)
 
+    def set_size(self, width: int, height: int) -> None:
+        """
+        Change the size of this Preview. Images are displayed at the new size
+        from the next call to display_image.
+        :param width: the new width of this Preview
+        :param height: the new height of this Preview
+        """
+        if (width, height) == (self._width, self._height):
+            return
+        self._width = width
+        self._height = height
+        self.config(width=width, height=height)
+
+    @timed("Preview.display_image")
     def display_image(self, arr: np.ndarray) -> None:
         """
         Display an image on this Preview.
@@ -0,0 +1,471 @@
+"""
+Projects of a whole Game Boy Camera cartridge: one drawing, and the
+reference it is drawn from, for each save slot.
+
+Slots can be assigned, listed and exported from the command line, e.g.
+
+    python3 project.py set cart.prj 1 drawings/mario.poprev -r refs/mario.jpg
+    python3 project.py list cart.prj
+    python3 project.py sheet cart.prj sheet.png --scale 2
+    python3 project.py gif cart.prj cart.gif --scale 2
+
+Slots are numbered from 1, as on the cartridge.
+"""
+import argparse
+import os
+import sys
+import numpy as np
+from PIL import Image
+from typing import List, Optional, Tuple
+
+from poprev import PopRev, read_drawing
+from exporter import export_indexed
+from util import make_palette
+from constants import COLOURS, COLOUR_UNKNOWN, COLOUR_UNKNOWN_RGB, \
+    DRAW_HEIGHT, DRAW_WIDTH, PROJECT_SLOTS, THUMBNAIL_STEP, \
+    CONTACT_SHEET_COLUMNS, CONTACT_SHEET_SPACING, ANIMATION_FRAME_MS
+
+
+class ProjectSlot(object):
+    """
+    A camera save slot of a Project, i.e. a drawing and the reference image
+    it is being drawn from.
+    """
+
+    def __init__(self, drawing: str, reference: Optional[str] = None):
+        """
+        Initialise this ProjectSlot
+        :param drawing: the file the drawing of this slot is saved to
+        :param reference: the reference image of this slot, if any
+        """
+        self.drawing = drawing
+        self.reference = reference
+
+
+class Project(object):
+    """
+    A whole Game Boy Camera cartridge: one drawing for each of its save
+    slots. Only the drawing being edited is held in memory, along with its
+    reference. Every other slot is kept on disk, apart from a small cached
+    thumbnail.
+    """
+
+    def __init__(self, slots: int = PROJECT_SLOTS):
+        """
+        Initialise an empty Project
+        :param slots: the number of save slots in this Project
+        """
+        self._slots = [None] * slots  # type: List[Optional[ProjectSlot]]
+
+        # index and model of the slot being edited
+        self._active = None
+        self._poprev = None
+
+        # thumbnails of drawings, by slot index
+        self._thumbnails = {}
+
+        self._save_name = None
+
+    def get_slot_count(self) -> int:
+        """
+        :return: the number of save slots in this Project
+        """
+        return len(self._slots)
+
+    def get_slot(self, index: int) -> Optional[ProjectSlot]:
+        """
+        :param index: index of the slot to retrieve
+        :return: the given slot, or None if it is empty
+        """
+        return self._slots[index]
+
+    def set_slot(self, index: int, drawing: str,
+                 reference: Optional[str] = None) -> None:
+        """
+        Assign a drawing and reference image to a slot. Raises ValueError if
+        the slot is active and has unsaved changes.
+        :param index: index of the slot to assign
+        :param drawing: the file the drawing of the slot is saved to
+        :param reference: the reference image of the slot, if any
+        """
+        if index == self._active:
+            self.deactivate()
+        self._slots[index] = ProjectSlot(drawing, reference)
+        self._thumbnails.pop(index, None)
+
+    def clear_slot(self, index: int) -> None:
+        """
+        Empty a slot. The files it refers to are left untouched. Raises
+        ValueError if the slot is active and has unsaved changes.
+        :param index: index of the slot to clear
+        """
+        if index == self._active:
+            self.deactivate()
+        self._slots[index] = None
+        self._thumbnails.pop(index, None)
+
+    def activate(self, index: int) -> PopRev:
+        """
+        Load the drawing and reference of a slot for editing. The previously
+        active slot is evicted from memory, which is refused if it has
+        changes that have not been saved with save_active.
+        :param index: index of the slot to edit
+        :return: the model of the slot's drawing
+        """
+        slot = self._slots[index]
+        if slot is None:
+            raise ValueError("slot {} is empty".format(index + 1))
+
+        self.deactivate()
+
+        poprev = PopRev()
+        if os.path.exists(slot.drawing):
+            poprev.load_drawing(slot.drawing)
+        if slot.reference is not None:
+            poprev.load_reference(slot.reference)
+
+        self._active = index
+        self._poprev = poprev
+        return poprev
+
+    def deactivate(self, discard: bool = False) -> None:
+        """
+        Evict the active slot from memory, if there is one. Raises
+        ValueError if the active slot has unsaved changes, unless they are
+        to be discarded.
+        :param discard: whether to discard any unsaved changes to the active
+        slot
+        """
+        if self._poprev is not None and self._poprev.unsaved_changes() and \
+                not discard:
+            raise ValueError("slot {} has unsaved changes"
+                             .format(self._active + 1))
+        self._active = None
+        self._poprev = None
+
+    def get_active(self) -> Optional[int]:
+        """
+        :return: index of the slot being edited, or None if there is none
+        """
+        return self._active
+
+    def save_active(self) -> None:
+        """
+        Save the drawing of the slot being edited to the slot's drawing file
+        """
+        if self._poprev is None:
+            return
+        self._poprev.save_drawing_as(self._slots[self._active].drawing)
+        self._thumbnails.pop(self._active, None)
+
+    def get_selections(self, index: int) -> np.ndarray:
+        """
+        :param index: index of the slot to retrieve from
+        :return: the colour of every pixel of the given slot's drawing. Empty
+        slots and unsaved drawings are entirely unknown, and the default
+        size.
+        """
+        return self._read(index)[0]
+
+    def _read(self, index: int) \
+            -> Tuple[np.ndarray, List[Tuple[int, int, int]]]:
+        """
+        :param index: index of the slot to retrieve from
+        :return: the colour of every pixel of the given slot's drawing, and
+        the RGB value of each of its colours
+        """
+        if index == self._active:
+            return self._poprev.get_selections(), self._poprev.get_colours()
+
+        slot = self._slots[index]
+        if slot is None or not os.path.exists(slot.drawing):
+            return np.full((DRAW_HEIGHT, DRAW_WIDTH), COLOUR_UNKNOWN,
+                           dtype=np.uint8), list(COLOURS)
+        return read_drawing(slot.drawing)
+
+    def get_thumbnail(self, index: int) -> np.ndarray:
+        """
+        :param index: index of the slot to retrieve from
+        :return: a downscaled RGB rendering of the given slot's drawing
+        """
+        if index == self._active:
+            # the active drawing changes with every edit, so never cache it
+            return self._render_thumbnail(*self._read(index))
+
+        if index not in self._thumbnails:
+            self._thumbnails[index] = self._render_thumbnail(
+                *self._read(index))
+        return self._thumbnails[index]
+
+    @staticmethod
+    def _render_thumbnail(selections: np.ndarray,
+                          colours: List[Tuple[int, int, int]]) -> np.ndarray:
+        """
+        :param selections: the colours of a drawing
+        :param colours: the RGB value of each colour of the drawing
+        :return: a downscaled RGB rendering of the given drawing
+        """
+        palette = make_palette(colours, COLOUR_UNKNOWN + 1,
+                               COLOUR_UNKNOWN_RGB)
+        return np.take(palette,
+                       selections[::THUMBNAIL_STEP, ::THUMBNAIL_STEP], axis=0)
+
+    def get_occupied(self) -> List[int]:
+        """
+        :return: indices of every slot that is not empty, in order
+        """
+        return [i for i, slot in enumerate(self._slots) if slot is not None]
+
+    def _stack(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Every drawing is remapped onto a palette shared by all of them, and
+        drawn at the top left of a frame the size of the largest drawing.
+        :return: an array of shape (slots, height, width) of the indices of
+        the colours of every occupied slot's drawing in the shared palette,
+        and the shared palette itself. Index 0 is unknown colour.
+        """
+        drawings = [self._read(index) for index in self.get_occupied()]
+        height = max([s.shape[0] for s, _ in drawings], default=DRAW_HEIGHT)
+        width = max([s.shape[1] for s, _ in drawings], default=DRAW_WIDTH)
+
+        # index of each RGB value in the shared palette
+        shared = {tuple(COLOUR_UNKNOWN_RGB): 0}
+        stack = np.zeros((len(drawings), height, width), dtype=np.uint8)
+        for i, (selections, colours) in enumerate(drawings):
+            lut = np.zeros(COLOUR_UNKNOWN + 1, dtype=np.uint8)
+            for j, colour in enumerate(colours):
+                index = shared.setdefault(tuple(colour), len(shared))
+                # checked before the index is stored, as it would not fit
+                if index > 255:
+                    raise ValueError("project has more than 256 distinct "
+                                     "colours")
+                lut[j] = index
+            stack[i, :selections.shape[0], :selections.shape[1]] = \
+                lut[selections]
+
+        return stack, np.array(list(shared), dtype=np.uint8).reshape(-1, 3)
+
+    def get_contact_sheet(self, columns: int = CONTACT_SHEET_COLUMNS,
+                          spacing: int = CONTACT_SHEET_SPACING) \
+            -> np.ndarray:
+        """
+        :param columns: the number of drawings in each row of the sheet
+        :param spacing: the number of pixels between adjacent drawings
+        :return: an RGB contact sheet of every occupied slot's drawing, laid
+        out in slot order. Gaps are unknown colour.
+        """
+        sheet, palette = self._layout(columns, spacing)
+        return np.take(palette, sheet, axis=0)
+
+    def _layout(self, columns: int, spacing: int) \
+            -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param columns: the number of drawings in each row of the sheet
+        :param spacing: the number of pixels between adjacent drawings
+        :return: the indices of the colours of a contact sheet, as described
+        by get_contact_sheet, in a palette shared by every drawing, and the
+        shared palette
+        """
+        stack, palette = self._stack()
+        rows = max(1, -(-len(stack) // columns))
+        height, width = stack.shape[1:]
+
+        # pad every drawing on the bottom and right, and pad the stack with
+        # blank drawings up to a whole number of rows, so that the sheet can
+        # be laid out with a single reshape
+        cells = np.zeros((rows * columns, height + spacing, width + spacing),
+                         dtype=np.uint8)
+        cells[:len(stack), :height, :width] = stack
+
+        cell_height, cell_width = cells.shape[1:]
+        sheet = cells.reshape(rows, columns, cell_height, cell_width)
+        sheet = sheet.transpose(0, 2, 1, 3).reshape(rows * cell_height,
+                                                    columns * cell_width)
+
+        # no spacing after the last row and column
+        return sheet[:sheet.shape[0] - spacing, :sheet.shape[1] - spacing], \
+            palette
+
+    def export_contact_sheet(self, filename: str, scale: int = 1,
+                             columns: int = CONTACT_SHEET_COLUMNS,
+                             spacing: int = CONTACT_SHEET_SPACING) -> str:
+        """
+        Export a contact sheet of every occupied slot's drawing as an indexed
+        colour PNG.
+        :param filename: the file to save the contact sheet to
+        :param scale: the integer factor to upscale the contact sheet by
+        :param columns: the number of drawings in each row of the sheet
+        :param spacing: the number of pixels between adjacent drawings
+        :return: the filename the contact sheet was written to
+        """
+        sheet, palette = self._layout(columns, spacing)
+        return export_indexed(filename, sheet, palette, (scale,), bits=8,
+                              colour_count=len(palette))[0]
+
+    def export_animation(self, filename: str, scale: int = 1,
+                         frame_ms: int = ANIMATION_FRAME_MS) -> None:
+        """
+        Export every occupied slot's drawing, in slot order, as the frames of
+        an animated GIF.
+        :param filename: the file to save the animation to
+        :param scale: the integer factor to upscale the animation by
+        :param frame_ms: how long each frame is shown for, in milliseconds
+        """
+        stack, palette = self._stack()
+        if len(stack) == 0:
+            raise ValueError("project has no drawings to animate")
+
+        stack = np.repeat(np.repeat(stack, scale, axis=1), scale, axis=2)
+        flat_palette = palette.flatten().tolist()
+
+        frames = []
+        for frame in stack:
+            img = Image.frombytes("P", (frame.shape[1], frame.shape[0]),
+                                  frame.tobytes())
+            img.putpalette(flat_palette)
+            frames.append(img)
+
+        frames[0].save(filename, format="GIF", save_all=True,
+                       append_images=frames[1:], duration=frame_ms, loop=0)
+
+    def save_project(self, filename: str) -> None:
+        """
+        Save the slot assignments of this Project. Each line of the file
+        holds the drawing and reference of one slot, separated by a tab, or
+        is blank if the slot is empty. Paths are stored relative to the
+        project file.
+        :param filename: the file to save the project to
+        """
+        base = os.path.dirname(os.path.abspath(filename))
+        lines = []
+        for slot in self._slots:
+            if slot is None:
+                lines.append("")
+                continue
+            reference = ""
+            if slot.reference is not None:
+                reference = os.path.relpath(slot.reference, base)
+            lines.append("{}\t{}".format(os.path.relpath(slot.drawing, base),
+                                         reference))
+
+        with open(filename, "w") as file:
+            file.write("\n".join(lines) + "\n")
+
+        self._save_name = filename
+
+    def load_project(self, filename: str) -> None:
+        """
+        Load slot assignments saved by save_project, replacing those of this
+        Project. Raises ValueError if the active slot has unsaved changes.
+        :param filename: the project to load
+        """
+        self.deactivate()
+        base = os.path.dirname(os.path.abspath(filename))
+        slots = [None] * len(self._slots)
+
+        with open(filename, "r") as file:
+            for i, line in enumerate(file):
+                line = line.rstrip("\n")
+                if i >= len(slots) or line == "":
+                    continue
+                drawing, _, reference = line.partition("\t")
+                slots[i] = ProjectSlot(
+                    os.path.join(base, drawing),
+                    os.path.join(base, reference) if reference else None)
+
+        self._slots = slots
+        self._thumbnails = {}
+        self._save_name = filename
+
+    def get_save_name(self) -> Optional[str]:
+        """
+        :return: the filename of this Project
+        """
+        return self._save_name
+
+
+def main(argv: List[str]) -> int:
+    """
+    Assign, list or export the slots of a project, as described by the
+    given command line arguments.
+    :param argv: command line arguments, excluding the program name
+    :return: exit status
+    """
+    parser = argparse.ArgumentParser(
+        description="Projects of a whole camera cartridge")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    set_ = commands.add_parser("set", help="assign a drawing to a slot. The "
+                                           "project is created if it does "
+                                           "not exist.")
+    set_.add_argument("project")
+    set_.add_argument("slot", type=int)
+    set_.add_argument("drawing", help=".poprev file of the slot")
+    set_.add_argument("-r", "--reference",
+                      help="reference image the drawing is drawn from")
+
+    clear = commands.add_parser("clear", help="empty a slot")
+    clear.add_argument("project")
+    clear.add_argument("slot", type=int)
+
+    list_ = commands.add_parser("list", help="list the slots of a project")
+    list_.add_argument("project")
+
+    sheet = commands.add_parser("sheet", help="export a contact sheet of "
+                                              "every drawing as a PNG")
+    sheet.add_argument("project")
+    sheet.add_argument("output")
+    sheet.add_argument("--scale", type=int, default=1)
+    sheet.add_argument("--columns", type=int, default=CONTACT_SHEET_COLUMNS)
+    sheet.add_argument("--spacing", type=int, default=CONTACT_SHEET_SPACING)
+
+    gif = commands.add_parser("gif", help="export every drawing as the "
+                                          "frames of an animated GIF")
+    gif.add_argument("project")
+    gif.add_argument("output")
+    gif.add_argument("--scale", type=int, default=1)
+    gif.add_argument("--frame-ms", type=int, default=ANIMATION_FRAME_MS)
+
+    args = parser.parse_args(argv)
+
+    project = Project()
+    if args.command != "set" or os.path.exists(args.project):
+        project.load_project(args.project)
+
+    if args.command in ("set", "clear"):
+        if not 1 <= args.slot <= project.get_slot_count():
+            print("slots are numbered from 1 to {}"
+                  .format(project.get_slot_count()), file=sys.stderr)
+            return 1
+        if args.command == "set":
+            project.set_slot(args.slot - 1, os.path.abspath(args.drawing),
+                             None if args.reference is None
+                             else os.path.abspath(args.reference))
+        else:
+            project.clear_slot(args.slot - 1)
+        project.save_project(args.project)
+        return 0
+
+    if args.command == "list":
+        for index in project.get_occupied():
+            slot = project.get_slot(index)
+            print("{}\t{}\t{}".format(index + 1, slot.drawing,
+                                      slot.reference or "-"))
+        return 0
+
+    try:
+        if args.command == "sheet":
+            written = project.export_contact_sheet(
+                args.output, args.scale, args.columns, args.spacing)
+            print("wrote {}".format(written))
+        else:
+            project.export_animation(args.output, args.scale, args.frame_ms)
+            print("wrote {}".format(args.output))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
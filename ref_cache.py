@@ -0,0 +1,181 @@
+import hashlib
+import os
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from constants import REF_CACHE_DIR, REF_CACHE_MAX_BYTES
+
+
+REF_SUFFIX = ".ref.npy"
+MEANS_SUFFIX = ".means.npy"
+
+# entries are written one at a time, after the reference they hold has been
+# shown, so that writing a large reference never delays loading it
+_executor = ThreadPoolExecutor(max_workers=1,
+                               thread_name_prefix="poprev-ref-cache")
+
+
+def file_digest(filename: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    :param filename: the file to hash
+    :param chunk_size: number of bytes to read at a time
+    :return: the hex SHA-1 digest of the contents of the given file
+    """
+    digest = hashlib.sha1()
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def flush() -> None:
+    """
+    Wait until every entry passed to ReferenceCache.store_async has been
+    stored.
+    """
+    _executor.submit(lambda: None).result()
+
+
+class ReferenceCache(object):
+    """
+    An on-disk cache of preprocessed reference images and their sector
+    means, keyed by the content of the reference file and the parameters
+    used to preprocess it. Entries are stored as .npy files so that they can
+    be memory-mapped when loaded, and the least recently used entries are
+    evicted once the cache grows past its size budget.
+    """
+
+    def __init__(self, directory: str = REF_CACHE_DIR,
+                 max_bytes: int = REF_CACHE_MAX_BYTES):
+        """
+        Initialise this ReferenceCache
+        :param directory: the directory to store cached entries in. It is
+        created when the first entry is stored.
+        :param max_bytes: the maximum combined size of all cached entries
+        """
+        self._directory = directory
+        self._max_bytes = max_bytes
+
+    def key(self, filename: str, params: tuple) -> str:
+        """
+        :param filename: the reference image file
+        :param params: the preprocessing parameters applied to the reference
+        :return: the key the preprocessed reference is cached under
+        """
+        digest = hashlib.sha1(file_digest(filename).encode())
+        digest.update(repr(params).encode())
+        return digest.hexdigest()
+
+    def load(self, key: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        :param key: the key of the entry to load
+        :return: a pair (reference, sector means) of read-only memory-mapped
+        arrays, or None if there is no valid entry for the given key
+        """
+        ref_path = self._path(key, REF_SUFFIX)
+        means_path = self._path(key, MEANS_SUFFIX)
+
+        try:
+            ref = np.load(ref_path, mmap_mode="r")
+            means = np.load(means_path, mmap_mode="r")
+        except (OSError, ValueError, EOFError):
+            # an empty or truncated entry raises EOFError
+            self._remove(key)
+            return None
+
+        # mark the entry as recently used
+        for path in (ref_path, means_path):
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+        return ref, means
+
+    def store(self, key: str, ref: np.ndarray, means: np.ndarray) -> None:
+        """
+        Store a preprocessed reference, then evict old entries if the cache
+        has grown past its size budget.
+        :param key: the key to store the entry under
+        :param ref: the preprocessed reference image
+        :param means: the sector means of the reference image
+        """
+        if ref.nbytes + means.nbytes > self._max_bytes:
+            return
+
+        os.makedirs(self._directory, exist_ok=True)
+
+        for suffix, arr in ((MEANS_SUFFIX, means), (REF_SUFFIX, ref)):
+            path = self._path(key, suffix)
+            # write to a temporary file first so that a concurrent or
+            # interrupted store never leaves a truncated entry behind
+            tmp_path = "{}.{}.tmp".format(path, os.getpid())
+            with open(tmp_path, "wb") as file:
+                np.save(file, np.ascontiguousarray(arr))
+            os.replace(tmp_path, path)
+
+        self.evict(keep=key)
+
+    def store_async(self, key: str, ref: np.ndarray,
+                    means: np.ndarray) -> Future:
+        """
+        Store a preprocessed reference on a background thread. Takes the
+        same arguments as store. The given arrays must not be modified
+        until the returned Future is done.
+        :return: a Future resolving once the entry has been stored
+        """
+        return _executor.submit(self.store, key, ref, means)
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """
+        Remove least recently used entries until the cache fits within its
+        size budget.
+        :param keep: the key of an entry that should never be evicted
+        """
+        try:
+            names = os.listdir(self._directory)
+        except OSError:
+            return
+
+        entries = {}
+        for name in names:
+            for suffix in (REF_SUFFIX, MEANS_SUFFIX):
+                if not name.endswith(suffix):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self._directory, name))
+                except OSError:
+                    continue
+                key = name[:-len(suffix)]
+                size, mtime = entries.get(key, (0, 0.0))
+                entries[key] = (size + stat.st_size,
+                                max(mtime, stat.st_mtime))
+
+        total = sum(size for size, _ in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k][1]):
+            if total <= self._max_bytes:
+                break
+            if key == keep:
+                continue
+            self._remove(key)
+            total -= entries[key][0]
+
+    def _path(self, key: str, suffix: str) -> str:
+        """
+        :param key: the key of an entry
+        :param suffix: the suffix of the file within the entry
+        :return: the path of the given file of the given entry
+        """
+        return os.path.join(self._directory, key + suffix)
+
+    def _remove(self, key: str) -> None:
+        """
+        Remove the entry with the given key, if it exists.
+        :param key: the key of the entry to remove
+        """
+        for suffix in (REF_SUFFIX, MEANS_SUFFIX):
+            try:
+                os.remove(self._path(key, suffix))
+            except OSError:
+                pass
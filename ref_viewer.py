@@ -0,0 +1,325 @@
+import tkinter as tk
+from collections import OrderedDict
+from PIL import Image, ImageTk
+import numpy as np
+from typing import Callable, List, Tuple
+
+from timing import timed
+from util import get_ref_cell_size, get_ref_tile_cells, get_ref_extent, \
+    get_ref_view_start, get_ref_tile_range
+from constants import HIGHLIGHT_COLOUR, REF_ZOOM_LEVELS, REF_TILE_CACHE_PIXELS
+
+
+# identifies a tile: the index of its zoom level, and its column and row
+TileKey = Tuple[int, int, int]
+
+
+class RefViewer(tk.Canvas):
+    """
+    A GUI element which displays the reference image around the current
+    pixel, and can be zoomed and panned.
+
+    The whole reference is laid out on the canvas at the current zoom level,
+    and the canvas is scrolled to show the current pixel. The reference is
+    rendered in tiles of whole sectors, which are kept after they scroll out
+    of view, so moving to a neighbouring pixel scrolls the canvas and
+    renders at most one new row or column of tiles. Tiles next to those in
+    view are rendered one at a time while the application is idle.
+    """
+
+    def __init__(self, master, width: int, height: int,
+                 render_tile: Callable[[int, int, int, int, int, int],
+                                       np.ndarray]):
+        """
+        Initialise this RefViewer
+        :param master: parent container of this RefViewer
+        :param width: the width of this RefViewer
+        :param height: the height of this RefViewer
+        :param render_tile: function that renders a tile of the reference,
+        given as PopRev.get_ref_tile
+        """
+        super().__init__(master, width=width, height=height,
+                         highlightthickness=0, xscrollincrement=1,
+                         yscrollincrement=1)
+
+        self._width = width
+        self._height = height
+        self._render_tile = render_tile
+
+        # the reference being displayed, and the (width, height) of the
+        # drawing it is divided into
+        self._reference = None
+        self._grid = None
+        # index into REF_ZOOM_LEVELS of the current zoom level
+        self._zoom = 0
+        self._position = (0, 0)
+
+        # rendered tiles by TileKey, least recently used first, and how many
+        # pixels they hold altogether
+        self._tiles = OrderedDict()
+        self._tile_pixels = 0
+        # canvas items of the tiles currently placed on the canvas, by
+        # TileKey
+        self._items = {}
+        self._prefetch_scheduled = False
+
+        self._highlight = self.create_rectangle(
+            0, 0, 0, 0, width=3, state=tk.HIDDEN,
+            outline="#{:02x}{:02x}{:02x}".format(*HIGHLIGHT_COLOUR))
+
+        self.bind("<ButtonPress-1>", self.handle_press)
+        self.bind("<B1-Motion>", self.handle_drag)
+        self.bind("<MouseWheel>", self.handle_wheel)
+        self.bind("<Button-4>", lambda evt: self.zoom_in())
+        self.bind("<Button-5>", lambda evt: self.zoom_out())
+
+    def get_cell_size(self) -> Tuple[int, int]:
+        """
+        :return: the (width, height) each sector is drawn at, at the current
+        zoom level
+        """
+        return get_ref_cell_size(self._width, self._zoom), \
+            get_ref_cell_size(self._height, self._zoom)
+
+    def get_tile_cells(self) -> Tuple[int, int]:
+        """
+        :return: how many sectors (wide, high) each tile is, at the current
+        zoom level
+        """
+        cell_width, cell_height = self.get_cell_size()
+        return get_ref_tile_cells(cell_width), get_ref_tile_cells(cell_height)
+
+    def set_reference(self, reference: np.ndarray, width: int,
+                      height: int) -> None:
+        """
+        Display a reference image. Tiles already rendered are discarded if
+        the reference or the size of the drawing has changed.
+        :param reference: the reference image. It is only compared with the
+        last reference displayed, and is rendered by render_tile.
+        :param width: width of the drawing the reference is divided into
+        :param height: height of the drawing the reference is divided into
+        """
+        if reference is self._reference and self._grid == (width, height):
+            return
+        self.clear()
+        self._reference = reference
+        self._grid = (width, height)
+        self._update_scrollregion()
+
+    def clear(self) -> None:
+        """
+        Stop displaying the reference, and discard every rendered tile.
+        """
+        for item in self._items.values():
+            self.delete(item)
+        self._items.clear()
+        self._tiles.clear()
+        self._tile_pixels = 0
+        self._reference = None
+        self._grid = None
+        self.itemconfig(self._highlight, state=tk.HIDDEN)
+        self.config(scrollregion=(0, 0, self._width, self._height))
+        self.xview_moveto(0)
+        self.yview_moveto(0)
+
+    def display_message(self, text: str) -> None:
+        """
+        Display a message in place of the reference.
+        :param text: the message to display
+        """
+        self.clear()
+        self.delete("message")
+        self.create_text(self._width / 2, self._height / 2, text=text,
+                         tags="message")
+
+    @timed("RefViewer.show")
+    def show(self, x: int, y: int) -> None:
+        """
+        Scroll to and highlight sector (x, y) of the reference.
+        :param x: x coordinate of the sector to show
+        :param y: y coordinate of the sector to show
+        """
+        self._position = (x, y)
+        if self._reference is None:
+            return
+        self.delete("message")
+
+        cell_width, cell_height = self.get_cell_size()
+        width, height = self._grid
+        x0, y0, x1, y1 = self._get_scrollregion()
+        left = get_ref_view_start(x, cell_width, width, self._width)
+        top = get_ref_view_start(y, cell_height, height, self._height)
+        self.xview_moveto((left - x0) / (x1 - x0))
+        self.yview_moveto((top - y0) / (y1 - y0))
+
+        self.coords(self._highlight, x * cell_width, y * cell_height,
+                    (x + 1) * cell_width, (y + 1) * cell_height)
+        self.itemconfig(self._highlight, state=tk.NORMAL)
+        self._fill()
+
+    def zoom_in(self) -> None:
+        """
+        Show fewer sectors around the current pixel, each drawn larger
+        """
+        self._set_zoom(self._zoom - 1)
+
+    def zoom_out(self) -> None:
+        """
+        Show more sectors around the current pixel, each drawn smaller
+        """
+        self._set_zoom(self._zoom + 1)
+
+    def _set_zoom(self, zoom: int) -> None:
+        """
+        Change the zoom level, keeping tiles rendered at other levels
+        :param zoom: index into REF_ZOOM_LEVELS of the new zoom level
+        """
+        zoom = self._clamp(zoom, 0, len(REF_ZOOM_LEVELS) - 1)
+        if zoom == self._zoom:
+            return
+        for item in self._items.values():
+            self.delete(item)
+        self._items.clear()
+        self._zoom = zoom
+        if self._reference is not None:
+            self._update_scrollregion()
+            self.show(*self._position)
+
+    def _get_scrollregion(self) -> Tuple[int, int, int, int]:
+        """
+        :return: the region of the canvas that can be scrolled over at the
+        current zoom level. References smaller than this RefViewer are
+        centred in it.
+        """
+        cell_width, cell_height = self.get_cell_size()
+        width, height = self._grid
+        x0, x1 = get_ref_extent(width * cell_width, self._width)
+        y0, y1 = get_ref_extent(height * cell_height, self._height)
+        return x0, y0, x1, y1
+
+    def _update_scrollregion(self) -> None:
+        """
+        Fit the scrollable region of the canvas to the reference at the
+        current zoom level
+        """
+        self.config(scrollregion=self._get_scrollregion())
+
+    def _get_visible_tiles(self, margin: int = 0) -> List[TileKey]:
+        """
+        :param margin: how many tiles beyond those in view to include
+        :return: the tiles in view at the current zoom level, and any within
+        margin tiles of them
+        """
+        cell_width, cell_height = self.get_cell_size()
+        columns, rows = self.get_tile_cells()
+        width, height = self._grid
+        txs = get_ref_tile_range(int(self.canvasx(0)), cell_width, columns,
+                                 width, self._width, margin)
+        tys = get_ref_tile_range(int(self.canvasy(0)), cell_height, rows,
+                                 height, self._height, margin)
+        return [(self._zoom, tx, ty) for ty in tys for tx in txs]
+
+    def _get_tile(self, key: TileKey) -> ImageTk.PhotoImage:
+        """
+        :param key: the tile to get, at the current zoom level
+        :return: the tile, rendered if it is not already cached
+        """
+        if key in self._tiles:
+            self._tiles.move_to_end(key)
+            return self._tiles[key]
+
+        _, tx, ty = key
+        cell_width, cell_height = self.get_cell_size()
+        columns, rows = self.get_tile_cells()
+        arr = self._render_tile(tx * columns, ty * rows, columns, rows,
+                                cell_width, cell_height)
+        tile = ImageTk.PhotoImage(image=Image.fromarray(arr))
+        self._tiles[key] = tile
+        self._tile_pixels += arr.shape[0] * arr.shape[1]
+
+        # evict the least recently used tiles, which are never those in view
+        # as they were used more recently
+        while self._tile_pixels > REF_TILE_CACHE_PIXELS and \
+                len(self._tiles) > 1:
+            old_key, old = self._tiles.popitem(last=False)
+            self._tile_pixels -= old.width() * old.height()
+            if old_key in self._items:
+                self.delete(self._items.pop(old_key))
+        return tile
+
+    def _fill(self) -> None:
+        """
+        Place every tile in view on the canvas, and remove those out of view
+        """
+        visible = self._get_visible_tiles()
+        for key in list(self._items):
+            if key not in visible:
+                self.delete(self._items.pop(key))
+
+        cell_width, cell_height = self.get_cell_size()
+        columns, rows = self.get_tile_cells()
+        for key in visible:
+            tile = self._get_tile(key)
+            if key not in self._items:
+                _, tx, ty = key
+                self._items[key] = self.create_image(
+                    tx * columns * cell_width, ty * rows * cell_height,
+                    anchor=tk.NW, image=tile)
+        self.tag_raise(self._highlight)
+
+        if not self._prefetch_scheduled:
+            self._prefetch_scheduled = True
+            self.after_idle(self._prefetch)
+
+    def _prefetch(self) -> None:
+        """
+        Render one of the tiles around those in view, so that it is ready
+        when scrolled to, and schedule the next if there are more
+        """
+        self._prefetch_scheduled = False
+        if self._reference is None:
+            return
+        for key in self._get_visible_tiles(margin=1):
+            if key not in self._tiles:
+                self._get_tile(key)
+                # render one tile at a time, so that inputs are not kept
+                # waiting
+                self._prefetch_scheduled = True
+                self.after_idle(self._prefetch)
+                return
+
+    def handle_press(self, evt: tk.Event) -> None:
+        """
+        Handle the event in which this RefViewer is pressed, starting a pan
+        :param evt: event object generated when this RefViewer is pressed
+        """
+        self.scan_mark(evt.x, evt.y)
+
+    def handle_drag(self, evt: tk.Event) -> None:
+        """
+        Handle the event in which the mouse is dragged over this RefViewer,
+        panning the reference with it
+        :param evt: event object generated when the mouse is dragged
+        """
+        if self._reference is None:
+            return
+        self.scan_dragto(evt.x, evt.y, gain=1)
+        self._fill()
+
+    def handle_wheel(self, evt: tk.Event) -> None:
+        """
+        Handle the event in which the mouse wheel is turned over this
+        RefViewer, zooming in or out
+        :param evt: event object generated when the mouse wheel is turned
+        """
+        if evt.delta > 0:
+            self.zoom_in()
+        elif evt.delta < 0:
+            self.zoom_out()
+
+    @staticmethod
+    def _clamp(value, lower, upper):
+        """
+        :return: value, limited to the range [lower, upper]
+        """
+        return max(lower, min(upper, value))
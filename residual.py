@@ -0,0 +1,102 @@
+import cv2
+import numpy as np
+from typing import List, Tuple
+
+from constants import COLOURS
+
+
+# weights converting BGR (as loaded by OpenCV) and RGB colours to intensity
+BGR_WEIGHTS = np.array([0.114, 0.587, 0.299], dtype=np.float32)
+RGB_WEIGHTS = BGR_WEIGHTS[::-1]
+
+
+def get_full_heat(colour_count: int) -> float:
+    """
+    :param colour_count: the number of colours of a drawing
+    :return: the residual, in intensity levels, drawn at full heat. This is
+    the difference between adjacent colours of an evenly spaced palette, so
+    a cell at full heat looks more like a neighbouring colour than the one
+    it was classified as.
+    """
+    return 255 / max(1, colour_count - 1)
+
+
+def get_residuals(selections: np.ndarray, palette: np.ndarray,
+                  ref_means: np.ndarray,
+                  colour_count: int = len(COLOURS)) -> np.ndarray:
+    """
+    Compare the intensity every pixel of a drawing is expected to have with
+    the mean intensity of the corresponding sector of the reference image.
+
+    The reference is photographed from a screen, so its intensities differ
+    from the drawing's by an unknown brightness and contrast. These are
+    estimated by a least squares fit over every classified pixel, and
+    removed from the reference before comparing.
+    :param selections: the colour of every pixel of the drawing
+    :param palette: the RGB value of each colour of the drawing
+    :param ref_means: the mean BGR colour of every sector of the reference
+    :param colour_count: the number of colours of the drawing. Pixels of any
+    other value have not been classified.
+    :return: a float32 array of the absolute difference between each pixel's
+    expected and corrected reference intensity, in the drawing's intensity
+    levels. Pixels that have not been classified are NaN.
+    """
+    known = selections < colour_count
+    expected = (palette.astype(np.float32) @ RGB_WEIGHTS)[selections]
+    observed = np.asarray(ref_means, dtype=np.float32) @ BGR_WEIGHTS
+
+    # fit observed = gain * expected + offset over the classified pixels
+    gain, offset = 1.0, 0.0
+    if np.unique(expected[known]).size >= 2:
+        gain, offset = np.polyfit(expected[known], observed[known], 1)
+        if abs(gain) < 1e-6:
+            gain, offset = 1.0, 0.0
+    elif known.any():
+        offset = float(np.mean(observed[known] - expected[known]))
+
+    residuals = np.abs((observed - offset) / gain - expected)
+    residuals[~known] = np.nan
+    return residuals.astype(np.float32)
+
+
+def get_worst_cells(residuals: np.ndarray, count: int) \
+        -> List[Tuple[int, int]]:
+    """
+    :param residuals: residuals as returned by get_residuals
+    :param count: the maximum number of cells to return
+    :return: the (x, y) coordinates of the cells with the largest residuals,
+    largest first
+    """
+    flat = np.nan_to_num(residuals.ravel(), nan=-1.0)
+    count = min(count, int(np.count_nonzero(flat >= 0)))
+    if count == 0:
+        return []
+
+    worst = np.argpartition(flat, -count)[-count:]
+    worst = worst[np.argsort(flat[worst])[::-1]]
+
+    ys, xs = np.unravel_index(worst, residuals.shape)
+    return [(int(x), int(y)) for x, y in zip(xs, ys)]
+
+
+def render_heatmap(drawing: np.ndarray, residuals: np.ndarray,
+                   opacity: float,
+                   colour_count: int = len(COLOURS)) -> np.ndarray:
+    """
+    :param drawing: the RGB image of the drawing
+    :param residuals: residuals as returned by get_residuals
+    :param opacity: how strongly to draw the heatmap over the drawing, from
+    0 to 1
+    :param colour_count: the number of colours of the drawing
+    :return: the RGB image of the drawing, overlaid with a heatmap of the
+    residuals. Unclassified pixels are left as they are.
+    """
+    heat = np.clip(np.nan_to_num(residuals) / get_full_heat(colour_count),
+                   0, 1)
+    heat = cv2.applyColorMap((heat * 255).astype(np.uint8), cv2.COLORMAP_JET)
+    heat = cv2.cvtColor(heat, cv2.COLOR_BGR2RGB)
+
+    overlay = cv2.addWeighted(drawing, 1 - opacity, heat, opacity, 0)
+    unknown = np.isnan(residuals)
+    overlay[unknown] = drawing[unknown]
+    return overlay
@@ -0,0 +1,382 @@
+"""
+Recording and replay of interactive sessions.
+
+When the POPREV_RECORD environment variable names a file, every user-level
+event that reaches the application is appended to it, one per line, as the
+milliseconds since the session started, the kind of event and its arguments,
+separated by tabs. A recorded session can be replayed headlessly against the
+model, or against the full application, e.g.
+
+    python3 session.py session.log --realtime
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from typing import Callable, List, Optional, Tuple
+
+from poprev import PopRev
+from cursor import Cursor
+from util import get_preview_scale, get_ref_cell_size, \
+    get_ref_tile_cells, get_ref_view_start, get_ref_tile_range
+from constants import DRAW_WIDTH, DRAW_HEIGHT, REF_CANVAS_WIDTH, \
+    REF_CANVAS_HEIGHT
+
+
+RECORD_FILE = os.environ.get("POPREV_RECORD")
+
+# the types of the arguments of each kind of event
+EVENT_ARGS = {
+    "select": (int,),
+    "move": (str,),
+    "jump": (int, int),
+    "preview": (int, int),
+    "load_reference": (str,),
+    "load_drawing": (str,),
+    "save": (str,),
+    "new": (int, int),
+    "undo": (),
+    "redo": (),
+    "auto": ()
+}
+
+# the method of the application that handles each kind of event
+EVENT_HANDLERS = {
+    "select": "handle_select_callback",
+    "move": "handle_move_callback",
+    "jump": "handle_jump_callback",
+    "preview": "handle_preview_click",
+    "load_reference": "open_reference",
+    "load_drawing": "open_drawing",
+    "save": "save_drawing_to",
+    "new": "new_drawing",
+    "undo": "undo",
+    "redo": "redo",
+    "auto": "auto_classify"
+}
+
+
+class SessionEvent(object):
+    """
+    A single user-level event of a recorded session.
+    """
+
+    def __init__(self, time_ms: float, kind: str, args: tuple):
+        """
+        Initialise this SessionEvent
+        :param time_ms: when the event happened, in milliseconds since the
+        session started
+        :param kind: the kind of event, one of EVENT_ARGS
+        :param args: the arguments of the event
+        """
+        self.time_ms = time_ms
+        self.kind = kind
+        self.args = args
+
+
+class SessionRecorder(object):
+    """
+    Appends the user-level events of a session to a log file.
+    """
+
+    def __init__(self, filename: str):
+        """
+        Initialise this SessionRecorder, truncating the log file
+        :param filename: the log file to record to
+        """
+        # line buffered, so that the log survives the application crashing
+        self._file = open(filename, "w", buffering=1)
+        self._start = time.perf_counter()
+
+    def record(self, kind: str, *args) -> None:
+        """
+        Record an event.
+        :param kind: the kind of event, one of EVENT_ARGS
+        :param args: the arguments of the event
+        """
+        time_ms = (time.perf_counter() - self._start) * 1000
+        fields = ["{:.0f}".format(time_ms), kind] + [str(arg) for arg in args]
+        self._file.write("\t".join(fields) + "\n")
+
+    def close(self) -> None:
+        """
+        Stop recording.
+        """
+        self._file.close()
+
+
+def read_session(filename: str) -> List[SessionEvent]:
+    """
+    :param filename: a log file written by a SessionRecorder
+    :return: the events of the recorded session, in order
+    """
+    events = []
+    with open(filename, "r") as file:
+        for line in file:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 2:
+                continue
+            kind = fields[1]
+            types = EVENT_ARGS[kind]
+            args = tuple(t(arg) for t, arg in zip(types, fields[2:]))
+            events.append(SessionEvent(float(fields[0]), kind, args))
+    return events
+
+
+class HeadlessSession(object):
+    """
+    Stands in for the application when replaying a session without a
+    display. Handles the same events as the application, and performs the
+    same model calls as the application does to refresh its components.
+    """
+
+    def __init__(self, poprev: Optional[PopRev] = None, render: bool = True):
+        """
+        Initialise this HeadlessSession
+        :param poprev: the model to drive. A new one is created if not given.
+        :param render: whether to fetch the images the application would
+        display after each event
+        """
+        self._poprev = PopRev() if poprev is None else poprev
+        self._cursor = Cursor()
+        self._render = render
+
+        # the reference and (width, height) of the drawing that tiles were
+        # rendered for, and the (column, row) of each tile rendered, as the
+        # RefViewer would have kept them
+        self._tile_reference = None
+        self._tile_grid = None
+        self._tiles = set()
+
+    def get_poprev(self) -> PopRev:
+        """
+        :return: the model driven by this HeadlessSession
+        """
+        return self._poprev
+
+    def get_position(self) -> Tuple[int, int]:
+        """
+        :return: the (x, y) coordinate of the pixel being classified
+        """
+        return self._cursor.get_position()
+
+    def refresh_components(self) -> None:
+        """
+        Fetch everything the application would display.
+        """
+        self._cursor.set_bounds(self._poprev.get_width(),
+                                self._poprev.get_height())
+        if not self._render:
+            return
+        x, y = self._cursor.get_position()
+        self._poprev.get_selection(x, y)
+        self._poprev.get_preview(x, y)
+        if self._poprev.has_reference():
+            self.render_ref_tiles(x, y)
+
+    def render_ref_tiles(self, x: int, y: int) -> None:
+        """
+        Render the tiles of the reference that the RefViewer would show
+        around a pixel at its initial zoom level, skipping those it would
+        already have rendered.
+        :param x: x coordinate of the pixel
+        :param y: y coordinate of the pixel
+        """
+        reference = self._poprev.get_reference()
+        width = self._poprev.get_width()
+        height = self._poprev.get_height()
+        if reference is not self._tile_reference or \
+                self._tile_grid != (width, height):
+            self._tile_reference = reference
+            self._tile_grid = (width, height)
+            self._tiles.clear()
+
+        cell_width = get_ref_cell_size(REF_CANVAS_WIDTH, 0)
+        cell_height = get_ref_cell_size(REF_CANVAS_HEIGHT, 0)
+        columns = get_ref_tile_cells(cell_width)
+        rows = get_ref_tile_cells(cell_height)
+        left = get_ref_view_start(x, cell_width, width, REF_CANVAS_WIDTH)
+        top = get_ref_view_start(y, cell_height, height, REF_CANVAS_HEIGHT)
+        for ty in get_ref_tile_range(int(top), cell_height, rows, height,
+                                     REF_CANVAS_HEIGHT):
+            for tx in get_ref_tile_range(int(left), cell_width, columns,
+                                         width, REF_CANVAS_WIDTH):
+                if (tx, ty) not in self._tiles:
+                    self._tiles.add((tx, ty))
+                    self._poprev.get_ref_tile(tx * columns, ty * rows,
+                                              columns, rows, cell_width,
+                                              cell_height)
+
+    def handle_select_callback(self, identifier: int) -> None:
+        """
+        Classify the current pixel and move to the next.
+        :param identifier: the id of the colour that was selected
+        """
+        if identifier >= self._poprev.get_colour_count():
+            return
+        self._poprev.edit_drawing(*self._cursor.get_position(), identifier)
+        self._cursor.next()
+        self.refresh_components()
+
+    def handle_move_callback(self, direction: str) -> None:
+        """
+        Move to the next pixel in the specified direction.
+        :param direction: the direction to move
+        """
+        self._cursor.move(direction)
+        self.refresh_components()
+
+    def handle_jump_callback(self, x: int, y: int) -> None:
+        """
+        Jump to the given position, as entered in the navigator.
+        :param x: the 1-based x coordinate to jump to
+        :param y: the 1-based y coordinate to jump to
+        """
+        self._cursor.jump(x - 1, y - 1)
+        self.refresh_components()
+
+    def handle_preview_click(self, x: int, y: int) -> None:
+        """
+        Jump to the pixel at the given position of the drawing preview.
+        :param x: the x coordinate that was clicked
+        :param y: the y coordinate that was clicked
+        """
+        scale = get_preview_scale(self._poprev.get_width(),
+                                  self._poprev.get_height())
+        self._cursor.jump(x // scale, y // scale)
+        self.refresh_components()
+
+    def open_reference(self, filename: str) -> None:
+        """
+        :param filename: the reference image to load
+        """
+        self._poprev.load_reference(filename)
+        self.refresh_components()
+
+    def open_drawing(self, filename: str) -> None:
+        """
+        :param filename: the drawing to load
+        """
+        self._poprev.load_drawing(filename)
+        self.refresh_components()
+
+    def save_drawing_to(self, filename: str) -> None:
+        """
+        :param filename: the file to save the drawing to
+        """
+        self._poprev.save_drawing_as(filename)
+
+    def new_drawing(self, width: int = DRAW_WIDTH,
+                    height: int = DRAW_HEIGHT) -> None:
+        """
+        Clear the current drawing and start a new one.
+        :param width: width of the new drawing
+        :param height: height of the new drawing
+        """
+        self._poprev.new_drawing(width, height)
+        self.refresh_components()
+
+    def undo(self) -> None:
+        """
+        Undo the most recent change to the drawing
+        """
+        self._poprev.undo()
+        self.refresh_components()
+
+    def redo(self) -> None:
+        """
+        Redo the most recently undone change to the drawing
+        """
+        self._poprev.redo()
+        self.refresh_components()
+
+    def auto_classify(self) -> None:
+        """
+        Classify every pixel of the drawing automatically from the reference
+        """
+        self._poprev.auto_classify()
+        self.refresh_components()
+
+
+def replay(events: List[SessionEvent], target,
+           realtime: bool = False, saves: bool = False,
+           update: Optional[Callable[[], None]] = None) -> List[float]:
+    """
+    Replay a recorded session.
+    :param events: the events of the session
+    :param target: the object that handles the events, i.e. a PopRevApp or
+    a HeadlessSession
+    :param realtime: if True, wait until each event's recorded time before
+    handling it. Otherwise, handle events as fast as possible.
+    :param saves: whether to replay save events, overwriting the drawings
+    they were saved to
+    :param update: function to call after each event, e.g. to let Tk
+    process redraws
+    :return: how long each replayed event took to handle, in seconds
+    """
+    latencies = []
+    start = time.perf_counter()
+
+    for event in events:
+        if event.kind == "save" and not saves:
+            continue
+
+        if realtime:
+            delay = start + event.time_ms / 1000 - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        event_start = time.perf_counter()
+        getattr(target, EVENT_HANDLERS[event.kind])(*event.args)
+        if update is not None:
+            update()
+        latencies.append(time.perf_counter() - event_start)
+
+    return latencies
+
+
+def main(argv: List[str]) -> int:
+    """
+    Replay the session described by the given command line arguments, and
+    report how long its events took to handle.
+    :param argv: command line arguments, excluding the program name
+    :return: exit status
+    """
+    parser = argparse.ArgumentParser(description="Replay a recorded session")
+    parser.add_argument("log", help="session log to replay")
+    parser.add_argument("--realtime", action="store_true",
+                        help="replay at the pace the session was recorded")
+    parser.add_argument("--app", action="store_true",
+                        help="replay against the full Tk application")
+    parser.add_argument("--saves", action="store_true",
+                        help="replay saves, overwriting the saved drawings")
+    args = parser.parse_args(argv)
+
+    events = read_session(args.log)
+
+    if args.app:
+        # imported here, as the application itself imports this module
+        import tkinter as tk
+        from poprevapp import PopRevApp
+        root = tk.Tk()
+        target = PopRevApp(root)
+        update = root.update
+    else:
+        target = HeadlessSession()
+        update = None
+
+    latencies = replay(events, target, args.realtime, args.saves, update)
+    if not latencies:
+        print("no events replayed")
+        return 0
+
+    ms = np.array(latencies) * 1000
+    print("{} events in {:.3f} s".format(len(ms), ms.sum() / 1000))
+    print("p50 {:.3f} ms  p99 {:.3f} ms  max {:.3f} ms".format(
+        np.percentile(ms, 50), np.percentile(ms, 99), ms.max()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,271 @@
+"""
+Long-session memory soak test.
+
+Drives the editor through tens of thousands of classifications, reloading
+references every few hundred, and samples the process's resident memory
+and the memory traced by tracemalloc as it goes. Memory is measured from
+the end of a warm-up, once caches and the undo history have filled, and
+the test fails if it has grown by more than a threshold by the end, e.g.
+
+    python3 soak.py --classifications 100000 --max-growth 16
+
+By default the model is driven headlessly, as session.py replays sessions.
+Pass --app to drive the full Tk application instead, which needs a
+display, e.g. a virtual one provided by
+
+    xvfb-run python3 soak.py --app
+
+The allocation sites whose traced memory grew the most are reported either
+way.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import cv2
+from typing import Callable, Dict, List, Optional, Tuple
+
+from benchmark import make_reference
+from history import CELL_EDIT_BYTES
+from poprev import PopRev
+from ref_cache import ReferenceCache, flush
+from session import HeadlessSession
+from constants import COLOURS, DRAW_WIDTH, DRAW_HEIGHT, HISTORY_MAX_BYTES
+
+
+# the baseline is taken once the undo history is full of classifications,
+# as it is in any long session
+DEFAULT_WARMUP = HISTORY_MAX_BYTES // CELL_EDIT_BYTES
+DEFAULT_CLASSIFICATIONS = DEFAULT_WARMUP + 50000
+DEFAULT_INTERVAL = 1000
+DEFAULT_LOAD_EVERY = 500
+DEFAULT_MEGAPIXELS = 2
+# the greatest growth, in MiB, of either resident or traced memory between
+# the end of the warm-up and the end of the test
+DEFAULT_MAX_GROWTH = 16
+DEFAULT_TOP = 10
+
+MIB = 1024 * 1024
+
+
+def get_rss() -> Optional[int]:
+    """
+    :return: the resident set size of this process in bytes, or None if it
+    cannot be read from /proc
+    """
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def take_snapshot() -> tracemalloc.Snapshot:
+    """
+    :return: a snapshot of traced memory, excluding tracemalloc's own
+    allocations and those made by importing modules
+    """
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>")))
+
+
+def settle() -> None:
+    """
+    Wait for background work to finish and collect garbage, so that memory
+    is measured in a steady state
+    """
+    flush()
+    gc.collect()
+
+
+def sample(step: int) -> Dict[str, Optional[int]]:
+    """
+    :param step: the number of classifications made so far
+    :return: the memory in use after that many classifications
+    """
+    traced = None
+    if tracemalloc.is_tracing():
+        traced = tracemalloc.get_traced_memory()[0]
+    return {"classifications": step, "time": time.perf_counter(),
+            "rss_bytes": get_rss(), "traced_bytes": traced}
+
+
+def format_bytes(value: Optional[int]) -> str:
+    """
+    :param value: a number of bytes, or None if it is not known
+    :return: the number of bytes in MiB, for display
+    """
+    if value is None:
+        return "n/a"
+    return "{:.1f} MiB".format(value / MIB)
+
+
+def soak(target, update: Callable[[], None], references: List[str],
+         classifications: int, warmup: int, interval: int, load_every: int) \
+        -> Tuple[List[Dict[str, Optional[int]]],
+                 Optional[tracemalloc.Snapshot]]:
+    """
+    Drive a session through many classifications and reference loads.
+    :param target: the object that handles events, i.e. a PopRevApp or a
+    HeadlessSession
+    :param update: function to call after each event, e.g. to let Tk
+    process redraws
+    :param references: reference images to load in turn
+    :param classifications: the number of pixels to classify
+    :param warmup: the number of classifications after which the baseline
+    sample is taken
+    :param interval: the number of classifications between samples
+    :param load_every: the number of classifications between loading the
+    next reference
+    :return: the memory samples, the first of which is the baseline, and a
+    snapshot of traced memory taken with the baseline, if memory is being
+    traced
+    """
+    samples = []
+    baseline = None
+    loads = 0
+    colours = len(COLOURS)
+    pixels = DRAW_WIDTH * DRAW_HEIGHT
+    for step in range(classifications + 1):
+        if step % load_every == 0:
+            target.open_reference(references[loads % len(references)])
+            update()
+            loads += 1
+
+        if step == warmup or (step > warmup and step % interval == 0):
+            settle()
+            samples.append(sample(step))
+            if step == warmup and tracemalloc.is_tracing():
+                baseline = take_snapshot()
+            print("{:>8} classifications  RSS {:>12}  traced {:>12}".format(
+                step, format_bytes(samples[-1]["rss_bytes"]),
+                format_bytes(samples[-1]["traced_bytes"])))
+
+        if step < classifications:
+            # cycle through the colours of a new drawing, offset on each
+            # pass over it, so that every classification changes its pixel
+            # and is recorded in the undo history
+            target.handle_select_callback((step + step // pixels) % colours)
+            update()
+    return samples, baseline
+
+
+def main(argv: List[str]) -> int:
+    """
+    Run the soak test described by the given command line arguments.
+    :param argv: command line arguments, excluding the program name
+    :return: exit status
+    """
+    parser = argparse.ArgumentParser(
+        description="Check that memory stays flat over a long session")
+    parser.add_argument("references", nargs="*",
+                        help="references to load in turn. Synthetic ones "
+                             "are made if none are given.")
+    parser.add_argument("--classifications", type=int,
+                        default=DEFAULT_CLASSIFICATIONS)
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP,
+                        help="classifications before the baseline sample")
+    parser.add_argument("--interval", type=int, default=DEFAULT_INTERVAL,
+                        help="classifications between samples")
+    parser.add_argument("--load-every", type=int, default=DEFAULT_LOAD_EVERY,
+                        help="classifications between reference loads")
+    parser.add_argument("--megapixels", type=float,
+                        default=DEFAULT_MEGAPIXELS,
+                        help="size of the synthetic references")
+    parser.add_argument("--max-growth", type=float,
+                        default=DEFAULT_MAX_GROWTH,
+                        help="the greatest growth in memory, in MiB, from "
+                             "the baseline to the end")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP,
+                        help="number of allocation sites to report")
+    parser.add_argument("--no-trace", action="store_true",
+                        help="only sample resident memory, which is much "
+                             "faster than tracing every allocation")
+    parser.add_argument("--app", action="store_true",
+                        help="drive the full Tk application")
+    parser.add_argument("--json", help="file to write the samples to")
+    args = parser.parse_args(argv)
+
+    if args.warmup > args.classifications:
+        parser.error("--warmup must not exceed --classifications")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        references = args.references
+        if not references:
+            references = []
+            for seed in range(2):
+                filename = os.path.join(workdir, "ref_{}.png".format(seed))
+                cv2.imwrite(filename, make_reference(args.megapixels, seed))
+                references.append(filename)
+
+        if args.app:
+            # imported here, as only this mode needs a display
+            import tkinter as tk
+            from poprevapp import PopRevApp
+            root = tk.Tk()
+            target = PopRevApp(root)
+            update = root.update
+        else:
+            # keep cached references out of the user's cache
+            target = HeadlessSession(PopRev(ref_cache=ReferenceCache(
+                os.path.join(workdir, "cache"))))
+
+            def update() -> None:
+                pass
+
+        if not args.no_trace:
+            tracemalloc.start()
+
+        samples, baseline_snapshot = soak(
+            target, update, references, args.classifications, args.warmup,
+            args.interval, args.load_every)
+
+        allocators = []
+        if baseline_snapshot is not None:
+            settle()
+            stats = take_snapshot().compare_to(baseline_snapshot, "lineno")
+            allocators = [str(stat) for stat in stats[:args.top]]
+            tracemalloc.stop()
+
+    if allocators:
+        print("allocation sites that grew the most:")
+        for allocator in allocators:
+            print("  " + allocator)
+
+    failures = []
+    baseline, final = samples[0], samples[-1]
+    for key, name in (("rss_bytes", "resident"), ("traced_bytes", "traced")):
+        if baseline[key] is None or final[key] is None:
+            continue
+        growth = (final[key] - baseline[key]) / MIB
+        print("{} memory grew by {:.1f} MiB over {} classifications".format(
+            name, growth, final["classifications"] -
+            baseline["classifications"]))
+        if growth > args.max_growth:
+            failures.append(name)
+
+    if args.json is not None:
+        with open(args.json, "w") as file:
+            json.dump({"samples": samples, "allocators": allocators,
+                       "failures": failures}, file, indent=2)
+
+    if failures:
+        print("FAIL: {} memory grew by more than {} MiB".format(
+            " and ".join(failures), args.max_growth))
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,105 @@
+"""
+Helpers for starting the application quickly.
+
+Heavy third-party modules are imported on a background thread while the
+window is being shown, and the application's own modules that depend on
+them are only executed when first used. Set POPREV_STARTUP_TIMING=1 to have
+the time taken by each import, and by each stage of startup, reported on
+stderr once the application is ready. For a full per-module breakdown of
+every import, run the application with python3 -X importtime instead.
+"""
+import importlib
+import importlib.util
+import sys
+import threading
+import time
+from types import ModuleType
+from typing import List, Optional
+
+from timing import registry, env_flag
+
+
+# the third-party modules that dominate the application's import time
+HEAVY_MODULES = ["numpy", "cv2", "PIL.Image", "PIL.ImageTk"]
+
+REPORT_ENABLED = env_flag("POPREV_STARTUP_TIMING")
+
+_start = time.perf_counter()
+# (stage, time since startup began, duration), in seconds
+_stages = []  # type: List[tuple]
+_lock = threading.Lock()
+
+
+def mark(stage: str, began: Optional[float] = None) -> None:
+    """
+    Record that a stage of startup has finished.
+    :param stage: name of the stage
+    :param began: the time.perf_counter() value the stage began at. If not
+    given, the stage is taken to have begun when startup began.
+    """
+    now = time.perf_counter()
+    if began is None:
+        began = _start
+    with _lock:
+        _stages.append((stage, now - _start, now - began))
+    if registry.enabled:
+        registry.record("startup." + stage, began, now - began)
+
+
+def lazy_import(name: str) -> ModuleType:
+    """
+    :param name: name of the module to import
+    :return: the module, which is only executed when one of its attributes
+    is first accessed. If the module has already been imported, it is
+    returned as is.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def preload(modules: List[str] = HEAVY_MODULES) -> threading.Thread:
+    """
+    Import modules on a background thread. Any thread that imports one of
+    them before the background thread has finished waits for it, rather
+    than importing it again.
+    :param modules: names of the modules to import
+    :return: the thread importing the modules
+    """
+    def run() -> None:
+        for name in modules:
+            began = time.perf_counter()
+            try:
+                importlib.import_module(name)
+            except ImportError:
+                # reported properly when the module is used
+                continue
+            mark("import." + name, began)
+
+    thread = threading.Thread(target=run, name="poprev-preload", daemon=True)
+    thread.start()
+    return thread
+
+
+def report() -> None:
+    """
+    Print the duration of every recorded stage of startup to stderr, if
+    startup timing is enabled.
+    """
+    if not REPORT_ENABLED:
+        return
+
+    with _lock:
+        stages = sorted(_stages, key=lambda stage: stage[1])
+
+    print("startup: finished [us] | duration [us] | stage", file=sys.stderr)
+    for stage, finished, duration in stages:
+        print("startup: {:>12.0f} | {:>13.0f} | {}".format(
+            finished * 1e6, duration * 1e6, stage), file=sys.stderr)
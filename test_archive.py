@@ -0,0 +1,98 @@
+import os
+import numpy as np
+import pytest
+
+from archive import Archive, ArchiveWriter, main
+from constants import COLOUR_UNKNOWN, COLOURS
+from poprev import format_header
+from ref_cache import file_digest
+
+
+def write_drawing(filename: str, selections: np.ndarray,
+                  colours=COLOURS) -> None:
+    """
+    Save a drawing the way PopRev.save_drawing_as does
+    """
+    height, width = selections.shape
+    with open(filename, "w") as file:
+        file.write(format_header(width, height, colours) + "\n")
+        for row in selections:
+            file.write("".join(str(v) for v in row) + "\n")
+
+
+def random_drawing(seed: int, width: int = 16, height: int = 12,
+                   colours: int = 4) -> np.ndarray:
+    """
+    :return: a drawing of random colours, with some pixels unknown
+    """
+    rng = np.random.default_rng(seed)
+    selections = rng.integers(0, colours, (height, width), dtype=np.uint8)
+    selections[rng.random((height, width)) < 0.1] = COLOUR_UNKNOWN
+    return selections
+
+
+def test_round_trip(tmp_path):
+    filename = str(tmp_path / "drawings.prar")
+    small = random_drawing(0)
+    # more colours than fit in 2 bits per pixel
+    wide = random_drawing(1, width=33, height=7, colours=6)
+    wide_colours = [(i * 40, i * 40, i * 40) for i in range(6)]
+
+    with ArchiveWriter(filename) as writer:
+        assert writer.add("small", small, COLOURS, reference="ab" * 20,
+                          created=100.0, modified=200.0) is None
+        assert writer.add("wide", wide, wide_colours) is None
+
+    with Archive(filename) as archive:
+        assert len(archive) == 2
+        assert archive.get_names() == ["small", "wide"]
+        assert archive.find("wide") == 1
+        with pytest.raises(KeyError):
+            archive.find("missing")
+
+        assert np.array_equal(archive.get_selections(0), small)
+        assert np.array_equal(archive.get_selections(1), wide)
+
+        info = archive.get_info(0)
+        assert info["name"] == "small"
+        assert info["reference"] == "ab" * 20
+        assert (info["created"], info["modified"]) == (100.0, 200.0)
+        assert (info["width"], info["height"]) == (16, 12)
+        assert info["colours"] == [tuple(c) for c in COLOURS]
+
+        info = archive.get_info(1)
+        assert info["reference"] is None
+        assert (info["width"], info["height"]) == (33, 7)
+        assert info["colours"] == wide_colours
+
+
+def test_pack_skip_duplicates(tmp_path):
+    drawings = []
+    for name, seed in (("first", 0), ("copy", 0), ("second", 1)):
+        drawings.append(str(tmp_path / "{}.poprev".format(name)))
+        write_drawing(drawings[-1], random_drawing(seed))
+    reference = str(tmp_path / "reference.png")
+    with open(reference, "wb") as file:
+        file.write(b"not really an image")
+
+    filename = str(tmp_path / "drawings.prar")
+    assert main(["pack", filename] + drawings +
+                ["--skip-duplicates", "--reference", reference]) == 0
+
+    with Archive(filename) as archive:
+        assert archive.get_names() == ["first", "second"]
+        assert np.array_equal(archive.get_selections(1), random_drawing(1))
+        assert archive.get_info(0)["reference"] == file_digest(reference)
+
+
+def test_failed_pack_leaves_no_archive(tmp_path):
+    good = str(tmp_path / "good.poprev")
+    write_drawing(good, random_drawing(0))
+    bad = str(tmp_path / "bad.poprev")
+    with open(bad, "w") as file:
+        file.write("not a drawing\n")
+
+    filename = str(tmp_path / "drawings.prar")
+    with pytest.raises(ValueError):
+        main(["pack", filename, good, bad])
+    assert not os.path.exists(filename)
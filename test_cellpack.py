@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from cellpack import get_cell_bits, pack_cells, packed_size, unpack_cells
+from constants import COLOUR_UNKNOWN
+
+
+@pytest.mark.parametrize("bits", [2, 4])
+def test_round_trip(bits):
+    rng = np.random.default_rng(bits)
+    # an odd number of pixels, so that neither part fills its last byte
+    selections = rng.integers(0, 1 << bits, (7, 9), dtype=np.uint8)
+    selections[rng.random((7, 9)) < 0.2] = COLOUR_UNKNOWN
+
+    data = pack_cells(selections, bits)
+    assert len(data) == packed_size(9, 7, bits)
+    assert np.array_equal(unpack_cells(data, 9, 7, bits), selections)
+
+
+def test_colours_too_large_to_pack_are_unknown():
+    selections = np.array([[0, 3, 4, 8]], dtype=np.uint8)
+
+    unpacked = unpack_cells(pack_cells(selections, 2), 4, 1, 2)
+    assert list(unpacked[0]) == [0, 3, COLOUR_UNKNOWN, COLOUR_UNKNOWN]
+
+
+def test_cell_bits():
+    selections = np.full((4, 4), COLOUR_UNKNOWN, dtype=np.uint8)
+    assert get_cell_bits(selections) == 2
+    selections[0, 0] = 3
+    assert get_cell_bits(selections) == 2
+    selections[0, 1] = 8
+    assert get_cell_bits(selections) == 4
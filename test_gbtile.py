@@ -0,0 +1,35 @@
+import numpy as np
+
+from constants import COLOUR_UNKNOWN
+from gbtile import decode_tiles, encode_tiles, tile_data_size
+
+
+def test_round_trip():
+    rng = np.random.default_rng(0)
+    selections = rng.integers(0, 4, (3, 16, 24), dtype=np.uint8)
+
+    data = encode_tiles(selections)
+    assert data.shape == (3, tile_data_size(24, 16))
+    assert np.array_equal(decode_tiles(data, 24, 16), selections)
+
+
+def test_unknown_pixels_decode_as_lightest_colour():
+    rng = np.random.default_rng(1)
+    selections = rng.integers(0, 4, (8, 16), dtype=np.uint8)
+    selections[0, :4] = COLOUR_UNKNOWN
+    # beyond the Game Boy's four shades
+    selections[1, :4] = 5
+
+    decoded = decode_tiles(encode_tiles(selections), 16, 8)
+    assert np.array_equal(decoded, np.where(selections < 4, selections, 3))
+
+
+def test_tile_layout():
+    # the darkest shade everywhere but the top left pixel, which is the
+    # lightest
+    selections = np.zeros((8, 8), dtype=np.uint8)
+    selections[0, 0] = 3
+
+    data = encode_tiles(selections)
+    assert list(data[:2]) == [0x7f, 0x7f]
+    assert np.all(data[2:] == 0xff)
@@ -0,0 +1,60 @@
+import numpy as np
+
+from history import CELL_EDIT_BYTES, SNAPSHOT_BYTES, History
+
+COLOURS = [(0, 0, 0), (255, 255, 255)]
+
+
+def edit(history: History, selections: np.ndarray, x: int,
+         new: int) -> None:
+    """
+    Change a pixel of the top row of a drawing, recording the change
+    """
+    history.record_edit(x, 0, int(selections[0, x]), new)
+    selections[0, x] = new
+
+
+def test_undo_redo_after_eviction():
+    history = History(max_bytes=3 * CELL_EDIT_BYTES)
+    selections = np.zeros((2, 5), dtype=np.uint8)
+    for x in range(5):
+        edit(history, selections, x, 1)
+
+    # only the three most recent edits are kept
+    for _ in range(3):
+        selections = history.undo(selections, COLOURS)[0]
+    assert history.undo(selections, COLOURS) is None
+    assert list(selections[0]) == [1, 1, 0, 0, 0]
+
+    for _ in range(3):
+        selections = history.redo(selections, COLOURS)[0]
+    assert history.redo(selections, COLOURS) is None
+    assert np.all(selections[0] == 1)
+
+
+def test_snapshot_round_trip_after_eviction():
+    # room for the snapshot and five edits, but not a sixth edit
+    history = History(max_bytes=SNAPSHOT_BYTES + 5 * CELL_EDIT_BYTES + 50)
+    selections = np.zeros((4, 4), dtype=np.uint8)
+    edit(history, selections, 0, 1)
+
+    history.record_snapshot(selections, COLOURS, "old.poprev", False)
+    replaced = np.ones((4, 4), dtype=np.uint8)
+    for _ in range(5):
+        edit(history, replaced, 1, 1 - int(replaced[0, 1]))
+
+    drawing = (replaced, [(1, 2, 3)], "new.poprev", True)
+    for _ in range(5):
+        drawing = history.undo(*drawing)
+    restored, colours, save_name, unsaved = history.undo(*drawing)
+    assert np.array_equal(restored, selections)
+    assert colours == COLOURS
+    assert save_name == "old.poprev"
+    assert not unsaved
+    assert history.undo(restored, colours) is None
+
+    restored, colours, save_name, _ = history.redo(restored, colours,
+                                                  save_name, unsaved)
+    assert np.array_equal(restored, np.ones((4, 4), dtype=np.uint8))
+    assert colours == [(1, 2, 3)]
+    assert save_name == "new.poprev"
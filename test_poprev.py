@@ -0,0 +1,78 @@
+import cv2
+import numpy as np
+from PIL import ImageFile
+
+from calibration import CalibrationStore
+from poprev import PopRev
+from ref_cache import ReferenceCache, flush
+
+
+def make_poprev(tmp_path) -> PopRev:
+    """
+    :param tmp_path: a directory to keep the model's caches in
+    :return: a model that leaves the user's caches alone
+    """
+    return PopRev(ref_cache=ReferenceCache(str(tmp_path / "cache")),
+                  calibrations=CalibrationStore(str(tmp_path / "calibration")))
+
+
+def test_undo_load_does_not_save_over_loaded_file(tmp_path):
+    first = str(tmp_path / "first.poprev")
+    second = str(tmp_path / "second.poprev")
+
+    poprev = make_poprev(tmp_path)
+    poprev.edit_drawing(0, 0, 3)
+    poprev.save_drawing_as(second)
+    poprev.new_drawing()
+    poprev.edit_drawing(0, 0, 1)
+    poprev.save_drawing_as(first)
+    with open(second, "rb") as file:
+        saved = file.read()
+
+    poprev.load_drawing(second)
+    assert poprev.undo()
+    assert poprev.get_save_name() == first
+    assert poprev.get_selection(0, 0) == 1
+
+    poprev.edit_drawing(1, 0, 2)
+    poprev.save_drawing()
+    with open(second, "rb") as file:
+        assert file.read() == saved
+
+
+def test_undo_new_drawing_restores_save_state(tmp_path):
+    filename = str(tmp_path / "drawing.poprev")
+
+    poprev = make_poprev(tmp_path)
+    poprev.edit_drawing(0, 0, 2)
+    poprev.save_drawing_as(filename)
+    poprev.new_drawing()
+    assert poprev.get_save_name() is None
+
+    assert poprev.undo()
+    assert poprev.get_save_name() == filename
+    assert not poprev.unsaved_changes()
+
+    assert poprev.redo()
+    assert poprev.get_save_name() is None
+
+
+def test_cached_load_does_not_decode_png(tmp_path, monkeypatch):
+    filename = str(tmp_path / "reference.png")
+    rng = np.random.default_rng(0)
+    cv2.imwrite(filename, rng.integers(0, 256, (300, 400, 3),
+                                       dtype=np.uint8))
+
+    poprev = make_poprev(tmp_path)
+    poprev.load_reference(filename)
+    expected = np.array(poprev.get_reference())
+    flush()
+
+    def decode(*args, **kwargs):
+        raise AssertionError("the reference was decoded")
+
+    monkeypatch.setattr(ImageFile.ImageFile, "load", decode)
+    monkeypatch.setattr(cv2, "imread", decode)
+    poprev = make_poprev(tmp_path)
+    poprev.load_reference(filename)
+    assert np.array_equal(poprev.get_reference(), expected)
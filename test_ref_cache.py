@@ -0,0 +1,28 @@
+import os
+import numpy as np
+
+from ref_cache import ReferenceCache, MEANS_SUFFIX, REF_SUFFIX
+
+
+def test_round_trip(tmp_path):
+    cache = ReferenceCache(str(tmp_path))
+    ref = np.arange(2 * 3 * 3, dtype=np.uint8).reshape(2, 3, 3)
+    means = np.ones((2, 3, 3), dtype=np.float32)
+    cache.store("key", ref, means)
+
+    loaded_ref, loaded_means = cache.load("key")
+    assert np.array_equal(loaded_ref, ref)
+    assert np.array_equal(loaded_means, means)
+
+
+def test_truncated_entry_is_removed(tmp_path):
+    cache = ReferenceCache(str(tmp_path))
+    cache.store("key", np.zeros((2, 3, 3), dtype=np.uint8),
+                np.zeros((2, 3, 3), dtype=np.float32))
+    ref_path = os.path.join(str(tmp_path), "key" + REF_SUFFIX)
+    open(ref_path, "wb").close()
+
+    assert cache.load("key") is None
+    assert not os.path.exists(ref_path)
+    assert not os.path.exists(os.path.join(str(tmp_path),
+                                           "key" + MEANS_SUFFIX))
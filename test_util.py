@@ -0,0 +1,43 @@
+import numpy as np
+
+from util import get_img_sector, get_sector_means, get_ref_tile_range, \
+    get_ref_view_start
+
+
+def test_sector_means_match_sectors():
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (61, 83, 3), dtype=np.uint8)
+
+    means = get_sector_means(img, 8, 6)
+    assert means.shape == (6, 8, 3)
+    for y in range(6):
+        for x in range(8):
+            sector = get_img_sector(img, x, y, 8, 6)
+            assert np.allclose(means[y, x], sector.mean(axis=(0, 1)))
+
+
+def test_sector_means_of_reference_smaller_than_grid():
+    # 50x60 pixels, divided into the default 128x112 grid
+    img = np.full((60, 50, 3), 7, dtype=np.uint8)
+
+    for inset in (0.0, 0.2):
+        means = get_sector_means(img, 128, 112, inset=inset)
+        assert means.shape == (112, 128, 3)
+        assert np.all(means == 7)
+
+
+def test_ref_tiles_in_view():
+    # 100 pixel sectors in tiles of 2, in a 300 pixel view
+    assert get_ref_view_start(0, 100, 128, 300) == 0
+    assert list(get_ref_tile_range(0, 100, 2, 128, 300)) == [0, 1]
+
+    start = get_ref_view_start(64, 100, 128, 300)
+    assert start == 6300
+    assert list(get_ref_tile_range(int(start), 100, 2, 128, 300)) == [31, 32]
+    assert list(get_ref_tile_range(int(start), 100, 2, 128, 300,
+                                   margin=1)) == [30, 31, 32, 33]
+
+    # references narrower than the view are centred in it
+    start = get_ref_view_start(0, 100, 1, 300)
+    assert start == -100
+    assert list(get_ref_tile_range(int(start), 100, 2, 1, 300)) == [0]
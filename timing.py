@@ -0,0 +1,167 @@
+"""
+A lightweight registry of how long each stage of the application takes.
+
+Timing is off unless the POPREV_TIMING environment variable is set to 1.
+When it is on, every call to a function wrapped with timed() is recorded,
+POPREV_TIMING_OVERLAY=1 shows rolling percentiles in the application's
+status bar, and every recorded call is written to the file named by
+POPREV_TIMING_TRACE (poprev-timing.json by default) on exit. Traces whose
+name ends in .csv are written as CSV, and anything else as JSON.
+"""
+import atexit
+import csv
+import functools
+import json
+import os
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, List
+
+from constants import TIMING_WINDOW, TIMING_TRACE_LIMIT
+
+
+def env_flag(name: str) -> bool:
+    """
+    :param name: name of an environment variable
+    :return: True if the environment variable is set to a value other than
+    "" or "0"
+    """
+    return os.environ.get(name, "0") not in ("", "0")
+
+
+def _percentile(samples: List[float], p: float) -> float:
+    """
+    :param samples: a sorted, non-empty list of samples
+    :param p: the percentile to get, from 0 to 100
+    :return: the nearest-rank percentile of the samples
+    """
+    rank = int(round(p / 100 * (len(samples) - 1)))
+    return samples[rank]
+
+
+class TimingRegistry(object):
+    """
+    Records the duration of named stages, keeping a rolling window of recent
+    durations of each stage and a trace of every call.
+    """
+
+    def __init__(self, enabled: bool = False, window: int = TIMING_WINDOW,
+                 trace_limit: int = TIMING_TRACE_LIMIT):
+        """
+        Initialise this TimingRegistry
+        :param enabled: whether to record anything
+        :param window: the number of recent durations of each stage used to
+        calculate its percentiles
+        :param trace_limit: the maximum number of calls kept in the trace.
+        The oldest calls are discarded first.
+        """
+        self.enabled = enabled
+        self._window = window
+        self._recent = {}  # type: Dict[str, deque]
+        self._trace = deque(maxlen=trace_limit)
+        self._start = time.perf_counter()
+
+    def record(self, name: str, start: float, duration: float) -> None:
+        """
+        Record a single call of a stage.
+        :param name: name of the stage
+        :param start: the time.perf_counter() value the call started at
+        :param duration: how long the call took, in seconds
+        """
+        recent = self._recent.get(name)
+        if recent is None:
+            recent = self._recent[name] = deque(maxlen=self._window)
+        recent.append(duration)
+        self._trace.append((name, start - self._start, duration))
+
+    def timed(self, name: str) -> Callable[[Callable], Callable]:
+        """
+        :param name: name of the stage
+        :return: a decorator that records every call of the function it
+        wraps as a call of the given stage, while this registry is enabled
+        """
+        def decorator(fn: Callable) -> Callable:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.record(name, start, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        :return: for each stage, the number of recent calls and their p50,
+        p99 and mean durations, in milliseconds
+        """
+        result = {}
+        for name, recent in self._recent.items():
+            samples = sorted(recent)
+            result[name] = {
+                "count": len(samples),
+                "p50_ms": _percentile(samples, 50) * 1000,
+                "p99_ms": _percentile(samples, 99) * 1000,
+                "mean_ms": sum(samples) / len(samples) * 1000
+            }
+        return result
+
+    def format_summary(self, names: Iterable[str]) -> str:
+        """
+        :param names: the stages to include
+        :return: a single line describing the recent p50 and p99 durations of
+        the given stages
+        """
+        summary = self.summary()
+        parts = []
+        for name in names:
+            if name in summary:
+                parts.append("{} {:.1f}/{:.1f} ms".format(
+                    name, summary[name]["p50_ms"], summary[name]["p99_ms"]))
+        return "p50/p99: " + "  ".join(parts)
+
+    def dump(self, filename: str) -> None:
+        """
+        Write every call in the trace, and the summary of each stage, to a
+        file. If filename ends in .csv, only the trace is written, as one
+        row per call. Otherwise both are written as JSON.
+        :param filename: the file to write to
+        """
+        if filename.lower().endswith(".csv"):
+            with open(filename, "w", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(["stage", "start_s", "duration_ms"])
+                for name, start, duration in self._trace:
+                    writer.writerow([name, "{:.6f}".format(start),
+                                     "{:.4f}".format(duration * 1000)])
+            return
+
+        with open(filename, "w") as file:
+            json.dump({
+                "summary": self.summary(),
+                "trace": [{"stage": name, "start_s": start,
+                           "duration_ms": duration * 1000}
+                          for name, start, duration in self._trace]
+            }, file)
+
+    def clear(self) -> None:
+        """
+        Discard everything recorded so far.
+        """
+        self._recent = {}
+        self._trace.clear()
+        self._start = time.perf_counter()
+
+
+registry = TimingRegistry(enabled=env_flag("POPREV_TIMING"))
+timed = registry.timed
+
+OVERLAY_ENABLED = registry.enabled and env_flag("POPREV_TIMING_OVERLAY")
+TRACE_FILE = os.environ.get("POPREV_TIMING_TRACE",
+                            "poprev-timing.json")
+
+if registry.enabled and TRACE_FILE:
+    atexit.register(registry.dump, TRACE_FILE)
@@ -0,0 +1,231 @@
+"""
+Tuning of automatic classification against drawings that have been checked
+by hand.
+
+A manifest lists finished drawings, the references they were drawn from,
+and the camera and screen setup each reference was taken with, one per line
+separated by tabs. Paths are relative to the manifest, and lines starting
+with # are ignored. If the setup is left out, references are grouped by
+their size, as calibration profiles are. e.g.
+
+    drawings/mario.poprev	refs/mario.jpg	rig-dmg
+    drawings/link.poprev	refs/link.jpg	rig-dmg
+    drawings/kirby.poprev	refs/kirby.jpg	phone-gbp
+
+Each reference is loaded, rectified and reduced to per-sector intensities
+once, for every sampling inset. Every combination of illumination
+correction and threshold placement is then scored on those intensities
+alone, across a process pool, and the configuration that classifies the
+most known pixels correctly is reported for each setup, e.g.
+
+    python3 tuner.py manifest.tsv --output configs
+
+A configuration written by --output is used by the application when it is
+named by the POPREV_CLASSIFIER environment variable.
+"""
+import argparse
+import itertools
+import os
+import sys
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from autoclassify import CORRECTIONS, ClassifierConfig, classify, \
+    correct_illumination, get_intensities
+from poprev import PopRev, read_drawing
+from constants import AUTO_INSETS, THRESHOLD_SHIFTS, THRESHOLD_SPREADS
+
+
+# a labelled drawing, reduced to what classification needs
+Sample = NamedTuple("Sample", [("selections", np.ndarray),
+                               ("colours", List[Tuple[int, int, int]]),
+                               ("intensities", Dict[float, np.ndarray])])
+
+# the samples of every setup, in each worker process
+_samples = {}  # type: Dict[str, List[Sample]]
+
+
+def read_manifest(filename: str) -> List[Tuple[str, str, str]]:
+    """
+    :param filename: a manifest, as described above
+    :return: the (drawing, reference, setup) of every line of the manifest.
+    The setup is empty where it was left out.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    entries = []
+    with open(filename) as file:
+        for number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = line.split("\t")
+            if len(fields) not in (2, 3):
+                raise ValueError("{}:{}: expected drawing, reference and "
+                                 "setup".format(filename, number))
+            drawing, reference = (os.path.join(directory, path)
+                                  for path in fields[:2])
+            setup = fields[2] if len(fields) == 3 else ""
+            entries.append((drawing, reference, setup))
+    return entries
+
+
+def load_samples(entries: Sequence[Tuple[str, str, str]],
+                 insets: Sequence[float]) -> Dict[str, List[Sample]]:
+    """
+    Load and reduce every labelled drawing of a manifest.
+    :param entries: the (drawing, reference, setup) of each drawing
+    :param insets: the sampling insets to reduce each reference with
+    :return: the samples of each setup, in manifest order
+    """
+    poprev = PopRev()
+    samples = OrderedDict()  # type: Dict[str, List[Sample]]
+    for drawing, reference, setup in entries:
+        selections, colours = read_drawing(drawing)
+        height, width = selections.shape
+        # load through the model, so that references are rectified and
+        # cached as they are when drawing
+        poprev.new_drawing(width, height, colours)
+        poprev.load_reference(reference)
+        ref = poprev.get_reference()
+        if ref is None:
+            print("{}\tunreadable".format(reference), file=sys.stderr)
+            continue
+
+        if not setup:
+            setup = "{}x{}".format(ref.shape[1], ref.shape[0])
+        intensities = {inset: get_intensities(ref, width, height, inset)
+                       for inset in insets}
+        samples.setdefault(setup, []).append(
+            Sample(selections, colours, intensities))
+    return samples
+
+
+def score(samples: Sequence[Sample], inset: float, correction: str,
+          shifts: Sequence[float], spreads: Sequence[float]) \
+        -> Tuple[np.ndarray, int]:
+    """
+    :param samples: the labelled drawings to score against
+    :param inset: the sampling inset to score
+    :param correction: the illumination correction to score
+    :param shifts: the threshold shifts to score
+    :param spreads: the threshold spreads to score
+    :return: (correct, total), where correct[i, j] is how many known pixels
+    are classified correctly with shifts[i] and spreads[j], and total is
+    how many known pixels there are
+    """
+    correct = np.zeros((len(shifts), len(spreads)), dtype=np.int64)
+    total = 0
+    for sample in samples:
+        known = sample.selections < len(sample.colours)
+        labels = sample.selections[known]
+        corrected = correct_illumination(sample.intensities[inset],
+                                         correction)[known]
+        total += labels.size
+        for (i, shift), (j, spread) in itertools.product(
+                enumerate(shifts), enumerate(spreads)):
+            classified = classify(corrected, sample.colours, shift, spread)
+            correct[i, j] += np.count_nonzero(classified == labels)
+    return correct, total
+
+
+def _init_worker(samples: Dict[str, List[Sample]]) -> None:
+    """
+    Give a worker process the samples of every setup, once, rather than
+    with each task
+    :param samples: the samples of every setup
+    """
+    global _samples
+    _samples = samples
+
+
+def _score_task(setup: str, inset: float, correction: str,
+                shifts: Sequence[float], spreads: Sequence[float]) \
+        -> Tuple[np.ndarray, int]:
+    """
+    Score part of the sweep in a worker process
+    :return: as score, for the samples of the given setup
+    """
+    return score(_samples[setup], inset, correction, shifts, spreads)
+
+
+def tune(samples: Dict[str, List[Sample]], insets: Sequence[float],
+         shifts: Sequence[float] = THRESHOLD_SHIFTS,
+         spreads: Sequence[float] = THRESHOLD_SPREADS,
+         workers: Optional[int] = None) \
+        -> Dict[str, Tuple[ClassifierConfig, float]]:
+    """
+    Sweep every configuration against the samples of each setup.
+    :param samples: the samples of every setup
+    :param insets: the sampling insets to sweep. Every sample must have
+    been reduced with each of them.
+    :param shifts: the threshold shifts to sweep
+    :param spreads: the threshold spreads to sweep
+    :param workers: the number of processes to sweep with. If not given,
+    one per core.
+    :return: the best configuration of each setup, and the fraction of
+    known pixels it classifies correctly
+    """
+    tasks = list(itertools.product(samples, insets, CORRECTIONS))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(samples,)) as executor:
+        futures = [executor.submit(_score_task, setup, inset, correction,
+                                   shifts, spreads)
+                   for setup, inset, correction in tasks]
+        results = [future.result() for future in futures]
+
+    best = {}  # type: Dict[str, Tuple[ClassifierConfig, float]]
+    for (setup, inset, correction), (correct, total) in zip(tasks, results):
+        i, j = np.unravel_index(np.argmax(correct), correct.shape)
+        accuracy = correct[i, j] / max(total, 1)
+        if setup not in best or accuracy > best[setup][1]:
+            config = ClassifierConfig(inset, correction, shifts[i],
+                                      spreads[j])
+            best[setup] = (config, accuracy)
+    return best
+
+
+def main(argv: List[str]) -> int:
+    """
+    Tune automatic classification, as described by the given command line
+    arguments.
+    :param argv: command line arguments, excluding the program name
+    :return: exit status
+    """
+    parser = argparse.ArgumentParser(
+        description="Find the best classifier configuration for each setup")
+    parser.add_argument("manifest",
+                        help="tab separated drawing, reference and setup")
+    parser.add_argument("--workers", type=int,
+                        help="number of processes to sweep with")
+    parser.add_argument("--output",
+                        help="directory to write the best configuration of "
+                             "each setup to, as <setup>.json")
+    args = parser.parse_args(argv)
+
+    baseline = ClassifierConfig()
+    insets = sorted(set(AUTO_INSETS) | {baseline.inset})
+    samples = load_samples(read_manifest(args.manifest), insets)
+    if not samples:
+        print("no readable references", file=sys.stderr)
+        return 1
+
+    best = tune(samples, insets, workers=args.workers)
+
+    if args.output is not None:
+        os.makedirs(args.output, exist_ok=True)
+    for setup, (config, accuracy) in best.items():
+        correct, total = score(samples[setup], baseline.inset,
+                               baseline.correction, [baseline.shift],
+                               [baseline.spread])
+        print("{}\t{} drawings\tdefault {:.2%}\tbest {:.2%}\t{}".format(
+            setup, len(samples[setup]), correct[0, 0] / max(total, 1),
+            accuracy, config))
+        if args.output is not None:
+            config.save(os.path.join(args.output, setup + ".json"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
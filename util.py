@@ -1,6 +1,16 @@
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import messagebox
-from typing import Tuple, Callable
+from typing import Tuple, Callable, Sequence
+
+from constants import PREVIEW_SCALE, PREVIEW_MAX_SIZE, SECTOR_WORKERS, \
+    SECTOR_BAND_PIXELS, REF_ZOOM_LEVELS, REF_TILE_SIZE
+
+
+# sums bands of large images in parallel. NumPy releases the GIL while
+# reducing, so the bands are summed on separate cores.
+_sector_executor = ThreadPoolExecutor(max_workers=SECTOR_WORKERS,
+                                      thread_name_prefix="poprev-sectors")
 
 
 def get_range_around(x: int, x_lower: int, x_upper: int, r: int)\
@@ -138,6 +148,227 @@ def get_img_extract(img: np.ndarray, x1: int, x2: int, y1: int, y2: int,
                int(x1 * xscale): int((x2 + 1) * xscale)]
 
 
+def get_sector_bounds(length: int, sectors: int) -> np.ndarray:
+    """
+    Get the boundaries of the sectors along one axis of an image, matching
+    the boundaries used by get_img_extract.
+    :param length: The length of the image along this axis, in pixels
+    :param sectors: How many sectors to divide this axis into
+    :return: An array of sectors + 1 pixel offsets, such that sector i spans
+            [bounds[i], bounds[i + 1])
+    """
+    scale = length / sectors
+    return (np.arange(sectors + 1) * scale).astype(int)
+
+
+def get_sector_spans(length: int, sectors: int, inset: float = 0.0) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the span of pixels sampled from each sector along one axis of an
+    image.
+    :param length: The length of the image along this axis, in pixels
+    :param sectors: How many sectors to divide this axis into
+    :param inset: The fraction of each sector to leave out at either end,
+            from 0 to 0.5. Every span keeps at least one pixel, so where
+            sectors are narrower than a pixel, spans overlap.
+    :return: Arrays (starts, ends) of pixel offsets, such that the span of
+            sector i is [starts[i], ends[i])
+    """
+    bounds = get_sector_bounds(length, sectors)
+    margins = (np.diff(bounds) * inset).astype(int)
+    starts = np.minimum(bounds[:-1] + margins, length - 1)
+    ends = np.minimum(np.maximum(bounds[1:] - margins, starts + 1), length)
+    return starts, ends
+
+
+def _sum_spans(arr: np.ndarray, starts: np.ndarray, ends: np.ndarray,
+               axis: int) -> np.ndarray:
+    """
+    Sum spans of an array along one axis.
+    :param arr: The array to sum
+    :param starts: The first index of each span, in increasing order
+    :param ends: The index after the last of each span, in increasing order
+    :param axis: The axis to sum along
+    :return: A uint64 array of the sum of each span along the given axis
+    """
+    if np.any(ends[:-1] > starts[1:]):
+        # spans overlap where sectors are narrower than a pixel, which
+        # reduceat cannot sum, so take differences of a running sum. The
+        # array is then no longer than the number of sectors along this
+        # axis, so the running sum is small.
+        totals = np.cumsum(arr, axis=axis, dtype=np.uint64)
+        zeros = np.zeros_like(totals.take([0], axis=axis))
+        totals = np.concatenate((zeros, totals), axis=axis)
+        return totals.take(ends, axis=axis) - totals.take(starts, axis=axis)
+
+    if np.array_equal(starts[1:], ends[:-1]) and ends[-1] == arr.shape[axis]:
+        # the spans tile the axis, so need only be split at their starts
+        return np.add.reduceat(arr, starts, axis=axis, dtype=np.uint64)
+
+    # sum alternately over each span and each gap after it
+    indices = np.empty(2 * len(starts), dtype=np.intp)
+    indices[0::2] = starts
+    indices[1::2] = ends
+    if indices[-1] >= arr.shape[axis]:
+        # reduceat always sums the last index to the end of the array
+        indices = indices[:-1]
+    sums = np.add.reduceat(arr, indices, axis=axis, dtype=np.uint64)
+    return sums.take(np.arange(0, sums.shape[axis], 2), axis=axis)
+
+
+def get_sector_means(img: np.ndarray, width: int, height: int,
+                     workers: int = SECTOR_WORKERS,
+                     inset: float = 0.0) -> np.ndarray:
+    """
+    Get the mean colour of every sector of an image, i.e. divide the image
+    into a width x height grid, and average the pixels in each cell.
+    Large images are divided into horizontal bands of whole sectors, which
+    are summed in parallel.
+    :param img: The image to get sector means of
+    :param width: How many sectors wide to divide the image into
+    :param height: How many sectors high to divide the image into
+    :param workers: The greatest number of bands to sum in parallel. Only
+            as many as there are CPUs are used, and the image is summed
+            whole, on the calling thread, if that is one.
+    :param inset: The fraction of each sector to leave out on every side,
+            e.g. to avoid sampling the blurred edges between pixels of a
+            photographed screen, from 0 to 0.5
+    :return: A float32 array of shape (height, width, channels) such that
+            means[y, x] is the mean colour of sector (x, y)
+    """
+    x_starts, x_ends = get_sector_spans(img.shape[1], width, inset)
+    y_starts, y_ends = get_sector_spans(img.shape[0], height, inset)
+    sums = np.empty((height, width) + img.shape[2:], dtype=np.uint64)
+
+    def sum_band(first: int, last: int) -> None:
+        """
+        Sum a band of whole rows of sectors into sums
+        :param first: The first row of sectors in the band
+        :param last: The row of sectors after the last one in the band
+        """
+        # each band is a view of the image, and is summed straight into its
+        # rows of sums, so the image is never copied. Whole rows of
+        # sectors are summed first, so that only a (sector rows x image
+        # width) intermediate is ever allocated.
+        top = y_starts[first]
+        band = img[top:y_ends[last - 1]]
+        rows = _sum_spans(band, y_starts[first:last] - top,
+                          y_ends[first:last] - top, 0)
+        sums[first:last] = _sum_spans(rows, x_starts, x_ends, 1)
+
+    # bands beyond the number of CPUs are not summed in parallel, so only
+    # add overhead
+    bands = min(workers, SECTOR_WORKERS, height,
+                img.shape[0] * img.shape[1] // SECTOR_BAND_PIXELS)
+    if bands <= 1 or img.shape[0] < height:
+        sum_band(0, height)
+    else:
+        edges = np.linspace(0, height, bands + 1).astype(int)
+        # list() waits for every band, and raises any error from one
+        list(_sector_executor.map(sum_band, edges[:-1], edges[1:]))
+
+    counts = np.outer(y_ends - y_starts, x_ends - x_starts)
+    counts = counts.reshape(counts.shape + (1,) * (img.ndim - 2))
+
+    return (sums / counts).astype(np.float32)
+
+
+def make_palette(colours: Sequence[Tuple[int, int, int]], size: int,
+                 unknown: Tuple[int, int, int]) -> np.ndarray:
+    """
+    Build a lookup table mapping colour indices to RGB values.
+    :param colours: the RGB values of the known colours, in index order
+    :param size: the number of entries in the lookup table
+    :param unknown: the RGB value of every index without a known colour
+    :return: a uint8 array of shape (size, 3)
+    """
+    palette = np.empty((size, 3), dtype=np.uint8)
+    palette[:] = unknown
+    palette[:len(colours)] = colours
+    return palette
+
+
+def get_preview_scale(width: int, height: int) -> int:
+    """
+    Get how many screen pixels wide each pixel of a drawing is shown in the
+    drawing preview.
+    :param width: The width of the drawing
+    :param height: The height of the drawing
+    :return: PREVIEW_SCALE, or less if the preview would otherwise be more
+            than PREVIEW_MAX_SIZE pixels across
+    """
+    return max(1, min(PREVIEW_SCALE, PREVIEW_MAX_SIZE // max(width, height)))
+
+
+def get_ref_cell_size(view: int, zoom: int) -> int:
+    """
+    :param view: The length of the reference viewer along an axis
+    :param zoom: The index into REF_ZOOM_LEVELS of the zoom level
+    :return: The length each sector of the reference is drawn at along the
+            axis, at the given zoom level
+    """
+    return max(1, view // (2 * REF_ZOOM_LEVELS[zoom] + 1))
+
+
+def get_ref_tile_cells(cell: int) -> int:
+    """
+    :param cell: The length each sector is drawn at along an axis
+    :return: How many sectors each tile of the reference viewer is along
+            the axis
+    """
+    return max(1, REF_TILE_SIZE // cell)
+
+
+def get_ref_extent(length: int, view: int) -> Tuple[int, int]:
+    """
+    :param length: The length of the reference along an axis, as drawn in
+            the reference viewer
+    :param view: The length of the reference viewer along the axis
+    :return: The range of canvas coordinates that can be scrolled over
+            along the axis. References shorter than the viewer are centred
+            in it.
+    """
+    if length >= view:
+        return 0, length
+    start = -((view - length) // 2)
+    return start, start + view
+
+
+def get_ref_view_start(position: int, cell: int, count: int,
+                       view: int) -> float:
+    """
+    :param position: The sector the reference viewer is scrolled to
+    :param cell: The length each sector is drawn at along an axis
+    :param count: The number of sectors along the axis
+    :param view: The length of the reference viewer along the axis
+    :return: The canvas coordinate of the start of the reference viewer
+            along the axis, centred on the sector as far as the extent of
+            the reference allows
+    """
+    start, end = get_ref_extent(count * cell, view)
+    return max(start, min(end - view, (position + 0.5) * cell - view / 2))
+
+
+def get_ref_tile_range(start: int, cell: int, tile: int, count: int,
+                       view: int, margin: int = 0) -> range:
+    """
+    :param start: The canvas coordinate of the start of the reference
+            viewer along an axis
+    :param cell: The length each sector is drawn at along the axis
+    :param tile: How many sectors each tile is along the axis
+    :param count: The number of sectors along the axis
+    :param view: The length of the reference viewer along the axis
+    :param margin: How many tiles beyond those in view to include
+    :return: The indices along the axis of the tiles in view, and any within
+            margin tiles of them
+    """
+    length = tile * cell
+    last = (count - 1) // tile
+    first = max(0, min(last, start // length - margin))
+    end = max(0, min(last, (start + view - 1) // length + margin))
+    return range(first, end + 1)
+
+
 def ask_save_before_doing(save_fn: Callable[[], None],
                           do_fn: Callable[[], None],
                           title: str, message: str) -> None: